@@ -0,0 +1,253 @@
+"""
+Benchmarks for the six cbor_json conversions on generated corpora.
+
+Usage (from the repository root):
+    python benchmarks/bench_conversions.py                  # just run
+    python benchmarks/bench_conversions.py --save           # run and store baseline
+    python benchmarks/bench_conversions.py --compare        # run and compare
+    python benchmarks/bench_conversions.py --corpus wide_records --quick
+
+For every corpus and conversion the script reports time per call, throughput
+(in megabytes of CBOR per second) and tracemalloc peak memory. With --compare,
+conversions that became slower than the baseline by more than --tolerance
+are flagged, and the exit code is 1.
+"""
+
+import argparse
+from datetime import datetime, date, timezone, timedelta
+import decimal
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor_json  # noqa: E402
+from cbor_json import custom_objects  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+# MARK: Corpora
+
+
+def wide_records(num=2000, width=40):
+    return [
+        {
+            f"field_{f:02}": (r * width + f) if f % 2 else f"value {r} {f}"
+            for f in range(width)
+        }
+        for r in range(num)
+    ]
+
+
+def deep_nesting(depth=50, breadth=50):
+    res: list = []
+    for level in range(depth):
+        res = [{"level": level, "payload": list(range(breadth)), "child": res}]
+    return res
+
+
+def binary_heavy(num=200, size=64 * 1024):
+    return [
+        {"name": f"blob {i}", "small": os.urandom(16), "data": os.urandom(size)}
+        for i in range(num)
+    ]
+
+
+class BenchPoint(cbor_json.SerializableToCbor):
+    cbor_cc_classtag = "bench-point"
+    cbor_cc_descr = "Benchmark point (x, y, label)"
+
+    def __init__(self, x=None, y=None, label=None):
+        self.x, self.y, self.label = x, y, label
+
+    def get_cbor_cc_values(self):
+        return [self.x, self.y, self.label]
+
+    def put_cbor_cc_values(self, *values):
+        self.x, self.y, self.label = values
+
+
+cbor_json.register_custom_class(BenchPoint)
+
+
+def custom_object_heavy(num=5000):
+    return [
+        {
+            "point": BenchPoint(i * 0.5, i * 1.5, f"p{i}"),
+            "hash": custom_objects.HashSha256(str(i).encode()),
+            "crc": custom_objects.HashCrc32(str(i).encode()),
+        }
+        for i in range(num)
+    ]
+
+
+def dataframe(rows):
+    def _gen():
+        import pandas as pd  # type: ignore
+
+        frame = pd.DataFrame(
+            {
+                "id": list(range(rows)),
+                "name": [f"name {i}" for i in range(rows)],
+                "score": [i * 0.25 for i in range(rows)],
+                "flag": [bool(i % 2) for i in range(rows)],
+            }
+        )
+        return custom_objects.DataFrameSerialized(frame)
+
+    return _gen
+
+
+def typed_scalars(num=5000):
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "ts": start + timedelta(seconds=i * 37, microseconds=i),
+            "day": date(2020, 1, 1) + timedelta(days=i % 1000),
+            "amount": decimal.Decimal(i) / 100,
+            "id": uuid.UUID(int=i * 7919),
+        }
+        for i in range(num)
+    ]
+
+
+CORPORA = {
+    "wide_records": wide_records,
+    "deep_nesting": deep_nesting,
+    "binary_heavy": binary_heavy,
+    "custom_objects": custom_object_heavy,
+    "dataframe_1k": dataframe(1_000),
+    "dataframe_10k": dataframe(10_000),
+    "dataframe_100k": dataframe(100_000),
+    "typed_scalars": typed_scalars,
+}
+
+
+# MARK: Running
+
+
+def _conversions(native):
+    """
+    Prepares inputs of all six conversions.
+    Returns {conversion name: (function, argument)}
+    """
+    cbor = cbor_json.cbor_from_native(native)
+    jsonable = cbor_json.jsonable_from_native(native)
+    return {
+        "cbor_from_native": (cbor_json.cbor_from_native, native),
+        "native_from_cbor": (cbor_json.native_from_cbor, cbor),
+        "jsonable_from_native": (cbor_json.jsonable_from_native, native),
+        "native_from_jsonable": (cbor_json.native_from_jsonable, jsonable),
+        "jsonable_from_cbor": (cbor_json.jsonable_from_cbor, cbor),
+        "cbor_from_jsonable": (cbor_json.cbor_from_jsonable, jsonable),
+    }, len(cbor)
+
+
+def _time_call(func, arg, repeat, min_time):
+    timer = timeit.Timer(lambda: func(arg))
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _peak_memory(func, arg):
+    tracemalloc.start()
+    try:
+        func(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run(corpus_names, repeat=5, min_time=0.2):
+    """
+    Runs benchmarks.
+    :return: {corpus: {conversion: {"seconds", "mb_per_s", "peak_bytes"}}}
+    """
+    results: dict = {}
+    for corpus_name in corpus_names:
+        try:
+            native = CORPORA[corpus_name]()
+        except ImportError as exc:
+            print(f"{corpus_name}: skipped ({exc})")
+            continue
+        conversions, cbor_size = _conversions(native)
+        corpus_res = results[corpus_name] = {}
+        print(f"{corpus_name} ({cbor_size / 1e6:.2f} MB of CBOR)")
+        for conv_name, (func, arg) in conversions.items():
+            seconds = _time_call(func, arg, repeat, min_time)
+            peak = _peak_memory(func, arg)
+            corpus_res[conv_name] = {
+                "seconds": seconds,
+                "mb_per_s": cbor_size / seconds / 1e6,
+                "peak_bytes": peak,
+            }
+            print(
+                f"  {conv_name:22} {seconds * 1e3:10.3f} ms "
+                f"{cbor_size / seconds / 1e6:9.2f} MB/s "
+                f"{peak / 1e6:9.2f} MB peak"
+            )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results to the baseline.
+    :return: list of regression descriptions
+    """
+    regressions = []
+    for corpus_name, corpus_res in results.items():
+        for conv_name, res in corpus_res.items():
+            base = baseline.get(corpus_name, {}).get(conv_name)
+            if base is None:
+                continue
+            for metric in ("seconds", "peak_bytes"):
+                ratio = res[metric] / base[metric] if base[metric] else 1.0
+                if ratio > 1.0 + tolerance:
+                    regressions.append(
+                        f"{corpus_name}/{conv_name}: {metric} {ratio:.2f}x baseline"
+                    )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA))
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="store results as baseline")
+    parser.add_argument("--compare", action="store_true", help="compare to baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions")
+    args = parser.parse_args(argv)
+
+    results = run(
+        args.corpus or list(CORPORA),
+        repeat=2 if args.quick else 5,
+        min_time=0.05 if args.quick else 0.2,
+    )
+
+    exit_code = 0
+    if args.compare:
+        with open(args.baseline, encoding="utf-8") as base_f:
+            regressions = compare(results, json.load(base_f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            exit_code = 1
+        else:
+            print("No regressions")
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as base_f:
+            json.dump(results, base_f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
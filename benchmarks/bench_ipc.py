@@ -0,0 +1,98 @@
+"""
+Inter-process throughput benchmark: multiprocessing.Queue (pickle through a
+pipe) against cbor_json.SharedMemoryQueue (CBOR in shared memory).
+
+Usage (from the repository root):
+    python benchmarks/bench_ipc.py                          # all corpora
+    python benchmarks/bench_ipc.py --corpus binary_heavy --messages 50
+
+The main process puts the same value in a queue a number of times, a child
+process gets and decodes every value. The script reports messages and
+megabytes (of CBOR) per second from the first put to the last get. The last
+two lines of every corpus pass already encoded CBOR, which shows the cost of
+the transport without the conversions.
+"""
+
+import argparse
+from functools import partial
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor_json  # noqa: E402
+from bench_conversions import CORPORA  # noqa: E402
+
+
+def _consume(in_queue, done, messages, encoded):
+    get = in_queue.get_cbor if encoded else in_queue.get
+    for _ in range(messages):
+        get()
+    done.put(True)
+
+
+def _throughput(in_queue, value, messages: int, encoded: bool) -> float:
+    """
+    :param encoded: value is CBOR to pass with put_cbor and get_cbor
+    :return: seconds to pass the value messages times to a child process
+    """
+    done = multiprocessing.Queue()
+    consumer = multiprocessing.Process(
+        target=_consume, args=(in_queue, done, messages, encoded)
+    )
+    consumer.start()
+    put = in_queue.put_cbor if encoded else in_queue.put
+    started = time.perf_counter()
+    for _ in range(messages):
+        put(value)
+    done.get()
+    seconds = time.perf_counter() - started
+    consumer.join()
+    return seconds
+
+
+def run(corpus_names, messages: int):
+    print(f"Python {sys.version.split()[0]}, {os.cpu_count()} CPUs")
+    for corpus_name in corpus_names:
+        try:
+            native = CORPORA[corpus_name]()
+        except ImportError as exc:
+            print(f"{corpus_name}: skipped ({exc})")
+            continue
+        cbor = cbor_json.cbor_from_native(native, cbor_json.FAST_PROFILE)
+        cbor_size = len(cbor)
+        print(f"{corpus_name} ({cbor_size / 1e6:.2f} MB of CBOR)")
+        shm_queue = partial(
+            cbor_json.SharedMemoryQueue, capacity=max(64 << 20, 4 * cbor_size)
+        )
+        transports = {
+            # name: (queue class, value, put_cbor/get_cbor)
+            "multiprocessing.Queue": (multiprocessing.Queue, native, False),
+            "SharedMemoryQueue": (shm_queue, native, False),
+            "  CBOR bytes, pickled": (multiprocessing.Queue, cbor, False),
+            "  CBOR bytes, put_cbor": (shm_queue, cbor, True),
+        }
+        for name, (make, value, encoded) in transports.items():
+            in_queue = make()
+            try:
+                seconds = _throughput(in_queue, value, messages, encoded)
+            finally:
+                in_queue.close()
+            print(
+                f"  {name:22} {messages / seconds:10.1f} msg/s "
+                f"{messages * cbor_size / seconds / 1e6:9.2f} MB/s"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA))
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args(argv)
+    run(args.corpus or list(CORPORA), args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Encoder profile benchmark: cbor_from_native with CANONICAL_PROFILE,
+DETERMINISTIC_PROFILE and FAST_PROFILE.
+
+Usage (from the repository root):
+    python benchmarks/bench_profiles.py                     # all corpora
+    python benchmarks/bench_profiles.py --corpus big_map --repeat 10
+
+For every corpus the script reports the best time per call of every profile
+and its ratio to the canonical one. big_map is one map of 100k string keys,
+the case DETERMINISTIC_PROFILE is meant to be cheaper than canonical for.
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor_json  # noqa: E402
+from bench_conversions import CORPORA  # noqa: E402
+
+
+def big_map(num=100_000):
+    return {f"key {i:06}": i for i in range(num)}
+
+
+PROFILE_CORPORA = {"big_map": big_map, **CORPORA}
+PROFILES = ("CANONICAL_PROFILE", "DETERMINISTIC_PROFILE", "FAST_PROFILE")
+
+
+def run(corpus_names, repeat: int):
+    print(f"Python {sys.version.split()[0]}")
+    for corpus_name in corpus_names:
+        try:
+            native = PROFILE_CORPORA[corpus_name]()
+        except ImportError as exc:
+            print(f"{corpus_name}: skipped ({exc})")
+            continue
+        print(corpus_name)
+        canonical = None
+        for profile_name in PROFILES:
+            profile = getattr(cbor_json, profile_name)
+            seconds = min(
+                timeit.repeat(
+                    lambda: cbor_json.cbor_from_native(native, profile=profile),
+                    number=1,
+                    repeat=repeat,
+                )
+            )
+            canonical = canonical or seconds
+            print(
+                f"  {profile_name:22} {seconds * 1000:9.2f} ms"
+                f"  x{seconds / canonical:.2f} of canonical"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", action="append", choices=sorted(PROFILE_CORPORA))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    run(args.corpus or sorted(PROFILE_CORPORA), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Multi-threaded scaling benchmark for cbor_from_native and native_from_cbor.
+
+Usage (from the repository root):
+    python benchmarks/bench_threads.py                      # 1, 2, 4, ... threads
+    python benchmarks/bench_threads.py --threads 1 --threads 8 --corpus wide_records
+
+Every thread converts the same corpus in a loop for a fixed time. The script
+reports total throughput (calls per second) and speedup against one thread.
+With the GIL the speedup stays around 1. Conversions take no locks, so a
+free-threaded build (3.13t+, PYTHON_GIL=0) is not held back by this package,
+but how far the speedup grows there has to be measured on such a build.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor_json  # noqa: E402
+from bench_conversions import CORPORA  # noqa: E402
+
+
+def _throughput(func, arg, threads: int, duration: float) -> float:
+    """
+    :return: total calls per second of func(arg) in all threads
+    """
+    start_barrier = threading.Barrier(threads + 1)
+    stop = threading.Event()
+    counts = [0] * threads
+
+    def worker(idx):
+        start_barrier.wait()
+        count = 0
+        while not stop.is_set():
+            func(arg)
+            count += 1
+        counts[idx] = count
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    time.sleep(duration)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def run(corpus_names, thread_counts, duration):
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(
+        f"Python {sys.version.split()[0]}, GIL {'enabled' if gil_enabled else 'disabled'}"
+        f", {os.cpu_count()} CPUs"
+    )
+    for corpus_name in corpus_names:
+        try:
+            native = CORPORA[corpus_name]()
+        except ImportError as exc:
+            print(f"{corpus_name}: skipped ({exc})")
+            continue
+        cbor = cbor_json.cbor_from_native(native)
+        print(f"{corpus_name} ({len(cbor) / 1e6:.2f} MB of CBOR)")
+        for func, arg in (
+            (cbor_json.cbor_from_native, native),
+            (cbor_json.native_from_cbor, cbor),
+        ):
+            single = None
+            for threads in thread_counts:
+                calls_per_s = _throughput(func, arg, threads, duration)
+                single = single or calls_per_s
+                print(
+                    f"  {func.__name__:18} {threads:3} threads "
+                    f"{calls_per_s:10.1f} calls/s  x{calls_per_s / single:.2f}"
+                )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA))
+    parser.add_argument("--threads", action="append", type=int)
+    parser.add_argument("--duration", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    max_threads = os.cpu_count() or 1
+    thread_counts = args.threads or sorted(
+        {1 << i for i in range(max_threads.bit_length())} | {max_threads}
+    )
+    run(
+        args.corpus or ["wide_records", "custom_objects", "typed_scalars"],
+        thread_counts,
+        args.duration,
+    )
+
+
+if __name__ == "__main__":
+    main()
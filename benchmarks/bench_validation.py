@@ -0,0 +1,64 @@
+"""
+Validation benchmark: validate_cbor and validate_jsonable against the full
+native_from_cbor and native_from_jsonable.
+
+Usage (from the repository root):
+    python benchmarks/bench_validation.py                   # all corpora
+    python benchmarks/bench_validation.py --corpus wide_records --repeat 10
+
+For every corpus the script reports the best time per call of decoding and
+validation, and the speedup of validation (below 1 when it is slower).
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cbor_json  # noqa: E402
+from bench_conversions import CORPORA  # noqa: E402
+
+# deep_nesting is deeper than the default limit
+LIMITS = cbor_json.ValidationLimits(max_depth=1000)
+
+
+def _best_time(func, arg, repeat: int) -> float:
+    return min(timeit.repeat(lambda: func(arg), number=1, repeat=repeat))
+
+
+def run(corpus_names, repeat: int):
+    print(f"Python {sys.version.split()[0]}")
+    for corpus_name in corpus_names:
+        try:
+            native = CORPORA[corpus_name]()
+        except ImportError as exc:
+            print(f"{corpus_name}: skipped ({exc})")
+            continue
+        print(corpus_name)
+        cbor = cbor_json.cbor_from_native(native)
+        jsonable = cbor_json.jsonable_from_native(native)
+        for decode, validate, data in (
+            (cbor_json.native_from_cbor, cbor_json.validate_cbor, cbor),
+            (cbor_json.native_from_jsonable, cbor_json.validate_jsonable, jsonable),
+        ):
+            decode_s = _best_time(decode, data, repeat)
+            validate_s = _best_time(lambda val: validate(val, LIMITS), data, repeat)
+            print(
+                f"  {validate.__name__:18} {validate_s * 1000:9.2f} ms"
+                f"  {decode.__name__:21} {decode_s * 1000:9.2f} ms"
+                f"  speedup x{decode_s / validate_s:.2f}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", action="append", choices=sorted(CORPORA))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    run(args.corpus or list(CORPORA), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
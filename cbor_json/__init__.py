@@ -3,6 +3,9 @@ Three-way conversion between "native" Python data representation, CBOR, and JSON
 See README.md for details.
 """
 
+from importlib import import_module
+from typing import TYPE_CHECKING
+
 from ._cbor_json_codecs import (  # noqa: F401
     native_from_cbor,
     cbor_from_native,
@@ -10,6 +13,7 @@ from ._cbor_json_codecs import (  # noqa: F401
     native_from_jsonable,
     jsonable_from_cbor,
     cbor_from_jsonable,
+    write_cbor_from_native,
     base58_encode,
     base58_decode,
 )
@@ -18,4 +22,106 @@ from ._custom_objects_base import (  # noqa: F401
     UnrecognizedCustomObject,
     register_custom_class,
 )
-from . import custom_objects  # noqa: F401
+from ._instrumentation import ConversionStats, instrumented  # noqa: F401
+from ._profiles import (  # noqa: F401
+    EncoderProfile,
+    CANONICAL_PROFILE,
+    FAST_PROFILE,
+    DETERMINISTIC_PROFILE,
+    RawCbor,
+)
+from ._decode_cache import DecodeCache, FrozenJsonDict  # noqa: F401
+from ._delta import cbor_delta, apply_cbor_delta  # noqa: F401
+from ._incremental import IncrementalDecoder  # noqa: F401
+from ._interning import StringInterner  # noqa: F401
+from ._streaming import StreamedMap  # noqa: F401
+from ._validation import (  # noqa: F401
+    ValidationLimits,
+    ValidationError,
+    validate_cbor,
+    validate_jsonable,
+)
+
+if TYPE_CHECKING:
+    from ._blob_store import BlobStore, DirectoryBlobStore  # noqa: F401
+    from ._encode_cache import EncodeCache  # noqa: F401
+    from ._container import ContainerWriter, ContainerReader  # noqa: F401
+    from ._record_store import RecordStore  # noqa: F401
+    from ._parallel import (  # noqa: F401
+        native_from_cbor_parallel,
+        jsonable_from_cbor_parallel,
+    )
+    from ._sizing import cbor_size_of, json_size_of, cbor_batches  # noqa: F401
+    from ._content_hash import content_hash, DigestCache  # noqa: F401
+    from ._shm_queue import SharedMemoryQueue  # noqa: F401
+    from ._json_text import native_from_json, json_from_native  # noqa: F401
+    from . import custom_objects  # noqa: F401
+
+# Names imported on first access, to keep "import cbor_json" fast
+_LAZY_NAMES = {
+    "BlobStore": "._blob_store",
+    "DirectoryBlobStore": "._blob_store",
+    "EncodeCache": "._encode_cache",
+    "ContainerWriter": "._container",
+    "ContainerReader": "._container",
+    "RecordStore": "._record_store",
+    "native_from_cbor_parallel": "._parallel",
+    "jsonable_from_cbor_parallel": "._parallel",
+    "cbor_size_of": "._sizing",
+    "json_size_of": "._sizing",
+    "cbor_batches": "._sizing",
+    "content_hash": "._content_hash",
+    "DigestCache": "._content_hash",
+    "SharedMemoryQueue": "._shm_queue",
+    "native_from_json": "._json_text",
+    "json_from_native": "._json_text",
+    "custom_objects": ".custom_objects",
+}
+
+__all__ = [
+    "native_from_cbor",
+    "cbor_from_native",
+    "jsonable_from_native",
+    "native_from_jsonable",
+    "jsonable_from_cbor",
+    "cbor_from_jsonable",
+    "write_cbor_from_native",
+    "base58_encode",
+    "base58_decode",
+    "SerializableToCbor",
+    "UnrecognizedCustomObject",
+    "register_custom_class",
+    "ConversionStats",
+    "instrumented",
+    "EncoderProfile",
+    "CANONICAL_PROFILE",
+    "FAST_PROFILE",
+    "DETERMINISTIC_PROFILE",
+    "RawCbor",
+    "DecodeCache",
+    "FrozenJsonDict",
+    "cbor_delta",
+    "apply_cbor_delta",
+    "IncrementalDecoder",
+    "StringInterner",
+    "StreamedMap",
+    "ValidationLimits",
+    "ValidationError",
+    "validate_cbor",
+    "validate_jsonable",
+    *_LAZY_NAMES,
+]
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_NAMES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = import_module(module_name, __name__)
+    value = module if name == "custom_objects" else getattr(module, name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
@@ -0,0 +1,113 @@
+"""
+Out-of-line storage for large binaries in the jsonable form.
+
+Classes:
+- BlobStore - abstract base class for blob stores
+- DirectoryBlobStore - content-addressed blob store in a sidecar directory
+
+When a blob store is passed to jsonable_from_native or jsonable_from_cbor, byte
+strings and MIME payloads longer than the store's threshold are written to the
+store, and the jsonable form gets a reference instead of the base64 text:
+  {"$type": "binary-ref", "$value": "<key>", "$length": <length>}
+  {"$type": "mime-ref", "$value": "<key>", "$length": <length>}
+Pass the same store to native_from_jsonable or cbor_from_jsonable to resolve them.
+Binary references are resolved lazily: native_from_jsonable reads a blob when
+it makes the bytes object, and cbor_from_jsonable writes it to the output
+straight from the store (a memory-mapped file for DirectoryBlobStore) while
+encoding. MIME references are read to build the Message.
+"""
+
+from abc import ABC, abstractmethod
+from hashlib import sha256
+import mmap
+import os
+import tempfile
+
+
+class BlobStore(ABC):
+    """
+    Abstract base class for blob stores.
+    Implement put and get methods.
+    """
+
+    threshold: int = 4096  # Binaries longer than this go to the store
+
+    @abstractmethod
+    def put(self, data: bytes) -> str:
+        """
+        Saves data to the store.
+        :param data: binary to save
+        :return: key to put into the "$value" of the reference
+        """
+
+    @abstractmethod
+    def get(self, key: str, length: int) -> bytes:
+        """
+        Loads data from the store.
+        :param key: key returned by the put method
+        :param length: expected length of the data
+        :return: stored binary
+        """
+
+    def open(self, key: str, length: int):
+        """
+        Gives the stored data without reading it into a bytes object, where the
+        store can. The default implementation calls get.
+        :param key: key returned by the put method
+        :param length: expected length of the data
+        :return: bytes-like object; closed by the caller if it has a close method
+        """
+        return self.get(key, length)
+
+
+class DirectoryBlobStore(BlobStore):
+    """
+    Content-addressed blob store. Blobs are files in a directory, named by their
+    SHA-256 hexdigest. Equal binaries are stored once.
+    """
+
+    def __init__(self, path: str, threshold: int | None = None):
+        """
+        :param path: directory for blobs; created if it does not exist
+        :param threshold: binaries longer than this go to the store
+        """
+        self.path = path
+        if threshold is not None:
+            self.threshold = threshold
+        os.makedirs(path, exist_ok=True)
+
+    def _blob_path(self, key: str) -> str:
+        if len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            raise ValueError(f'Invalid blob key "{key}"')
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, data: bytes) -> str:
+        key = sha256(data).hexdigest()
+        blob_path = self._blob_path(key)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(blob_path))
+            try:
+                with os.fdopen(fd, "wb") as tmp_f:
+                    tmp_f.write(data)
+                os.replace(tmp_path, blob_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return key
+
+    def get(self, key: str, length: int) -> bytes:
+        with open(self._blob_path(key), "rb") as blob_f:
+            res = blob_f.read()
+        if len(res) != length:
+            raise ValueError(f'Blob "{key}" has length {len(res)}, expected {length}')
+        return res
+
+    def open(self, key: str, length: int):
+        with open(self._blob_path(key), "rb") as blob_f:
+            size = os.fstat(blob_f.fileno()).st_size
+            if size != length:
+                raise ValueError(f'Blob "{key}" has length {size}, expected {length}')
+            if length == 0:
+                return b""
+            return mmap.mmap(blob_f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -2,45 +2,129 @@
 The implementation of Native <-> CBOR <-> JSONable conversions
 """
 
-from datetime import datetime, date, timezone, timedelta
+from __future__ import annotations
+
+from datetime import datetime, date, timedelta
+from collections.abc import Iterable, Iterator, Sequence
+from functools import partial
+from typing import Any, BinaryIO, TYPE_CHECKING
 import base64
-from uuid import UUID
-from fractions import Fraction
-import decimal
+from binascii import a2b_base64
 import re
-from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
-from email.message import Message
 from warnings import warn
 
 import cbor2
-import base58
 
 from ._custom_objects_base import (
     SerializableToCbor,
     UnrecognizedCustomObject,
-    CUSTOM_CLASSES_BY_CLASSTAG,
+    _custom_class_by_classtag,
+)
+from ._instrumentation import _convert
+from ._passthrough import _passthrough_loads
+from ._lazy import _loaded_class, _imported_class, _LoadedClasses
+from ._profiles import (
+    EncoderProfile,
+    CANONICAL_PROFILE,
+    RawCbor,
+    _BlobRef,
+    _sorted_container,
+)
+from ._decode_cache import DecodeCache, FrozenJsonDict
+from ._streaming import StreamedMap, _Stream
+
+if TYPE_CHECKING:
+    from ._blob_store import BlobStore
+    from ._interning import StringInterner
+    from ._encode_cache import EncodeCache, _Memo
+
+# Types supported as is, whose modules are imported only when used
+_LAZY_SCALARS = (
+    "fractions.Fraction",
+    "decimal.Decimal",
+    "uuid.UUID",
+    "ipaddress.IPv4Address",
+    "ipaddress.IPv4Network",
+    "ipaddress.IPv6Address",
+    "ipaddress.IPv6Network",
 )
+_lazy_native_scalars = _LoadedClasses(*_LAZY_SCALARS, "email.message.Message")
+_lazy_cborable_scalars = _LoadedClasses(*_LAZY_SCALARS)
+
+
+# MARK: Binary payloads
+
+
+_LEADING_NEWLINES = re.compile(rb"\n*")
+_BASE64_BLOCK = 57 * 1024  # whole lines of base64.encodebytes
+
+
+def _mime_payload(data) -> str:
+    """
+    Payload of a MIME message made of raw bytes, as Message.set_payload stores
+    it. Leading newlines are skipped through a memoryview slice, so the bytes
+    are copied only once, by the decoding itself.
+    """
+    start = _LEADING_NEWLINES.match(data).end()  # type: ignore[union-attr]
+    return str(memoryview(data)[start:], "ascii", "surrogateescape")
+
+
+def _base64_text(data) -> str:
+    """
+    base64.encodebytes of the data as text, without the trailing newline.
+    Encodes blocks of a memoryview, so that neither the whole encoded bytes
+    nor a stripped copy of the text are ever made.
+    """
+    view = memoryview(data)
+    parts = [
+        str(base64.encodebytes(view[pos : pos + _BASE64_BLOCK]), "ascii")
+        for pos in range(0, len(view), _BASE64_BLOCK)
+    ]
+    if parts:
+        parts[-1] = parts[-1][:-1]
+    return "".join(parts)
 
 
 # MARK: Native<->CBORable
 
 
-def _transform_collection(src, encountered_ids, conv_func):
-    res = None
+def _transform_collection(
+    src, encountered_ids, conv_func, frozen: bool = False, key_hook=None
+):
+    """
+    :param key_hook: function to apply to converted map keys
+    """
+    res: Any = None
+    key_func = conv_func
+    if key_hook is not None:
+        key_func = lambda k, encountered_ids: key_hook(  # noqa: E731
+            conv_func(k, encountered_ids)
+        )
 
-    if isinstance(src, list):
+    if frozen and isinstance(src, (list, tuple)):
+        res = tuple(conv_func(el, encountered_ids) for el in src)
+    elif frozen and isinstance(src, (dict, cbor2.FrozenDict)):
+        res = cbor2.FrozenDict(
+            [
+                (key_func(k, encountered_ids), conv_func(v, encountered_ids))
+                for k, v in src.items()
+            ]
+        )
+    elif frozen and isinstance(src, (set, frozenset)):
+        res = frozenset(conv_func(el, encountered_ids) for el in src)
+    elif isinstance(src, list):
         res = [conv_func(el, encountered_ids) for el in src]
     elif isinstance(src, tuple):
         res = tuple(conv_func(el, encountered_ids) for el in src)
     elif isinstance(src, dict):
         res = {
-            conv_func(k, encountered_ids): conv_func(v, encountered_ids)
+            key_func(k, encountered_ids): conv_func(v, encountered_ids)
             for k, v in src.items()
         }
     elif isinstance(src, cbor2.FrozenDict):
         res = cbor2.FrozenDict(
             [
-                (conv_func(k, encountered_ids), conv_func(v, encountered_ids))
+                (key_func(k, encountered_ids), conv_func(v, encountered_ids))
                 for k, v in src.items()
             ]
         )
@@ -57,7 +141,16 @@ def _transform_collection(src, encountered_ids, conv_func):
 # MARK: Native->CBORable
 
 
-def _cborable_from_native(native, encountered_ids=None):
+def _cborable_from_native(
+    native,
+    encountered_ids=None,
+    sort_keys: bool = False,
+    memo: _Memo | None = None,
+    streaming: bool = False,
+):
+    """
+    :param streaming: turn iterators and StreamedMaps into _Stream objects
+    """
     if (
         native is None
         or native == cbor2.undefined
@@ -71,27 +164,29 @@ def _cborable_from_native(native, encountered_ids=None):
                 datetime,
                 bytes,
                 re.Pattern,
-                Fraction,
-                decimal.Decimal,
-                UUID,
                 cbor2.CBORSimpleValue,
-                IPv4Address,
-                IPv4Network,
-                IPv6Address,
-                IPv6Network,
-                Message,
+                RawCbor,
             ),
         )
+        or isinstance(native, _lazy_native_scalars())
     ):
         return native
     if isinstance(native, date):
         return cbor2.CBORTag(100, (native - date(1970, 1, 1)).days)
 
+    if memo is not None and isinstance(native, (tuple, frozenset, cbor2.FrozenDict)):
+        raw = memo.lookup(
+            native,
+            partial(_cborable_from_native, sort_keys=sort_keys, streaming=streaming),
+        )
+        if raw is not None:
+            return raw
+
     if encountered_ids is None:
         encountered_ids = set()
 
     this_id = None
-    res = None
+    res: Any = None
     if isinstance(
         native,
         (
@@ -112,7 +207,7 @@ def _cborable_from_native(native, encountered_ids=None):
 
         if isinstance(native, SerializableToCbor):
             values = [
-                _cborable_from_native(el, encountered_ids)
+                _cborable_from_native(el, encountered_ids, sort_keys, memo, streaming)
                 for el in native.get_cbor_cc_values() or []
             ]
             res = cbor2.CBORTag(
@@ -124,10 +219,52 @@ def _cborable_from_native(native, encountered_ids=None):
             )
         elif isinstance(native, cbor2.CBORTag):
             res = cbor2.CBORTag(
-                native.tag, _cborable_from_native(native.value, encountered_ids)
+                native.tag,
+                _cborable_from_native(
+                    native.value, encountered_ids, sort_keys, memo, streaming
+                ),
             )
+        elif (
+            sort_keys
+            and type(native) is dict
+            and all(type(key) is str for key in native)
+        ):
+            # Plain dict with string keys: sorted in one go, keys need no conversion
+            res = {
+                key: _cborable_from_native(
+                    native[key], encountered_ids, True, memo, streaming
+                )
+                for key in sorted(native)
+            }
+        elif sort_keys and type(native) in (list, tuple):
+            res = [
+                _cborable_from_native(el, encountered_ids, True, memo, streaming)
+                for el in native
+            ]
+            if type(native) is tuple:
+                res = tuple(res)
+        elif sort_keys or memo is not None or streaming:
+            res = _transform_collection(
+                native,
+                encountered_ids,
+                partial(
+                    _cborable_from_native,
+                    sort_keys=sort_keys,
+                    memo=memo,
+                    streaming=streaming,
+                ),
+            )
+            if sort_keys:
+                res = _sorted_container(res)
         else:
             res = _transform_collection(native, encountered_ids, _cborable_from_native)
+    elif streaming and isinstance(native, (Iterator, StreamedMap)):
+        # items are converted while they are encoded
+        res = _Stream(
+            native,
+            partial(_cborable_from_native, sort_keys=sort_keys, streaming=True),
+            _sorted_container if sort_keys else None,
+        )
     else:
         raise ValueError(f"Cannot convert {type(native).__name__} to cborable format")
 
@@ -139,7 +276,12 @@ def _cborable_from_native(native, encountered_ids=None):
 # MARK: CBORable->Native
 
 
-def _native_from_cborable(cborable, encountered_ids=None):
+def _native_from_cborable(
+    cborable,
+    encountered_ids=None,
+    frozen: bool = False,
+    interner: StringInterner | None = None,
+):
     if (
         cborable is None
         or cborable == cbor2.undefined
@@ -154,24 +296,21 @@ def _native_from_cborable(cborable, encountered_ids=None):
                 date,
                 bytes,
                 re.Pattern,
-                Fraction,
-                decimal.Decimal,
-                UUID,
                 cbor2.CBORSimpleValue,
-                IPv4Address,
-                IPv4Network,
-                IPv6Address,
-                IPv6Network,
+                RawCbor,
             ),
         )
+        or isinstance(cborable, _lazy_cborable_scalars())
     ):
+        if interner is not None and interner.values:
+            return interner(cborable)
         return cborable
 
     if encountered_ids is None:
         encountered_ids = set()
 
     this_id = None
-    res = None
+    res: Any = None
     if isinstance(
         cborable,
         (list, tuple, dict, cbor2.FrozenDict, set, frozenset, cbor2.CBORTag),
@@ -191,30 +330,38 @@ def _native_from_cborable(cborable, encountered_ids=None):
                 class_tag = cborable.value[0]
                 assert class_tag
                 native_values = [
-                    _native_from_cborable(el, encountered_ids)
+                    _native_from_cborable(el, encountered_ids, interner=interner)
                     for el in cborable.value[1:]
                 ]
-                if class_tag in CUSTOM_CLASSES_BY_CLASSTAG:
-                    res = CUSTOM_CLASSES_BY_CLASSTAG[class_tag]()
-                    res.put_cbor_cc_values(*native_values)
-                else:
-                    res = UnrecognizedCustomObject()
-                    res.cbor_cc_classtag = res.cbor_cc_classtag = class_tag
-                    res.put_cbor_cc_values(*native_values)
+                res = _custom_object(class_tag, native_values)
             else:
                 res = cbor2.CBORTag(
-                    cborable.tag, _native_from_cborable(cborable.value, encountered_ids)
+                    cborable.tag,
+                    _native_from_cborable(
+                        cborable.value, encountered_ids, frozen, interner
+                    ),
                 )
+        elif interner is not None:
+            res = _transform_collection(
+                cborable,
+                encountered_ids,
+                partial(_native_from_cborable, frozen=frozen, interner=interner),
+                frozen=frozen,
+                key_hook=interner,
+            )
+        elif frozen:
+            res = _transform_collection(
+                cborable, encountered_ids, _frozen_native_from_cborable, frozen=True
+            )
         else:
             res = _transform_collection(
                 cborable, encountered_ids, _native_from_cborable
             )
-    elif isinstance(cborable, Message):
-        payload = cborable.as_bytes()
-        while payload and payload[: len(b"\n")] == b"\n":
-            payload = payload[len(b"\n") :]
-        res = Message()
-        res.set_payload(payload)
+    elif isinstance(cborable, _BlobRef):
+        res = cborable.read()
+    elif isinstance(cborable, _loaded_class("email.message", "Message")):
+        res = type(cborable)()
+        res.set_payload(_mime_payload(cborable.as_bytes()))
     else:
         raise ValueError(f"Cannot convert {type(cborable).__name__} to native format")
 
@@ -223,6 +370,22 @@ def _native_from_cborable(cborable, encountered_ids=None):
     return res
 
 
+def _custom_object(class_tag: str, native_values: list) -> SerializableToCbor:
+    custom_class = _custom_class_by_classtag(class_tag)
+    if custom_class is not None:
+        res = custom_class()
+        res.put_cbor_cc_values(*native_values)
+    else:
+        res = UnrecognizedCustomObject()
+        res.cbor_cc_classtag = res.cbor_cc_classtag = class_tag
+        res.put_cbor_cc_values(*native_values)
+    return res
+
+
+def _frozen_native_from_cborable(cborable, encountered_ids=None):
+    return _native_from_cborable(cborable, encountered_ids, frozen=True)
+
+
 # MARK: JSON<->CBOR
 
 
@@ -236,14 +399,39 @@ def _freeze(val):
     return val
 
 
+def _freeze_jsonable(val):
+    if isinstance(val, list):
+        return tuple(_freeze_jsonable(el) for el in val)
+    if isinstance(val, dict):
+        return FrozenJsonDict((k, _freeze_jsonable(v)) for k, v in val.items())
+    return val
+
+
+# MARK: Blob references
+
+
+def _ref_from_blob(ref_type: str, data: bytes, blob_store: BlobStore) -> dict:
+    return {"$type": ref_type, "$value": blob_store.put(data), "$length": len(data)}
+
+
+def _blob_from_ref(jsonable: dict, blob_store: BlobStore | None) -> bytes:
+    if blob_store is None:
+        raise ValueError(f'$type "{jsonable["$type"]}" requires a blob store')
+    return blob_store.get(jsonable["$value"], jsonable["$length"])
+
+
 # MARK: JSONable->CBORable
 
 
-def _cborable_from_jsonable(jsonable, enforce_object: bool = False):
+def _cborable_from_jsonable(
+    jsonable, enforce_object: bool = False, blob_store: BlobStore | None = None
+):
     if isinstance(jsonable, list):
-        return [_cborable_from_jsonable(el) for el in jsonable]
+        return [_cborable_from_jsonable(el, blob_store=blob_store) for el in jsonable]
     if isinstance(jsonable, tuple):
-        return tuple(_cborable_from_jsonable(el) for el in jsonable)
+        return tuple(
+            _cborable_from_jsonable(el, blob_store=blob_store) for el in jsonable
+        )
     if isinstance(jsonable, dict):
         if "$type" in jsonable and not enforce_object:
             val_type = jsonable["$type"]
@@ -259,9 +447,14 @@ def _cborable_from_jsonable(jsonable, enforce_object: bool = False):
             if val_type == "binary-base58":  # deprecated
                 return base58_decode(jsonable["$value"])  # pragma: no cover
             if val_type == "binary-b58":
-                return base58.b58decode(jsonable["$value"])
+                return _imported_class("base58", "b58decode")(jsonable["$value"])
             if val_type == "binary-base64":
-                return base64.decodebytes(jsonable["$value"].encode())
+                return a2b_base64(jsonable["$value"])
+            if val_type == "binary-ref":
+                if blob_store is None:
+                    return _blob_from_ref(jsonable, blob_store)  # raises
+                # read when converted to native, or written by the encoder
+                return _BlobRef(blob_store, jsonable["$value"], jsonable["$length"])
             if val_type == "custom-object":
                 class_tag = jsonable["$class_tag"]
                 assert class_tag
@@ -271,60 +464,74 @@ def _cborable_from_jsonable(jsonable, enforce_object: bool = False):
                     [
                         class_tag,
                     ]
-                    + [_cborable_from_jsonable(el) for el in jsonable["$value"]],
+                    + [
+                        _cborable_from_jsonable(el, blob_store=blob_store)
+                        for el in jsonable["$value"]
+                    ],
                 )
             if val_type == "tagged-value":
                 tag = jsonable["$cbor_tag"]
-                return cbor2.CBORTag(tag, _cborable_from_jsonable(jsonable["$value"]))
+                return cbor2.CBORTag(
+                    tag,
+                    _cborable_from_jsonable(jsonable["$value"], blob_store=blob_store),
+                )
             if val_type == "map":
                 assert isinstance(jsonable["$value"], list)
                 res = {}
                 for kv_pair in jsonable["$value"]:
                     assert isinstance(kv_pair, list)
                     assert len(kv_pair) == 2
-                    res[_freeze(_cborable_from_jsonable(kv_pair[0]))] = (
-                        _cborable_from_jsonable(kv_pair[1])
+                    key = _freeze(
+                        _cborable_from_jsonable(kv_pair[0], blob_store=blob_store)
+                    )
+                    res[key] = _cborable_from_jsonable(
+                        kv_pair[1], blob_store=blob_store
                     )
                 return res
             if val_type == "set":
                 assert isinstance(jsonable["$value"], list)
                 return set(
-                    _freeze(_cborable_from_jsonable(el)) for el in jsonable["$value"]
+                    _freeze(_cborable_from_jsonable(el, blob_store=blob_store))
+                    for el in jsonable["$value"]
                 )
             if val_type == "uuid":
-                return UUID(jsonable["$value"])
+                return _imported_class("uuid", "UUID")(jsonable["$value"])
             if val_type == "fraction":
                 sep_pos = jsonable["$value"].find("/")
                 assert sep_pos != -1
-                return Fraction(
+                return _imported_class("fractions", "Fraction")(
                     int(jsonable["$value"][:sep_pos]),
                     int(jsonable["$value"][(sep_pos + 1) :]),
                 )
             if val_type == "decimal":
-                return decimal.Decimal(jsonable["$value"])
+                return _imported_class("decimal", "Decimal")(jsonable["$value"])
             if val_type == "regex":
                 return re.compile(jsonable["$value"])
             if val_type == "ipv4-address":
-                return IPv4Address(jsonable["$value"])
+                return _imported_class("ipaddress", "IPv4Address")(jsonable["$value"])
             if val_type == "ipv4-network":
-                return IPv4Network(jsonable["$value"])
+                return _imported_class("ipaddress", "IPv4Network")(jsonable["$value"])
             if val_type == "ipv6-address":
-                return IPv6Address(jsonable["$value"])
+                return _imported_class("ipaddress", "IPv6Address")(jsonable["$value"])
             if val_type == "ipv6-network":
-                return IPv6Network(jsonable["$value"])
-            if val_type == "mime":
-                res_msg = Message()
-                payload = base64.decodebytes(jsonable["$value"].encode())
-                while payload and payload[: len(b"\n")] == b"\n":
-                    payload = payload[len(b"\n") :]
-                res_msg.set_payload(payload)
+                return _imported_class("ipaddress", "IPv6Network")(jsonable["$value"])
+            if val_type in ("mime", "mime-ref"):
+                res_msg = _imported_class("email.message", "Message")()
+                if val_type == "mime-ref":
+                    payload = _blob_from_ref(jsonable, blob_store)
+                else:
+                    payload = a2b_base64(jsonable["$value"])
+                res_msg.set_payload(_mime_payload(payload))
                 return res_msg
             if val_type == "cbor-simple-value":
                 return cbor2.CBORSimpleValue(jsonable["$value"])
             if val_type == "undefined":
                 return cbor2.undefined
             raise ValueError(f'$type "{val_type}" is not supported')
-        return {k: _cborable_from_jsonable(v) for k, v in jsonable.items()}
+        return {
+            k: _cborable_from_jsonable(v, blob_store=blob_store)
+            for k, v in jsonable.items()
+        }
     if jsonable is None or isinstance(jsonable, (str, int, float, bool)):
         return jsonable
     raise TypeError(f"Value of type {type(jsonable).__name__} is not JSONable")
@@ -333,23 +540,30 @@ def _cborable_from_jsonable(jsonable, enforce_object: bool = False):
 # MARK: CBORable->JSONable
 
 
-def _jsonable_from_cborable(cborable):
+def _jsonable_from_cborable(cborable, blob_store: BlobStore | None = None):
+    if isinstance(cborable, RawCbor):
+        cborable = cbor2.loads(cborable.data)
     if isinstance(cborable, list):
-        return [_jsonable_from_cborable(el) for el in cborable]
+        return [_jsonable_from_cborable(el, blob_store) for el in cborable]
     if isinstance(cborable, (dict, cbor2.FrozenDict)):
         if "$type" not in cborable and all(isinstance(k, str) for k in cborable.keys()):
-            return {k: _jsonable_from_cborable(v) for k, v in cborable.items()}
+            return {
+                k: _jsonable_from_cborable(v, blob_store) for k, v in cborable.items()
+            }
         return {
             "$type": "map",
             "$value": [
-                [_jsonable_from_cborable(k), _jsonable_from_cborable(v)]
+                [
+                    _jsonable_from_cborable(k, blob_store),
+                    _jsonable_from_cborable(v, blob_store),
+                ]
                 for k, v in cborable.items()
             ],
         }
     if isinstance(cborable, (set, frozenset)):
         return {
             "$type": "set",
-            "$value": [_jsonable_from_cborable(el) for el in cborable],
+            "$value": [_jsonable_from_cborable(el, blob_store) for el in cborable],
         }
     if isinstance(cborable, datetime):
         # cborable = cborable.replace(tzinfo=None)
@@ -358,32 +572,37 @@ def _jsonable_from_cborable(cborable):
         # cborable = cborable.replace(tzinfo=None)
         return {"$type": "date", "$value": cborable.isoformat()}
     if isinstance(cborable, bytes):
+        if blob_store is not None and len(cborable) > blob_store.threshold:
+            return _ref_from_blob("binary-ref", cborable, blob_store)
         if len(cborable) <= 16:
             return {"$type": "binary-hex", "$value": cborable.hex()}
         if len(cborable) <= 32:
             return {
                 "$type": "binary-b58",
-                "$value": base58.b58encode(cborable).decode(),
+                "$value": _imported_class("base58", "b58encode")(cborable).decode(),
             }
         return {
             "$type": "binary-base64",
-            "$value": base64.encodebytes(cborable).decode().rstrip("\n"),
+            "$value": _base64_text(cborable),
         }
     if isinstance(cborable, cbor2.CBORTag):
         if cborable.tag == 27:
             assert isinstance(cborable.value, list)
             assert len(cborable.value) > 0
             class_tag = cborable.value[0]
+            custom_class = _custom_class_by_classtag(class_tag)
             class_descr = (
-                CUSTOM_CLASSES_BY_CLASSTAG[class_tag].get_cbor_cc_descr()
-                if class_tag in CUSTOM_CLASSES_BY_CLASSTAG
+                custom_class.get_cbor_cc_descr()
+                if custom_class is not None
                 else f'<unrecognized class tag "{class_tag}">'
             )
             return {
                 "$type": "custom-object",
                 "$class": class_descr,
                 "$class_tag": class_tag,
-                "$value": [_jsonable_from_cborable(el) for el in cborable.value[1:]],
+                "$value": [
+                    _jsonable_from_cborable(el, blob_store) for el in cborable.value[1:]
+                ],
             }
 
         if cborable.tag == 100:
@@ -397,113 +616,366 @@ def _jsonable_from_cborable(cborable):
         return {
             "$type": "tagged-value",
             "$cbor_tag": cborable.tag,
-            "$value": _jsonable_from_cborable(cborable.value),
+            "$value": _jsonable_from_cborable(cborable.value, blob_store),
         }
     if cborable == cbor2.undefined:
         return {"$type": "undefined"}
-    if isinstance(cborable, UUID):
+    if cborable is None or isinstance(cborable, (str, int, float)):
+        return cborable
+    if isinstance(cborable, _loaded_class("uuid", "UUID")):
         return {"$type": "uuid", "$value": str(cborable)}
-    if isinstance(cborable, Fraction):
+    if isinstance(cborable, _loaded_class("fractions", "Fraction")):
         return {
             "$type": "fraction",
             "$value": f"{cborable.numerator}/{cborable.denominator}",
         }
-    if isinstance(cborable, decimal.Decimal):
+    if isinstance(cborable, _loaded_class("decimal", "Decimal")):
         return {"$type": "decimal", "$value": str(cborable)}
     if isinstance(cborable, re.Pattern):
         return {"$type": "regex", "$value": cborable.pattern}
-    if isinstance(cborable, IPv4Address):
+    if isinstance(cborable, _loaded_class("ipaddress", "IPv4Address")):
         return {"$type": "ipv4-address", "$value": str(cborable)}
-    if isinstance(cborable, IPv4Network):
+    if isinstance(cborable, _loaded_class("ipaddress", "IPv4Network")):
         return {"$type": "ipv4-network", "$value": str(cborable)}
-    if isinstance(cborable, IPv6Address):
+    if isinstance(cborable, _loaded_class("ipaddress", "IPv6Address")):
         return {"$type": "ipv6-address", "$value": str(cborable)}
-    if isinstance(cborable, IPv6Network):
+    if isinstance(cborable, _loaded_class("ipaddress", "IPv6Network")):
         return {"$type": "ipv6-network", "$value": str(cborable)}
-    if isinstance(cborable, Message):
+    if isinstance(cborable, _loaded_class("email.message", "Message")):
+        payload = cborable.as_bytes()
+        if blob_store is not None and len(payload) > blob_store.threshold:
+            return _ref_from_blob("mime-ref", payload, blob_store)
         return {
             "$type": "mime",
-            "$value": base64.encodebytes(cborable.as_bytes()).decode().rstrip("\n"),
+            "$value": _base64_text(payload),
         }
     if isinstance(cborable, cbor2.CBORSimpleValue):
         return {"$type": "cbor-simple-value", "$value": cborable.value}
     return cborable
 
 
+# MARK: In-place JSONable<->Native
+
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def _in_place(
+    container, convert, done: set[int], path_ids: set[int], *args
+) -> list | dict:
+    """
+    Replaces elements of a list or values of a dict with their conversions
+    :param done: ids of containers converted already (they may be shared)
+    :param path_ids: ids of containers on the way to this one
+    """
+    this_id = id(container)
+    if this_id in done:
+        return container
+    if this_id in path_ids:
+        raise ValueError("Cannot encode a recursively linked structure")
+    path_ids.add(this_id)
+    if isinstance(container, list):
+        for idx, el in enumerate(container):
+            container[idx] = convert(el, done, path_ids, *args)
+    else:
+        for key, val in container.items():
+            container[key] = convert(val, done, path_ids, *args)
+    path_ids.remove(this_id)
+    done.add(this_id)
+    return container
+
+
+def _native_from_jsonable_in_place(
+    jsonable, done: set[int], path_ids: set[int], blob_store: BlobStore | None
+):
+    if type(jsonable) in _JSON_SCALARS:
+        return jsonable
+    if type(jsonable) is list or (type(jsonable) is dict and "$type" not in jsonable):
+        return _in_place(
+            jsonable, _native_from_jsonable_in_place, done, path_ids, blob_store
+        )
+    # $type envelopes, tuples
+    return _native_from_cborable(
+        _cborable_from_jsonable(jsonable, blob_store=blob_store)
+    )
+
+
+def _jsonable_from_native_in_place(
+    native, done: set[int], path_ids: set[int], blob_store: BlobStore | None
+):
+    if type(native) in _JSON_SCALARS:
+        return native
+    if type(native) is list or (
+        type(native) is dict
+        and "$type" not in native
+        and all(isinstance(k, str) for k in native)
+    ):
+        return _in_place(
+            native, _jsonable_from_native_in_place, done, path_ids, blob_store
+        )
+    # other types, maps that become "map" envelopes
+    return _jsonable_from_cborable(_cborable_from_native(native), blob_store)
+
+
 # MARK: Native->JSONable
 
 
-def jsonable_from_native(native):
+def jsonable_from_native(
+    native, blob_store: BlobStore | None = None, consume: bool = False
+):
     """
     :param native: 'native' data to convert to jsonable form
+    :param blob_store: optional store for binaries longer than its threshold
+    :param consume: convert in place: lists and dicts of native are reused in
+        the result, and only other values are replaced. Native is not usable
+        after this (nor after an error).
     :return: jsonable data
     """
-    return _jsonable_from_cborable(_cborable_from_native(native))
+    if consume:
+        return _convert(
+            "jsonable_from_native",
+            native,
+            (
+                "in_place",
+                lambda native: _jsonable_from_native_in_place(
+                    native, set(), set(), blob_store
+                ),
+            ),
+            jsonable_side="output",
+        )
+    return _convert(
+        "jsonable_from_native",
+        native,
+        ("to_cborable", _cborable_from_native),
+        ("to_jsonable", lambda cborable: _jsonable_from_cborable(cborable, blob_store)),
+        jsonable_side="output",
+    )
 
 
 # MARK: JSONable->Native
 
 
-def native_from_jsonable(jsonable):
+def native_from_jsonable(
+    jsonable,
+    blob_store: BlobStore | None = None,
+    frozen: bool = False,
+    interner: StringInterner | None = None,
+    consume: bool = False,
+):
     """
     :param native: 'jsonable' data to convert to native form
+    :param blob_store: store to resolve "binary-ref" and "mime-ref" values from
+    :param frozen: build tuples, frozensets and FrozenDicts instead of lists,
+        sets and dicts
+    :param interner: table to share equal map keys (and string values, if it
+        is configured so) between the result and earlier results
+    :param consume: convert in place: lists and dicts of jsonable are reused
+        in the result, and only "$type" objects are replaced. Jsonable is not
+        usable after this (nor after an error). Cannot be combined with frozen
+        and interner.
     :return: native data
     """
-    return _native_from_cborable(_cborable_from_jsonable(jsonable))
+    if consume:
+        if frozen or interner is not None:
+            raise ValueError("consume cannot be combined with frozen and interner")
+        return _convert(
+            "native_from_jsonable",
+            jsonable,
+            (
+                "in_place",
+                lambda jsonable: _native_from_jsonable_in_place(
+                    jsonable, set(), set(), blob_store
+                ),
+            ),
+            jsonable_side="input",
+        )
+    return _convert(
+        "native_from_jsonable",
+        jsonable,
+        (
+            "from_jsonable",
+            lambda jsonable: _cborable_from_jsonable(jsonable, blob_store=blob_store),
+        ),
+        (
+            "to_native",
+            lambda cborable: _native_from_cborable(
+                cborable, frozen=frozen, interner=interner
+            ),
+        ),
+        jsonable_side="input",
+    )
 
 
 # MARK: Native->CBOR
 
 
-def cbor_from_native(native) -> bytes:
+def cbor_from_native(
+    native,
+    profile: EncoderProfile | None = None,
+    cache: EncodeCache | None = None,
+) -> bytes:
     """
     :param native: 'native' data to encode to CBOR
+    :param profile: encoding options; canonical CBOR by default
+    :param cache: cache of encoded immutable subtrees (tuples, frozensets,
+        FrozenDicts) to reuse instead of encoding them again
     :return: CBOR bytes
     """
-    return cbor2.dumps(
-        _cborable_from_native(native),
-        canonical=True,
-        timezone=timezone.utc,
-        datetime_as_timestamp=True,
+    profile = profile or CANONICAL_PROFILE
+    memo = cache._memo(profile) if cache is not None else None
+    return _convert(
+        "cbor_from_native",
+        native,
+        (
+            "to_cborable",
+            lambda native: _cborable_from_native(native, None, profile.sort_keys, memo),
+        ),
+        ("cbor_encode", lambda cborable: profile.dumps(cborable, presorted=True)),
+    )
+
+
+def write_cbor_from_native(
+    native, fp: BinaryIO, profile: EncoderProfile | None = None
+) -> None:
+    """
+    Encodes 'native' data to CBOR and writes it to a file object. Iterators
+    (e.g. generators) in the data are written as indefinite-length arrays, and
+    StreamedMaps as indefinite-length maps, while they produce items, so they
+    are never held in memory as a whole. Canonical CBOR does not allow
+    indefinite lengths: with a canonical profile (the default) they are
+    collected first. With sort_keys StreamedMaps are collected too.
+    :param native: 'native' data to encode to CBOR
+    :param fp: file object open for writing in binary mode
+    :param profile: encoding options; canonical CBOR by default
+    """
+    profile = profile or CANONICAL_PROFILE
+    _convert(
+        "write_cbor_from_native",
+        native,
+        (
+            "to_cborable",
+            lambda native: _cborable_from_native(
+                native, None, profile.sort_keys, streaming=True
+            ),
+        ),
+        ("cbor_encode", lambda cborable: profile.dump(cborable, fp, presorted=True)),
     )
 
 
 # MARK: CBOR->Native
 
 
-def native_from_cbor(data: bytes):
+def native_from_cbor(
+    data: bytes,
+    cache: DecodeCache | None = None,
+    frozen: bool = False,
+    interner: StringInterner | None = None,
+    passthrough: bool = False,
+    raw_paths: Iterable[Sequence] = (),
+):
     """
     :param native: CBOR bytes
+    :param cache: cache of decoded payloads; with it the result is always frozen
+    :param frozen: build tuples, frozensets and FrozenDicts instead of lists,
+        sets and dicts
+    :param interner: table to share equal map keys (and string values, if it
+        is configured so) between the result and earlier results
+    :param passthrough: keep items with unknown tags and custom objects of
+        unregistered classes as RawCbor, which the encoder writes verbatim
+    :param raw_paths: paths of subtrees to keep as RawCbor without decoding
+        them: sequences of map keys and array indices, where ... (Ellipsis)
+        matches any key or index. Paths do not go into tagged items.
     :return: decoded 'native' data
     """
-    return _native_from_cborable(cbor2.loads(data))
+    raw_paths = tuple(tuple(raw_path) for raw_path in raw_paths)
+    if cache is not None:
+        return cache._get_or_decode(
+            (
+                ("native", passthrough, raw_paths)
+                if passthrough or raw_paths
+                else "native"
+            ),
+            data,
+            lambda data: native_from_cbor(
+                data,
+                frozen=True,
+                interner=interner,
+                passthrough=passthrough,
+                raw_paths=raw_paths,
+            ),
+        )
+    decode: Any = cbor2.loads
+    if passthrough or raw_paths:
+        decode = partial(
+            _passthrough_loads, passthrough=passthrough, raw_paths=raw_paths
+        )
+    return _convert(
+        "native_from_cbor",
+        data,
+        ("cbor_decode", decode),
+        (
+            "to_native",
+            lambda cborable: _native_from_cborable(
+                cborable, frozen=frozen, interner=interner
+            ),
+        ),
+    )
 
 
 # MARK: JSONable->CBOR
 
 
-def cbor_from_jsonable(jsonable) -> bytes:
+def cbor_from_jsonable(
+    jsonable,
+    blob_store: BlobStore | None = None,
+    profile: EncoderProfile | None = None,
+) -> bytes:
     """
     :param native: 'jsonable' data to encode to CBOR
+    :param blob_store: store to resolve "binary-ref" and "mime-ref" values from
+    :param profile: encoding options; canonical CBOR by default
     :return: CBOR bytes
     """
-    return cbor2.dumps(
-        _cborable_from_jsonable(jsonable),
-        canonical=True,
-        timezone=timezone.utc,
-        datetime_as_timestamp=True,
+    return _convert(
+        "cbor_from_jsonable",
+        jsonable,
+        (
+            "from_jsonable",
+            lambda jsonable: _cborable_from_jsonable(jsonable, blob_store=blob_store),
+        ),
+        ("cbor_encode", (profile or CANONICAL_PROFILE).dumps),
+        jsonable_side="input",
     )
 
 
 # MARK: CBOR->JSONable
 
 
-def jsonable_from_cbor(data: bytes):
+def jsonable_from_cbor(
+    data: bytes,
+    blob_store: BlobStore | None = None,
+    cache: DecodeCache | None = None,
+):
     """
     :param native: CBOR bytes
+    :param blob_store: optional store for binaries longer than its threshold
+    :param cache: cache of decoded payloads; with it the result is frozen
+        (tuples instead of lists, read-only dicts)
     :return: decoded data in jsonable form
     """
-    return _jsonable_from_cborable(cbor2.loads(data))
+    if cache is not None:
+        return cache._get_or_decode(
+            ("jsonable", blob_store),
+            data,
+            lambda data: _freeze_jsonable(jsonable_from_cbor(data, blob_store)),
+        )
+    return _convert(
+        "jsonable_from_cbor",
+        data,
+        ("cbor_decode", cbor2.loads),
+        ("to_jsonable", lambda cborable: _jsonable_from_cborable(cborable, blob_store)),
+        jsonable_side="output",
+    )
 
 
 # MARK: Deprecated b58
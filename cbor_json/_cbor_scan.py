@@ -0,0 +1,229 @@
+"""
+Scanning of CBOR item boundaries by data item heads, without decoding values.
+"""
+
+from cbor2 import CBORDecodeValueError
+
+# Tags whose meaning depends on items decoded before: shared values (28, 29)
+# and string references (256, 25). Items containing them cannot be decoded
+# apart from the rest of the data.
+_CONTEXT_TAGS = frozenset((25, 28, 29, 256))
+
+
+class _ContextDependent(Exception):
+    pass
+
+
+def _read_head(data, pos: int):
+    """
+    Reads a data item head.
+    :param data: bytes-like object
+    :param pos: position of the head
+    :return: (major type, additional info, argument, position after the head),
+        or None if data ends inside the head. Argument is None for
+        indefinite-length items and breaks.
+    """
+    if pos >= len(data):
+        return None
+    initial = data[pos]
+    major = initial >> 5
+    info = initial & 0x1F
+    if info < 24:
+        return major, info, info, pos + 1
+    if info == 31:
+        if major in (0, 1, 6):
+            raise CBORDecodeValueError(
+                f"Indefinite length is not allowed for major type {major} at {pos}"
+            )
+        return major, info, None, pos + 1
+    if info > 27:
+        raise CBORDecodeValueError(f"Invalid additional information {info} at {pos}")
+    end = pos + 1 + (1 << (info - 24))
+    if end > len(data):
+        return None
+    return major, info, int.from_bytes(data[pos + 1 : end], "big"), end
+
+
+class _ItemScanner:
+    """
+    Finds ends of consecutive top-level items in a growing buffer.
+    Keeps its state between calls, so every head byte is read once however
+    the buffer grows. String payloads are skipped without reading.
+    """
+
+    def __init__(self, watch_context: bool = False):
+        """
+        :param watch_context: raise _ContextDependent at context-dependent tags
+        """
+        self.pos = 0  # next unread position in the buffer
+        self._context_tags = _CONTEXT_TAGS if watch_context else frozenset()
+        self._skip = 0  # payload bytes left to skip
+        self._stack: list[int] = []  # items left in open containers; -1 if indefinite
+
+    @property
+    def in_item(self) -> bool:
+        """
+        True if the scanner stopped inside an item
+        """
+        return bool(self._stack or self._skip)
+
+    def shift(self, offset: int):
+        """
+        Tells the scanner that first offset bytes were removed from the buffer
+        """
+        self.pos -= offset
+
+    def scan(self, data) -> list[int]:
+        """
+        Scans data from the position where the previous call stopped.
+        :param data: the buffer; it may only grow between calls (or be shifted)
+        :return: end positions of top-level items completed during this call
+        """
+        ends: list[int] = []
+        stack = self._stack
+        pos = self.pos
+        data_len = len(data)
+        while True:
+            if self._skip:
+                if pos + self._skip > data_len:
+                    self._skip -= data_len - pos
+                    pos = data_len
+                    break
+                pos += self._skip
+                self._skip = 0
+            else:
+                head_pos = pos
+                try:
+                    head = _read_head(data, pos)
+                    if (
+                        head is not None
+                        and head[0] == 7
+                        and head[2] is None
+                        and (not stack or stack[-1] != -1)
+                    ):
+                        raise CBORDecodeValueError(f"Unexpected break at {pos}")
+                except CBORDecodeValueError:
+                    if not ends:
+                        self.pos = pos  # consistent with _stack and _skip
+                        raise
+                    break  # report completed items first, fail on the next call
+                if head is None:
+                    break
+                major, _, arg, pos = head
+                if major in (2, 3) and arg:
+                    self._skip = arg
+                    continue
+                if major in (2, 3, 4, 5) and arg is None:
+                    stack.append(-1)
+                    continue
+                if major in (4, 5) and arg:
+                    stack.append(arg if major == 4 else arg * 2)
+                    continue
+                if major == 6:
+                    if arg in self._context_tags:
+                        self.pos = head_pos  # the tag is not on the stack
+                        raise _ContextDependent()
+                    stack.append(1)
+                    continue
+                if major == 7 and arg is None:  # break
+                    stack.pop()
+
+            # An item is complete here. Complete containers it was the last item of.
+            while stack and stack[-1] > 0:
+                stack[-1] -= 1
+                if stack[-1]:
+                    break
+                stack.pop()
+            if not stack:
+                ends.append(pos)
+        self.pos = pos
+        return ends
+
+
+def _head(major: int, arg: int) -> bytes:
+    """
+    Encodes a data item head with the shortest argument
+    """
+    if arg < 24:
+        return bytes((major << 5 | arg,))
+    for info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+        if arg < 1 << (8 * size):
+            return bytes((major << 5 | info,)) + arg.to_bytes(size, "big")
+    raise ValueError(f"Argument {arg} is too big")
+
+
+def _item_end(data, pos: int) -> int:
+    """
+    Finds the end of a well-formed data item without decoding it
+    :return: position after the item at pos
+    """
+    stack: list[int] = []  # items left in enclosing containers
+    left = 1  # items left in the innermost container; -1 if indefinite
+    while True:
+        initial = data[pos]
+        major = initial >> 5
+        info = initial & 0x1F
+        if info < 24:
+            arg: int | None = info
+            pos += 1
+        elif info < 28:
+            size = 1 << (info - 24)
+            arg = int.from_bytes(data[pos + 1 : pos + 1 + size], "big")
+            pos += 1 + size
+        else:
+            arg = None
+            pos += 1
+        if arg is None and major != 7:  # indefinite-length string or container
+            stack.append(left)
+            left = -1
+            continue
+        if major in (2, 3):
+            pos += arg  # type: ignore[operator]
+        elif major in (4, 5) and arg:
+            stack.append(left)
+            left = arg if major == 4 else arg * 2
+            continue
+        elif major == 6:
+            stack.append(left)
+            left = 1
+            continue
+        elif major == 7 and arg is None:  # break
+            left = stack.pop()
+
+        # An item is complete here. Complete containers it was the last item of.
+        while left > 0:
+            left -= 1
+            if left:
+                break
+            if not stack:
+                return pos
+            left = stack.pop()
+
+
+def _array_item_bounds(data) -> list[int] | None:
+    """
+    Finds boundaries of elements of a top-level array without decoding them.
+    :return: start of the first element and ends of all elements, or None if
+        data is not an array, is damaged, or contains context-dependent tags
+    """
+    head = _read_head(data, 0)
+    if head is None or head[0] != 4:
+        return None
+    _, _, count, start = head
+    scanner = _ItemScanner(watch_context=True)
+    scanner.pos = start
+    try:
+        if count is not None:
+            ends = scanner.scan(data)[:count]
+            if len(ends) != count:
+                return None
+        else:
+            if data[-1] != 0xFF:
+                return None
+            with memoryview(data) as view, view[:-1] as items:
+                ends = scanner.scan(items)
+            if scanner.pos != len(data) - 1 or scanner.in_item:
+                return None
+    except (_ContextDependent, CBORDecodeValueError):
+        return None
+    return [start] + ends
@@ -0,0 +1,337 @@
+"""
+Compressed block-indexed container of CBOR records.
+
+Classes:
+- ContainerWriter - writes records to a container file
+- ContainerReader - reads records by number, sequentially, or in parallel
+
+File layout:
+- header: magic b"CBJC", format version (1 byte), compression (1 byte:
+  0 - none, 1 - zlib, 2 - lzma), first 8 bytes of SHA-256 of the preset
+  dictionary (zeros if there is no dictionary);
+- blocks: every block is compressed CBOR array of end offsets of its records,
+  followed by the records (so a record is found without scanning the block);
+- index: CBOR array of [block offset, compressed size, record count];
+- trailer: index offset (8 bytes, big-endian) and magic b"CBJC".
+
+A preset dictionary (zlib only) helps a lot when records are small and share
+many keys and strings. Readers must be given the same dictionary.
+"""
+
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from itertools import accumulate
+import lzma
+import os
+from threading import Lock
+from typing import Callable, Iterator, cast
+import zlib
+
+import cbor2
+
+from ._cbor_json_codecs import cbor_from_native, native_from_cbor
+
+_MAGIC = b"CBJC"
+_VERSION = 1
+_COMPRESSIONS = {None: 0, "zlib": 1, "lzma": 2}
+_HEADER_SIZE = 14
+_TRAILER_SIZE = 12
+
+
+def _dict_id(zdict: bytes | None) -> bytes:
+    return sha256(zdict).digest()[:8] if zdict else bytes(8)
+
+
+def _decompress(compression: int, zdict: bytes | None, data: bytes) -> bytes:
+    if compression == 1:
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib
+        return decompressor.decompress(data)
+    if compression == 2:
+        return lzma.decompress(data)
+    return data
+
+
+def _split_block(block: bytes) -> list[int]:
+    """
+    :return: start and end positions of records in a decompressed block
+    """
+    with BytesIO(block) as block_io:
+        ends = cast(list[int], cbor2.CBORDecoder(block_io).decode())
+        base = block_io.tell()
+    return [base] + [base + end for end in ends]
+
+
+def _decode_block(path: str, offset: int, size: int, compression: int, zdict, decode):
+    """
+    Reads, decompresses and decodes one block. Runs in worker processes.
+    """
+    with open(path, "rb") as block_f:
+        block_f.seek(offset)
+        block = _decompress(compression, zdict, block_f.read(size))
+    bounds = _split_block(block)
+    return [decode(block[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+
+class ContainerWriter:
+    """
+    Writes records to a container file. Use it as a context manager, or call
+    close() to write the index. A file without index cannot be read.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression: str | None = "zlib",
+        level: int | None = None,
+        zdict: bytes | None = None,
+        block_size: int = 1 << 18,
+        encode: Callable[..., bytes] = cbor_from_native,
+    ):
+        """
+        :param path: file to create
+        :param compression: "zlib", "lzma" or None
+        :param level: compression level (zlib) or preset (lzma)
+        :param zdict: preset dictionary; only for zlib
+        :param block_size: uncompressed size to start a new block at; bigger
+            blocks compress better, smaller ones give faster random access
+        :param encode: function that encodes records to CBOR
+        """
+        if compression not in _COMPRESSIONS:
+            raise ValueError(f'Unknown compression "{compression}"')
+        if zdict and compression != "zlib":
+            raise ValueError("Preset dictionary is supported only for zlib")
+        self.compression = compression
+        self.level = level
+        self.zdict = zdict
+        self.block_size = block_size
+        self.encode = encode
+        self.records = 0
+        self._index: list[list[int]] = []
+        self._block = bytearray()
+        self._block_ends: list[int] = []
+        self._file = open(path, "wb")
+        self._file.write(
+            _MAGIC + bytes((_VERSION, _COMPRESSIONS[compression])) + _dict_id(zdict)
+        )
+
+    def write(self, record):
+        """
+        Encodes and writes a record
+        """
+        self.write_cbor(self.encode(record))
+
+    def write_cbor(self, data: bytes):
+        """
+        Writes an already encoded record. It must be exactly one CBOR item.
+        """
+        self._block += data
+        self._block_ends.append(len(self._block))
+        self.records += 1
+        if len(self._block) >= self.block_size:
+            self.flush_block()
+
+    def _compress(self, data) -> bytes:
+        if self.compression == "zlib":
+            level = -1 if self.level is None else self.level
+            if self.zdict:
+                compressor = zlib.compressobj(level, zdict=self.zdict)
+            else:
+                compressor = zlib.compressobj(level)
+            return compressor.compress(data) + compressor.flush()
+        if self.compression == "lzma":
+            return lzma.compress(data, preset=self.level)
+        return bytes(data)
+
+    def flush_block(self):
+        """
+        Compresses and writes buffered records as a block
+        """
+        if not self._block_ends:
+            return
+        compressed = self._compress(cbor2.dumps(self._block_ends) + self._block)
+        self._index.append([self._file.tell(), len(compressed), len(self._block_ends)])
+        self._file.write(compressed)
+        self._block.clear()
+        self._block_ends.clear()
+
+    def close(self):
+        """
+        Writes the last block and the index, and closes the file
+        """
+        if self._file.closed:
+            return
+        try:
+            self.flush_block()
+            index_offset = self._file.tell()
+            self._file.write(cbor2.dumps(self._index))
+            self._file.write(index_offset.to_bytes(8, "big") + _MAGIC)
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ContainerReader:
+    """
+    Reads records of a container file. Records are numbered from 0.
+    reader[n] decompresses only the block that contains record n; the last
+    decompressed block is kept, so neighbouring records are cheap.
+    Thread-safe.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        zdict: bytes | None = None,
+        decode: Callable = native_from_cbor,
+    ):
+        """
+        :param path: container file
+        :param zdict: preset dictionary the file was written with
+        :param decode: function that decodes CBOR records
+        """
+        self.path = path
+        self.zdict = zdict
+        self.decode = decode
+        self._file = open(path, "rb")
+        self._lock = Lock()
+        self._cached_block: tuple[int, bytes, list[int]] | None = None
+        try:
+            self._read_index()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _read_index(self):
+        header = self._file.read(_HEADER_SIZE)
+        if len(header) != _HEADER_SIZE or header[:4] != _MAGIC:
+            raise ValueError(f'"{self.path}" is not a container file')
+        if header[4] != _VERSION:
+            raise ValueError(f"Unsupported container version {header[4]}")
+        self._compression = header[5]
+        if self._compression not in _COMPRESSIONS.values():
+            raise ValueError(f"Unknown compression {self._compression}")
+        if header[6:] != _dict_id(self.zdict):
+            raise ValueError(
+                "Wrong preset dictionary" if self.zdict else "Preset dictionary needed"
+            )
+        file_size = self._file.seek(0, os.SEEK_END)
+        if file_size < _HEADER_SIZE + _TRAILER_SIZE:
+            raise ValueError(f'"{self.path}" has no index; was the writer closed?')
+        self._file.seek(file_size - _TRAILER_SIZE)
+        trailer = self._file.read(_TRAILER_SIZE)
+        if trailer[8:] != _MAGIC:
+            raise ValueError(f'"{self.path}" has no index; was the writer closed?')
+        index_offset = int.from_bytes(trailer[:8], "big")
+        self._file.seek(index_offset)
+        self._index = cbor2.loads(
+            self._file.read(file_size - _TRAILER_SIZE - index_offset)
+        )
+        # Number of the first record of every block, and the total at the end
+        self._first_records = list(
+            accumulate((count for _, _, count in self._index), initial=0)
+        )
+
+    def __len__(self):
+        return self._first_records[-1]
+
+    @property
+    def blocks(self) -> int:
+        """
+        Number of blocks
+        """
+        return len(self._index)
+
+    def _block(self, block_no: int) -> tuple[bytes, list[int]]:
+        """
+        :return: decompressed block and positions of its records
+        """
+        cached = self._cached_block
+        if cached is not None and cached[0] == block_no:
+            return cached[1], cached[2]
+        offset, size, _ = self._index[block_no]
+        with self._lock:
+            self._file.seek(offset)
+            compressed = self._file.read(size)
+        block = _decompress(self._compression, self.zdict, compressed)
+        bounds = _split_block(block)
+        self._cached_block = (block_no, block, bounds)
+        return block, bounds
+
+    def raw(self, record_no: int) -> bytes:
+        """
+        :return: CBOR bytes of the record
+        """
+        if record_no < 0:
+            record_no += len(self)
+        if not 0 <= record_no < len(self):
+            raise IndexError("Record number out of range")
+        block_no = bisect_right(self._first_records, record_no) - 1
+        block, bounds = self._block(block_no)
+        idx = record_no - self._first_records[block_no]
+        return block[bounds[idx] : bounds[idx + 1]]
+
+    def __getitem__(self, record_no: int):
+        return self.decode(self.raw(record_no))
+
+    def __iter__(self) -> Iterator:
+        for block_no in range(len(self._index)):
+            block, bounds = self._block(block_no)
+            for start, end in zip(bounds, bounds[1:]):
+                yield self.decode(block[start:end])
+
+    def scan(
+        self, executor: Executor | None = None, max_workers: int | None = None
+    ) -> Iterator:
+        """
+        Decompresses and decodes blocks in parallel.
+        :param executor: executor to run on; a process pool is created (and shut
+            down at the end) if not given. With a process pool the decode
+            function must be picklable, e.g. a module-level function.
+        :param max_workers: size of the created process pool
+        :return: iterator over all records in order
+        """
+        own_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers)
+        window = 2 * (max_workers or os.cpu_count() or 1)
+        try:
+            pending: deque = deque()
+            for offset, size, _ in self._index:
+                pending.append(
+                    executor.submit(
+                        _decode_block,
+                        self.path,
+                        offset,
+                        size,
+                        self._compression,
+                        self.zdict,
+                        self.decode,
+                    )
+                )
+                if len(pending) >= window:
+                    yield from pending.popleft().result()
+            for future in pending:
+                yield from future.result()
+        finally:
+            if own_executor:
+                executor.shutdown(cancel_futures=True)
+
+    def close(self):
+        """
+        Closes the file
+        """
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
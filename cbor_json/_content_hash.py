@@ -0,0 +1,220 @@
+"""
+Merkle hashing of native data.
+
+Function:
+- content_hash - hash of the canonical CBOR structure of native data
+Class:
+- DigestCache - LRU cache of digests of immutable subtrees for content_hash
+
+Every container (array, map, set, tagged item, custom object) is hashed on its
+own. A parent hashes its canonical CBOR in which every child container is
+replaced by the byte 0xfc (it never starts a well-formed item) followed by the
+child's digest. So data without nested containers is hashed as its canonical
+CBOR: for a flat record content_hash(native) is equal to
+HashSha256(data=cbor_from_native(native)).
+
+Digests of tuples, frozensets and cbor2.FrozenDicts that contain only immutable
+values are computed once per call, and once at all if a DigestCache is given.
+When a branch of a big document changes, put a new frozen subtree in its place
+(e.g. a result of native_from_cbor with frozen=True): content_hash with the
+same cache hashes only the new branch and the containers on the way to it.
+"""
+
+from collections import OrderedDict
+import io
+from threading import Lock
+from typing import Any, Type
+
+import cbor2
+
+from ._cbor_json_codecs import _cborable_from_native
+from ._cbor_scan import _head
+from ._custom_objects_base import SerializableToCbor
+from ._encode_cache import _KEY_BY_STR, _KEY_BY_VALUE
+from ._profiles import CANONICAL_PROFILE, RawCbor, _encode_raw
+from .custom_objects import HashSha256, _HashBase
+
+_SIMPLE_TYPES = {str, int, float, bytes, bool, type(None)}  # cborable as they are
+_IMMUTABLE_SCALARS = _KEY_BY_VALUE + _KEY_BY_STR
+_FROZEN_TYPES = {tuple, frozenset, cbor2.FrozenDict}
+_CONTAINERS = (
+    list,
+    tuple,
+    dict,
+    cbor2.FrozenDict,
+    set,
+    frozenset,
+    SerializableToCbor,
+    cbor2.CBORTag,
+)
+
+
+class DigestCache:
+    """
+    Thread-safe LRU cache of digests of immutable subtrees.
+    Pass it to content_hash. One cache can be used with different hash classes.
+    The cache keeps references to the subtrees.
+    Statistics: hits, misses, evictions, entries.
+    """
+
+    def __init__(self, max_entries: int = 65536):
+        """
+        :param max_entries: maximal number of cached digests
+        """
+        self.max_entries = max_entries
+        self.hits = self.misses = self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()  # (algo, id) -> (native, digest)
+        self._lock = Lock()
+
+    @property
+    def entries(self) -> int:
+        """
+        Number of cached digests
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all entries. Statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _get(self, algo, native) -> bytes | None:
+        key = (algo, id(native))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put(self, algo, native, digest: bytes):
+        with self._lock:
+            self._entries[(algo, id(native))] = (native, digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __repr__(self):
+        return (
+            f"<DigestCache entries={self.entries} hits={self.hits} "
+            f"misses={self.misses} evictions={self.evictions}>"
+        )
+
+
+class _Hasher:
+    def __init__(self, algo: Type[_HashBase], cache: DigestCache | None):
+        self.algo = algo
+        self.cache = cache
+        self.hash = algo()
+        self.known: dict[int, bytes] = {}  # id of frozen subtree -> digest
+        self.encountered_ids: set[int] = set()
+        self.fp = io.BytesIO()
+        self.encoder = cbor2.CBOREncoder(  # one encoder for all nodes is faster
+            self.fp,
+            canonical=True,
+            timezone=CANONICAL_PROFILE.timezone,
+            datetime_as_timestamp=CANONICAL_PROFILE.datetime_as_timestamp,
+            default=_encode_raw,
+        )
+
+    def encode(self, cborable) -> bytes:
+        self.fp.seek(0)
+        self.fp.truncate()
+        self.encoder.encode(cborable)
+        return self.fp.getvalue()
+
+    def stand_ins(self, natives) -> tuple[list, bool]:
+        """
+        :return: "cborable" values in which containers are replaced by their
+            digests, and True if all natives are immutable
+        """
+        res = []
+        all_immutable = True
+        for native in natives:
+            if type(native) in _SIMPLE_TYPES:
+                res.append(native)
+            elif isinstance(native, cbor2.CBORSimpleValue) or not isinstance(
+                native, _CONTAINERS
+            ):  # CBORSimpleValue is a tuple
+                res.append(_cborable_from_native(native))
+                all_immutable = all_immutable and isinstance(native, _IMMUTABLE_SCALARS)
+            else:
+                digest, immutable = self.digest(native)
+                res.append(RawCbor(b"\xfc" + digest))
+                all_immutable = all_immutable and immutable
+        return res, all_immutable
+
+    def digest(self, native) -> tuple[bytes, bool]:
+        """
+        :param native: container
+        :return: digest of the container, and True if it is immutable
+        """
+        this_id = id(native)
+        frozen = type(native) in _FROZEN_TYPES
+        if frozen:
+            found = self.known.get(this_id)
+            if found is None and self.cache is not None:
+                found = self.cache._get(self.algo, native)
+            if found is not None:
+                return found, True
+
+        if this_id in self.encountered_ids:
+            raise ValueError("Cannot encode a recursively linked structure")
+        self.encountered_ids.add(this_id)
+        cborable: Any = None
+        node = None
+        if isinstance(native, (list, tuple)):
+            # Arrays often contain many containers. Joining encoded elements
+            # here is faster than RawCbor stand-ins going through _encode_raw.
+            cborable, immutable = self.stand_ins(native)
+            if any(type(el) is RawCbor for el in cborable):
+                node = _head(4, len(cborable)) + b"".join(
+                    el.data if type(el) is RawCbor else self.encode(el)
+                    for el in cborable
+                )
+        elif isinstance(native, (dict, cbor2.FrozenDict)):
+            keys, keys_immutable = self.stand_ins(native.keys())
+            values, immutable = self.stand_ins(native.values())
+            cborable = dict(zip(keys, values))
+            immutable = immutable and keys_immutable
+        elif isinstance(native, (set, frozenset)):
+            elements, immutable = self.stand_ins(native)
+            cborable = set(elements)
+        elif isinstance(native, SerializableToCbor):
+            values = [native.cbor_cc_classtag] + (native.get_cbor_cc_values() or [])
+            cborable = cbor2.CBORTag(27, self.stand_ins(values)[0])
+            immutable = False
+        else:
+            cborable = cbor2.CBORTag(native.tag, self.stand_ins([native.value])[0][0])
+            immutable = False
+        self.encountered_ids.remove(this_id)
+
+        self.hash.calculate(self.encode(cborable) if node is None else node)
+        digest = self.hash.digest
+        assert digest is not None
+        if frozen and immutable:
+            self.known[this_id] = digest
+            if self.cache is not None:
+                self.cache._put(self.algo, native, digest)
+        return digest, frozen and immutable
+
+
+def content_hash(
+    native, algo: Type[_HashBase] = HashSha256, cache: DigestCache | None = None
+) -> _HashBase:
+    """
+    Calculates a Merkle hash of the canonical CBOR structure of native data,
+    see the module docstring. Equal data give equal hashes whatever the order
+    of dict keys and set elements, and lists give the same hashes as tuples.
+    :param native: 'native' data
+    :param algo: hash class from custom_objects
+    :param cache: cache of digests of immutable subtrees to reuse between calls
+    :return: hash object
+    """
+    if isinstance(native, cbor2.CBORSimpleValue) or not isinstance(native, _CONTAINERS):
+        return algo(data=CANONICAL_PROFILE.dumps(_cborable_from_native(native)))
+    return algo(digest=_Hasher(algo, cache).digest(native)[0])
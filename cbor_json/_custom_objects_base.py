@@ -11,6 +11,7 @@ in the custom_objects.py module.
 """
 
 from abc import ABC, abstractmethod
+from threading import Lock
 from typing import Type
 
 
@@ -49,8 +50,33 @@ class SerializableToCbor(ABC):
         """
 
 
+# The registry is copy-on-write: registration builds new dicts and rebinds
+# these names, so conversions read a consistent snapshot without locking.
+# Always access them as attributes of this module.
 CUSTOM_CLASSES_BY_CLASSTAG: dict[str, Type[SerializableToCbor]] = {}
 CUSTOM_CLASTAGS_BY_CLASS: dict[Type[SerializableToCbor], str] = {}
+_REGISTRY_LOCK = Lock()
+_BUILTIN_CLASSES_LOADED = False
+
+
+def _load_builtin_classes():
+    """
+    Imports the custom_objects module, which registers the built-in custom
+    classes. It is imported on first need to keep "import cbor_json" fast.
+    """
+    global _BUILTIN_CLASSES_LOADED
+    if not _BUILTIN_CLASSES_LOADED:
+        from . import custom_objects  # noqa: F401
+
+        _BUILTIN_CLASSES_LOADED = True
+
+
+def _custom_class_by_classtag(classtag: str) -> Type[SerializableToCbor] | None:
+    """
+    :return: registered class with the class tag, or None
+    """
+    _load_builtin_classes()
+    return CUSTOM_CLASSES_BY_CLASSTAG.get(classtag)
 
 
 def register_custom_class(a_class: Type[SerializableToCbor]):
@@ -59,7 +85,15 @@ def register_custom_class(a_class: Type[SerializableToCbor]):
     this function to register your class for the codec.
     :param a_class: a class to register. Should be a subclass of SerializableToCbor.
     """
-    if a_class not in CUSTOM_CLASTAGS_BY_CLASS:
+    _load_builtin_classes()  # so that their class tags are taken first
+    _register_class(a_class)
+
+
+def _register_class(a_class: Type[SerializableToCbor]):
+    global CUSTOM_CLASSES_BY_CLASSTAG, CUSTOM_CLASTAGS_BY_CLASS
+    with _REGISTRY_LOCK:
+        if a_class in CUSTOM_CLASTAGS_BY_CLASS:
+            return
         if not issubclass(a_class, SerializableToCbor):
             raise ValueError(
                 f"Class {a_class.__name__} is not a subclass of SerializableToCbor"
@@ -78,8 +112,8 @@ def register_custom_class(a_class: Type[SerializableToCbor]):
                 f"for {CUSTOM_CLASSES_BY_CLASSTAG[classtag].__name__}"
             )
 
-        CUSTOM_CLASSES_BY_CLASSTAG[classtag] = a_class
-        CUSTOM_CLASTAGS_BY_CLASS[a_class] = classtag
+        CUSTOM_CLASSES_BY_CLASSTAG = {**CUSTOM_CLASSES_BY_CLASSTAG, classtag: a_class}
+        CUSTOM_CLASTAGS_BY_CLASS = {**CUSTOM_CLASTAGS_BY_CLASS, a_class: classtag}
 
 
 class UnrecognizedCustomObject(SerializableToCbor):
@@ -0,0 +1,133 @@
+"""
+Cache of decoding results for repeated CBOR payloads.
+
+Class:
+- DecodeCache - bounded cache for native_from_cbor and jsonable_from_cbor
+
+Results are keyed by the payload digest and are returned frozen, so one cached
+tree can be shared by all callers without defensive copies:
+- native_from_cbor gives tuples, frozensets and cbor2.FrozenDicts instead of
+  lists, sets and dicts, as with frozen=True;
+- jsonable_from_cbor gives tuples instead of lists and read-only dicts (still
+  instances of dict, so json.dump accepts them).
+Custom objects in cached results are shared as well. Do not modify them.
+"""
+
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from typing import Type, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .custom_objects import _HashBase
+
+
+class FrozenJsonDict(dict):
+    """
+    Read-only dict of a cached jsonable result
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError(f"{type(self).__name__} is read-only")
+
+    __setitem__ = __delitem__ = _readonly  # type: ignore
+    clear = pop = popitem = setdefault = update = _readonly  # type: ignore
+    __ior__ = _readonly  # type: ignore
+
+    def __hash__(self):  # type: ignore
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+    def __copy__(self):
+        return self  # read-only, like a tuple
+
+    def __deepcopy__(self, memo):
+        return type(self)(deepcopy(dict(self), memo))
+
+
+class DecodeCache:
+    """
+    Thread-safe LRU cache of decoded CBOR payloads.
+    Pass it to native_from_cbor or jsonable_from_cbor.
+    Size of an entry is estimated as the size of its payload.
+    Statistics: hits, misses, evictions, entries, size_bytes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 64 << 20,
+        max_entries: int = 4096,
+        hash_class: "Type[_HashBase] | None" = None,
+    ):
+        """
+        :param max_bytes: maximal total size of cached payloads
+        :param max_entries: maximal number of cached results
+        :param hash_class: hash to key payloads by (custom_objects.HashSha256 by
+            default); use a collision-resistant one
+        """
+        if hash_class is None:
+            from .custom_objects import HashSha256
+
+            hash_class = HashSha256
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hash_class = hash_class
+        self.hits = self.misses = self.evictions = 0
+        self.size_bytes = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (size, result)
+        self._lock = Lock()
+
+    @property
+    def entries(self) -> int:
+        """
+        Number of cached results
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all entries. Statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def _get_or_decode(self, kind, data, decode):
+        """
+        :param kind: hashable description of the conversion
+        :param data: CBOR payload
+        :param decode: function that decodes data to a frozen result
+        """
+        key = (kind, self.hash_class(data=data).digest)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+
+        res = decode(data)
+        size = len(data)
+        if size > self.max_bytes:
+            return res
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (size, res)
+                self.size_bytes += size
+                while (
+                    len(self._entries) > self.max_entries
+                    or self.size_bytes > self.max_bytes
+                ):
+                    _, (evicted_size, _) = self._entries.popitem(last=False)
+                    self.size_bytes -= evicted_size
+                    self.evictions += 1
+        return res
+
+    def __repr__(self):
+        return (
+            f"<DecodeCache entries={self.entries} size_bytes={self.size_bytes} "
+            f"hits={self.hits} misses={self.misses} evictions={self.evictions}>"
+        )
@@ -0,0 +1,474 @@
+"""
+Structural difference between two CBOR documents.
+
+Functions:
+- cbor_delta - patch that turns one CBOR document into another
+- apply_cbor_delta - applies such a patch
+
+The patch is a CBOR array of operations:
+- ["set", path, value] - replaces the value at path
+- ["delete", path] - removes the map key or the array element at path
+- ["insert", path, value] - inserts an array element before the index at path
+- ["insert", path, value, position] - inserts a map key at path as the pair
+  number position
+Path is an array of map keys and array indices. Tags on the way are skipped:
+a path into a tagged array or map addresses the array or map itself.
+Operations apply one after another, and operations on one array go in the
+order of indices, so the patch is applied in one pass over the document.
+Values and keys are copied as they are encoded in the documents, so
+apply_cbor_delta(old, cbor_delta(old, new)) == new as long as the maps in both
+documents keep the common keys in the same order (it is so if the documents
+are canonical or encoded with sort_keys). Otherwise the result is equal to new
+after decoding.
+
+The patch is "cborable" data like any other CBOR, so jsonable_from_cbor shows
+it as JSON, and cbor_from_jsonable converts it back.
+
+Comparison goes over the encoded bytes: equal subtrees are skipped by one
+comparison of their byte ranges, and only containers that differ are parsed.
+"""
+
+from bisect import bisect_left
+import io
+
+import cbor2
+
+from ._cbor_scan import _head, _item_end, _read_head
+from ._profiles import FAST_PROFILE, RawCbor
+
+_OP_OVERHEAD = 4  # approximate size of an operation besides its value
+_WINDOW = 0x10000  # bytes of data cbor2 decodes items from at once
+
+
+def _skip_tags(data, pos: int) -> int:
+    while data[pos] >> 5 == 6:
+        pos = _read_head(data, pos)[3]
+    return pos
+
+
+class _Document:
+    """
+    CBOR document with bounds of items found on demand
+    """
+
+    __slots__ = ("data", "_containers")
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(bytes(data)).toreadonly()  # its slices are hashable
+        self._containers: dict[int, tuple[int, bool, list[int]]] = {}  # big ones
+
+    def container(self, pos: int) -> tuple[int, bool, list[int]]:
+        """
+        :param pos: position of an array or a map head
+        :return: major type, True if definite length, and bounds of the items:
+            start of every item (keys and values for a map) and end of the last
+        """
+        found = self._containers.get(pos)
+        if found is not None:
+            return found
+        major, info, arg, item_pos = _read_head(self.data, pos)
+        if info == 31:
+            return major, False, self._item_bounds(item_pos, None)
+        return major, True, self._item_bounds(item_pos, arg * 2 if major == 5 else arg)
+
+    def _item_bounds(self, pos: int, count: int | None) -> list[int]:
+        """
+        :param pos: position of the first item
+        :param count: number of items; None for items up to a "break"
+        :return: start of every item and end of the last one
+        """
+        # cbor2 finds the ends of items much faster than _item_end does. It
+        # works on a window of data, so that a big item is not decoded whole.
+        data = self.data
+        bounds = [pos]
+        fp = decoder = None
+        base = pos
+        while count > 0 if count is not None else data[pos] != 0xFF:
+            if fp is None:
+                base = pos
+                fp = io.BytesIO(data[pos : pos + _WINDOW])
+                decoder = cbor2.CBORDecoder(fp)
+            fp.seek(pos - base)
+            try:
+                decoder.decode()  # type: ignore[union-attr]
+                pos = base + fp.tell()
+            except cbor2.CBORDecodeEOF:
+                fp = None
+                if pos > base:
+                    continue  # try again with the window starting at this item
+                pos = self._big_item_end(pos)
+            except Exception:  # e.g. a shared value referenced out of its context
+                pos = _item_end(data, pos)
+            bounds.append(pos)
+            if count is not None:
+                count -= 1
+        return bounds
+
+    def _big_item_end(self, pos: int) -> int:
+        major = self.data[pos] >> 5
+        if major in (4, 5):
+            found = self._containers[pos] = self.container(pos)
+            return found[2][-1] + (0 if found[1] else 1)  # "break"
+        if major == 6:
+            return self._item_bounds(_read_head(self.data, pos)[3], 1)[-1]
+        return _item_end(self.data, pos)
+
+
+# MARK: Comparison
+
+
+def _ops_size(ops: list) -> int:
+    return sum(_OP_OVERHEAD + (len(op[2].data) if len(op) > 2 else 0) for op in ops)
+
+
+def _diff(
+    old: _Document,
+    o_pos: int,
+    o_end: int,
+    new: _Document,
+    n_pos: int,
+    n_end: int,
+    path: list,
+    ops: list,
+):
+    o_data = old.data
+    n_data = new.data
+    if o_data[o_pos:o_end] == n_data[n_pos:n_end]:
+        return
+    o_inner = _skip_tags(o_data, o_pos)
+    n_inner = _skip_tags(n_data, n_pos)
+    major = o_data[o_inner] >> 5
+    if (
+        major in (4, 5)
+        and n_data[n_inner] >> 5 == major
+        and o_data[o_pos:o_inner] == n_data[n_pos:n_inner]
+    ):
+        sub_ops: list = []
+        o_bounds = old.container(o_inner)[2]
+        n_bounds = new.container(n_inner)[2]
+        if major == 4:
+            _diff_arrays(old, o_bounds, new, n_bounds, path, sub_ops)
+        else:
+            _diff_maps(old, o_bounds, new, n_bounds, path, sub_ops)
+        if _ops_size(sub_ops) < n_end - n_pos:
+            ops.extend(sub_ops)
+            return
+    ops.append(["set", path, RawCbor(bytes(n_data[n_pos:n_end]))])
+
+
+def _next_index(positions: dict, item, after: int) -> int | None:
+    """
+    :return: first index not less than after of an element equal to item
+    """
+    indices = positions.get(item)
+    if indices is None:
+        return None
+    found = bisect_left(indices, after)
+    return indices[found] if found < len(indices) else None
+
+
+def _diff_arrays(
+    old: _Document, o_bounds: list[int], new: _Document, n_bounds: list[int], path, ops
+):
+    o_data = old.data
+    n_data = new.data
+    o_len = len(o_bounds) - 1
+    n_len = len(n_bounds) - 1
+    o_idx = n_idx = 0  # skip equal elements at the start and at the end
+    while (
+        o_idx < o_len
+        and n_idx < n_len
+        and o_data[o_bounds[o_idx] : o_bounds[o_idx + 1]]
+        == n_data[n_bounds[n_idx] : n_bounds[n_idx + 1]]
+    ):
+        o_idx += 1
+        n_idx += 1
+    while (
+        o_len > o_idx
+        and n_len > n_idx
+        and o_data[o_bounds[o_len - 1] : o_bounds[o_len]]
+        == n_data[n_bounds[n_len - 1] : n_bounds[n_len]]
+    ):
+        o_len -= 1
+        n_len -= 1
+    o_items = {
+        idx: o_data[o_bounds[idx] : o_bounds[idx + 1]] for idx in range(o_idx, o_len)
+    }
+    n_items = {
+        idx: n_data[n_bounds[idx] : n_bounds[idx + 1]] for idx in range(n_idx, n_len)
+    }
+
+    # Greedy alignment of the rest: an element that is found ahead in the other
+    # array is kept, the elements before it are deleted or inserted. Elements
+    # that are not found are compared pairwise. Indices in the operations are
+    # n_idx, as the elements before it are already patched.
+    o_positions: dict = {}
+    for idx in range(o_idx, o_len):
+        o_positions.setdefault(o_items[idx], []).append(idx)
+    n_positions: dict = {}
+    for idx in range(n_idx, n_len):
+        n_positions.setdefault(n_items[idx], []).append(idx)
+    while o_idx < o_len and n_idx < n_len:
+        if o_items[o_idx] == n_items[n_idx]:
+            o_idx += 1
+            n_idx += 1
+            continue
+        o_found = _next_index(o_positions, n_items[n_idx], o_idx)
+        n_found = _next_index(n_positions, o_items[o_idx], n_idx)
+        if o_found is None and n_found is None:
+            _diff(
+                old,
+                o_bounds[o_idx],
+                o_bounds[o_idx + 1],
+                new,
+                n_bounds[n_idx],
+                n_bounds[n_idx + 1],
+                path + [n_idx],
+                ops,
+            )
+            o_idx += 1
+            n_idx += 1
+        elif n_found is not None and (
+            o_found is None or n_found - n_idx <= o_found - o_idx
+        ):
+            for idx in range(n_idx, n_found):
+                ops.append(["insert", path + [idx], RawCbor(bytes(n_items[idx]))])
+            n_idx = n_found
+        else:
+            assert o_found is not None
+            for _ in range(o_idx, o_found):
+                ops.append(["delete", path + [n_idx]])
+            o_idx = o_found
+    for _ in range(o_idx, o_len):
+        ops.append(["delete", path + [n_idx]])
+    for idx in range(n_idx, n_len):
+        ops.append(["insert", path + [idx], RawCbor(bytes(n_items[idx]))])
+
+
+def _diff_maps(
+    old: _Document, o_bounds: list[int], new: _Document, n_bounds: list[int], path, ops
+):
+    old_pairs = {
+        bytes(old.data[o_bounds[idx] : o_bounds[idx + 1]]): idx
+        for idx in range(0, len(o_bounds) - 1, 2)
+    }
+    new_keys = [
+        bytes(new.data[n_bounds[idx] : n_bounds[idx + 1]])
+        for idx in range(0, len(n_bounds) - 1, 2)
+    ]
+    # deletions go first, so insert positions are right when inserts are applied
+    new_key_set = set(new_keys)
+    for key in old_pairs:
+        if key not in new_key_set:
+            ops.append(["delete", path + [RawCbor(key)]])
+    inserts = []
+    for idx, key in zip(range(0, len(n_bounds) - 1, 2), new_keys):
+        old_idx = old_pairs.get(key)
+        if old_idx is None:
+            value = bytes(new.data[n_bounds[idx + 1] : n_bounds[idx + 2]])
+            inserts.append(["insert", path + [RawCbor(key)], RawCbor(value), idx // 2])
+        else:
+            _diff(
+                old,
+                o_bounds[old_idx + 1],
+                o_bounds[old_idx + 2],
+                new,
+                n_bounds[idx + 1],
+                n_bounds[idx + 2],
+                path + [RawCbor(key)],
+                ops,
+            )
+    ops.extend(inserts)
+
+
+def cbor_delta(old: bytes, new: bytes) -> bytes:
+    """
+    :param old: CBOR document
+    :param new: changed CBOR document
+    :return: CBOR patch that turns old into new; see the module docstring
+    """
+    ops: list = []
+    _diff(_Document(old), 0, len(old), _Document(new), 0, len(new), [], ops)
+    return FAST_PROFILE.dumps(ops)
+
+
+# MARK: Application
+
+
+def _mismatch(what: str) -> ValueError:
+    return ValueError(f"Delta does not match the document: {what}")
+
+
+def _apply(doc: _Document, pos: int, end: int, ops: list, depth: int, out: list):
+    """
+    Writes the item at doc.data[pos:end] with operations applied to out.
+    :param ops: operations (path, kind, value, position) on the item;
+        path[depth:] is the path relative to the item
+    """
+    path, kind, value, _ = ops[0]
+    if len(path) == depth:
+        if len(ops) > 1 or kind != "set":
+            raise _mismatch(f"cannot {kind} the whole item")
+        out.append(value)
+        return
+    data = doc.data
+    inner = _skip_tags(data, pos)
+    if data[inner] >> 5 not in (4, 5):
+        raise _mismatch("path goes into a scalar")
+    major, definite, bounds = doc.container(inner)
+    body: list = []
+    if major == 4:
+        count = _apply_to_array(doc, bounds, ops, depth, body)
+    else:
+        count = _apply_to_map(doc, bounds, ops, depth, body)
+    out.append(data[pos:inner])  # tags
+    if definite:
+        out.append(_head(major, count))
+        out.extend(body)
+    else:
+        out.append(data[inner : inner + 1])
+        out.extend(body)
+        out.append(b"\xff")
+
+
+def _apply_to_array(
+    doc: _Document, bounds: list[int], ops: list, depth: int, out: list
+) -> int:
+    """
+    :return: number of elements in the result
+    """
+    data = doc.data
+    length = len(bounds) - 1
+    old_idx = new_idx = 0
+    op_idx = 0
+    while op_idx < len(ops):
+        path, kind, value, _ = ops[op_idx]
+        at = cbor2.loads(path[depth])
+        if not isinstance(at, int) or at < new_idx or old_idx + at - new_idx > length:
+            raise _mismatch(f"bad index {at!r}")
+        out.append(data[bounds[old_idx] : bounds[old_idx + at - new_idx]])
+        old_idx += at - new_idx
+        new_idx = at
+        if kind == "insert" and len(path) == depth + 1:
+            out.append(value)
+            new_idx += 1
+            op_idx += 1
+            continue
+        if old_idx == length:
+            raise _mismatch(f"bad index {at!r}")
+        next_idx = op_idx + 1
+        if len(path) > depth + 1:
+            while (
+                next_idx < len(ops)
+                and len(ops[next_idx][0]) > depth + 1
+                and ops[next_idx][0][depth] == path[depth]
+            ):
+                next_idx += 1
+            _apply(
+                doc,
+                bounds[old_idx],
+                bounds[old_idx + 1],
+                ops[op_idx:next_idx],
+                depth + 1,
+                out,
+            )
+            new_idx += 1
+        elif kind == "set":
+            out.append(value)
+            new_idx += 1
+        old_idx += 1  # "delete" just skips the element
+        op_idx = next_idx
+    out.append(data[bounds[old_idx] : bounds[length]])
+    return new_idx + length - old_idx
+
+
+def _apply_to_map(
+    doc: _Document, bounds: list[int], ops: list, depth: int, out: list
+) -> int:
+    """
+    :return: number of pairs in the result
+    """
+    data = doc.data
+    key_ops: dict = {}  # encoded key -> operations
+    inserts = []
+    for op in ops:
+        if op[1] == "insert" and len(op[0]) == depth + 1:
+            inserts.append(op)
+        else:
+            key_ops.setdefault(op[0][depth], []).append(op)
+    inserts.reverse()  # to pop them from the end
+
+    count = 0
+    for idx in range(0, len(bounds) - 1, 2):
+        while inserts and inserts[-1][3] == count:
+            path, _, value, _ = inserts.pop()
+            out.append(path[depth])
+            out.append(value)
+            count += 1
+        pair_ops = key_ops.pop(data[bounds[idx] : bounds[idx + 1]], None)
+        if pair_ops is None:
+            out.append(data[bounds[idx] : bounds[idx + 2]])
+            count += 1
+        elif (
+            len(pair_ops) == 1
+            and pair_ops[0][1] == "delete"
+            and len(pair_ops[0][0]) == depth + 1
+        ):
+            pass
+        else:
+            out.append(data[bounds[idx] : bounds[idx + 1]])
+            _apply(doc, bounds[idx + 1], bounds[idx + 2], pair_ops, depth + 1, out)
+            count += 1
+    while inserts and inserts[-1][3] == count:
+        path, _, value, _ = inserts.pop()
+        out.append(path[depth])
+        out.append(value)
+        count += 1
+    if inserts:
+        raise _mismatch(f"bad position {inserts[-1][3]!r}")
+    if key_ops:
+        raise _mismatch("key not found")
+    return count
+
+
+def _parse_ops(delta: _Document) -> list:
+    """
+    :return: list of (path, kind, value, position), where path is a list of
+        encoded keys and indices, and value is encoded
+    """
+    data = delta.data
+    ops = []
+    for op_start in delta.container(0)[2][:-1]:
+        op_bounds = delta.container(op_start)[2]
+        kind = cbor2.loads(data[op_bounds[0] : op_bounds[1]])
+        if kind not in ("set", "delete", "insert") or len(op_bounds) < 3:
+            raise ValueError(f"Bad delta operation {kind!r}")
+        path_bounds = delta.container(op_bounds[1])[2]
+        path = [
+            data[path_bounds[idx] : path_bounds[idx + 1]]
+            for idx in range(len(path_bounds) - 1)
+        ]
+        value = data[op_bounds[2] : op_bounds[3]] if len(op_bounds) > 3 else None
+        position = (
+            cbor2.loads(data[op_bounds[3] : op_bounds[4]])
+            if len(op_bounds) > 4
+            else None
+        )
+        if kind != "delete" and value is None:
+            raise ValueError(f"Bad delta operation {kind!r}: no value")
+        ops.append((path, kind, value, position))
+    return ops
+
+
+def apply_cbor_delta(old: bytes, delta: bytes) -> bytes:
+    """
+    :param old: CBOR document
+    :param delta: patch made by cbor_delta
+    :return: the changed CBOR document
+    """
+    ops = _parse_ops(_Document(delta))
+    if not ops:
+        return bytes(old)
+    out: list = []
+    _apply(_Document(old), 0, len(old), ops, 0, out)
+    return b"".join(out)
@@ -0,0 +1,199 @@
+"""
+Memoized encoding of immutable subtrees.
+
+Class:
+- EncodeCache - LRU cache of encoded immutable subtrees for cbor_from_native
+
+Tuples, frozensets and cbor2.FrozenDicts that contain only immutable values are
+looked up in the cache. On a hit previously encoded bytes are spliced into the
+output instead of walking and encoding the subtree again. Keys are built from
+values and their types, so equal-but-differently-encoded values like 1, 1.0 and
+True never share an entry. With profiles that neither sort nor canonicalize,
+keys also keep the order of map items and set elements. Lookups of the very
+object that was cached skip building the key: the cache holds a reference to
+the object, so its id cannot be reused while the entry exists.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, date
+from decimal import Decimal
+from fractions import Fraction
+from ipaddress import IPv4Address, IPv4Network, IPv6Address, IPv6Network
+from threading import Lock
+from uuid import UUID
+
+import cbor2
+
+from ._profiles import EncoderProfile, RawCbor
+
+_KEY_BY_VALUE = (
+    str,
+    int,
+    bool,
+    bytes,
+    Fraction,
+    UUID,
+    IPv4Address,
+    IPv4Network,
+    IPv6Address,
+    IPv6Network,
+    cbor2.CBORSimpleValue,
+)
+_KEY_BY_STR = (float, Decimal, datetime, date)  # equal values may differ in encoding
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def _typed_key(val, ordered: bool = False):
+    """
+    :param ordered: the encoding follows the iteration order of maps and sets,
+        so the key keeps it
+    """
+    val_type = type(val)
+    if val is None or val is cbor2.undefined:
+        return val_type
+    if val_type is tuple:
+        return (tuple, tuple(_typed_key(el, ordered) for el in val))
+    if val_type is frozenset:
+        elements = (_typed_key(el, ordered) for el in val)
+        return (frozenset, tuple(elements) if ordered else frozenset(elements))
+    if val_type is cbor2.FrozenDict:
+        items = (
+            (_typed_key(k, ordered), _typed_key(v, ordered)) for k, v in val.items()
+        )
+        return (cbor2.FrozenDict, tuple(items) if ordered else frozenset(items))
+    if isinstance(val, _KEY_BY_VALUE):
+        return (val_type, val)
+    if isinstance(val, _KEY_BY_STR):
+        return (val_type, repr(val))
+    raise _Uncacheable()
+
+
+class EncodeCache:
+    """
+    Thread-safe LRU cache of encoded immutable subtrees.
+    Pass it to cbor_from_native. One cache can be shared by many threads and
+    used with different encoder profiles.
+    Statistics: hits, misses, evictions, entries, size_bytes.
+    """
+
+    def __init__(
+        self, max_entries: int = 1024, max_bytes: int = 64 << 20, min_size: int = 32
+    ):
+        """
+        :param max_entries: maximal number of cached subtrees
+        :param max_bytes: maximal total size of cached encodings
+        :param min_size: encodings shorter than this are not worth caching
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.hits = self.misses = self.evictions = 0
+        self.size_bytes = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> (native, raw)
+        self._keys_by_id: dict = {}  # id(native) -> key
+        self._lock = Lock()
+
+    @property
+    def entries(self) -> int:
+        """
+        Number of cached subtrees
+        """
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Removes all entries. Statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_id.clear()
+            self.size_bytes = 0
+
+    def _get_by_id(self, native, profile_key) -> RawCbor | None:
+        with self._lock:
+            key = self._keys_by_id.get(id(native))
+            if key is None or key[0] != profile_key:
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][1]
+
+    def _get(self, key) -> RawCbor | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _put(self, key, native, raw: RawCbor):
+        size = len(raw.data)
+        if size < self.min_size or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (native, raw)
+            self._keys_by_id[id(native)] = key
+            self.size_bytes += size
+            while (
+                len(self._entries) > self.max_entries
+                or self.size_bytes > self.max_bytes
+            ):
+                evicted_key, (evicted_native, evicted_raw) = self._entries.popitem(
+                    last=False
+                )
+                if self._keys_by_id.get(id(evicted_native)) == evicted_key:
+                    del self._keys_by_id[id(evicted_native)]
+                self.size_bytes -= len(evicted_raw.data)
+                self.evictions += 1
+
+    def _memo(self, profile: EncoderProfile) -> "_Memo":
+        return _Memo(self, profile)
+
+    def __repr__(self):
+        return (
+            f"<EncodeCache entries={self.entries} size_bytes={self.size_bytes} "
+            f"hits={self.hits} misses={self.misses} evictions={self.evictions}>"
+        )
+
+
+class _Memo:
+    """
+    Binds a cache to the encoder profile of one cbor_from_native call
+    """
+
+    def __init__(self, cache: EncodeCache, profile: EncoderProfile):
+        self.cache = cache
+        self.profile = profile
+        self.profile_key = (
+            profile.canonical,
+            profile.sort_keys,
+            profile.datetime_as_timestamp,
+            profile.timezone,
+        )
+        self.ordered = not (profile.canonical or profile.sort_keys)
+
+    def lookup(self, native, encode_subtree) -> RawCbor | None:
+        """
+        :param native: tuple, frozenset or FrozenDict
+        :param encode_subtree: function that makes "cborable" from native
+        :return: encoded subtree, or None if the subtree is not cacheable
+        """
+        raw = self.cache._get_by_id(native, self.profile_key)
+        if raw is not None:
+            return raw
+        try:
+            key = (self.profile_key, _typed_key(native, self.ordered))
+        except (_Uncacheable, TypeError):
+            return None
+        raw = self.cache._get(key)
+        if raw is None:
+            raw = RawCbor(self.profile.dumps(encode_subtree(native), presorted=True))
+            self.cache._put(key, native, raw)
+        return raw
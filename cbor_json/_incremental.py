@@ -0,0 +1,78 @@
+"""
+Push-style decoding of CBOR streams.
+
+Class:
+- IncrementalDecoder - decodes CBOR items from arbitrary fragments of a stream
+"""
+
+from typing import Callable
+
+from cbor2 import CBORDecodeEOF
+
+from ._cbor_scan import _ItemScanner
+from ._cbor_json_codecs import native_from_cbor
+
+
+class IncrementalDecoder:
+    """
+    Decodes a stream of consecutive CBOR items (a CBOR sequence) that arrives in
+    arbitrary fragments, e.g. from non-blocking socket reads.
+    Fragments are not re-parsed from the beginning on every call: the decoder
+    keeps its parse state, and every complete item is decoded exactly once.
+
+    >>> decoder = IncrementalDecoder()
+    >>> decoder.feed(b"\\x83\\x01")
+    []
+    >>> decoder.feed(b"\\x02\\x03\\x04")
+    [[1, 2, 3], 4]
+    """
+
+    def __init__(self, convert: Callable = native_from_cbor):
+        """
+        :param convert: function to apply to CBOR bytes of every complete item;
+            native_from_cbor by default. Use jsonable_from_cbor to get jsonable
+            items, or a functools.partial to pass options.
+        """
+        self.convert = convert
+        self._buffer = bytearray()
+        self._scanner = _ItemScanner()
+
+    @property
+    def pending_bytes(self) -> int:
+        """
+        Number of buffered bytes of an incomplete item
+        """
+        return len(self._buffer)
+
+    def feed(self, chunk: bytes) -> list:
+        """
+        :param chunk: next fragment of the stream
+        :return: list of decoded items completed by this fragment
+        """
+        self._buffer += chunk
+        ends = self._scanner.scan(self._buffer)
+        if not ends:
+            return []
+        res = []
+        start = 0
+        view = memoryview(self._buffer)
+        try:
+            for end in ends:
+                item, start = view[start:end].tobytes(), end
+                res.append(self.convert(item))
+        finally:
+            # Items are consumed even if conversion fails
+            view.release()
+            del self._buffer[:start]
+            self._scanner.shift(start)
+        return res
+
+    def close(self):
+        """
+        Checks that the stream did not end inside an item.
+        Raises CBORDecodeEOF if it did.
+        """
+        if self._buffer:
+            raise CBORDecodeEOF(
+                f"Stream ended inside an item ({len(self._buffer)} bytes pending)"
+            )
@@ -0,0 +1,175 @@
+"""
+Opt-in instrumentation of conversions.
+
+Classes:
+- ConversionStats - statistics of one conversion call
+
+Function:
+- instrumented - context manager that enables statistics collection
+
+Usage:
+    with cbor_json.instrumented(callback=print, sample_rate=0.01) as collected:
+        ...  # conversions here are sampled
+
+Every sampled conversion call inside the block produces a ConversionStats object.
+It is passed to the callback, or, if there is no callback, appended to the list
+returned by the context manager. Outside of the block conversions run without
+any bookkeeping.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from random import random
+from time import perf_counter
+from typing import Callable
+
+import cbor2
+
+from ._custom_objects_base import SerializableToCbor
+
+
+class ConversionStats:
+    """
+    Statistics of one conversion call.
+    - conversion - name of the conversion function, e.g. "native_from_cbor"
+    - input_size, output_size - sizes in bytes of CBOR input and output; None for
+      native and jsonable data
+    - phases - seconds spent in each phase, e.g. {"cbor_decode": .., "to_native": ..}
+    - python_types - number of nodes per Python type name
+    - cbor_tags - number of CBOR tags per tag number
+    - class_tags - number of custom objects per class tag
+    - json_types - number of "$type" envelopes per type in the jsonable side
+    - nodes - total number of nodes
+    - max_depth - maximal nesting depth (a scalar has depth 0)
+    """
+
+    def __init__(self, conversion: str):
+        self.conversion = conversion
+        self.input_size: int | None = None
+        self.output_size: int | None = None
+        self.phases: dict[str, float] = {}
+        self.python_types: Counter = Counter()
+        self.cbor_tags: Counter = Counter()
+        self.class_tags: Counter = Counter()
+        self.json_types: Counter = Counter()
+        self.nodes = 0
+        self.max_depth = 0
+
+    @property
+    def total_time(self) -> float:
+        """
+        Sum of all phase times in seconds
+        """
+        return sum(self.phases.values())
+
+    def __repr__(self):
+        return (
+            f"<ConversionStats {self.conversion}: {self.nodes} nodes, "
+            f"max depth {self.max_depth}, {self.total_time * 1000:.3f} ms>"
+        )
+
+
+class _Instrumentation:
+    def __init__(self, callback, sample_rate):
+        self.callback = callback
+        self.sample_rate = sample_rate
+        self.collected: list[ConversionStats] = []
+
+
+_ACTIVE: ContextVar[_Instrumentation | None] = ContextVar(
+    "cbor_json_instrumentation", default=None
+)
+
+
+@contextmanager
+def instrumented(
+    callback: Callable[[ConversionStats], None] | None = None,
+    sample_rate: float = 1.0,
+):
+    """
+    Enables statistics collection for conversions made inside the block.
+    :param callback: function to call with ConversionStats of every sampled call
+    :param sample_rate: fraction of calls to instrument, from 0.0 to 1.0
+    :return: list that receives ConversionStats of every sampled call if there
+        is no callback
+    """
+    instr = _Instrumentation(callback, sample_rate)
+    token = _ACTIVE.set(instr)
+    try:
+        yield instr.collected
+    finally:
+        _ACTIVE.reset(token)
+
+
+def _size_of(data) -> int | None:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return len(data)
+    return None
+
+
+def _walk(obj, stats: ConversionStats, count_types: bool, depth: int = 0):
+    stats.nodes += 1
+    if depth > stats.max_depth:
+        stats.max_depth = depth
+    if count_types:
+        stats.python_types[type(obj).__name__] += 1
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        for el in obj:
+            _walk(el, stats, count_types, depth + 1)
+    elif isinstance(obj, (dict, cbor2.FrozenDict)):
+        val_type = obj.get("$type")
+        if not count_types and isinstance(val_type, str):
+            stats.json_types[val_type] += 1
+        for key, val in obj.items():
+            _walk(key, stats, count_types, depth + 1)
+            _walk(val, stats, count_types, depth + 1)
+    elif isinstance(obj, cbor2.CBORTag):
+        stats.cbor_tags[obj.tag] += 1
+        if obj.tag == 27 and isinstance(obj.value, list) and obj.value:
+            stats.class_tags[obj.value[0]] += 1
+        _walk(obj.value, stats, count_types, depth + 1)
+    elif isinstance(obj, SerializableToCbor):
+        stats.class_tags[obj.cbor_cc_classtag] += 1
+        for el in obj.get_cbor_cc_values() or []:
+            _walk(el, stats, count_types, depth + 1)
+
+
+def _convert(conversion: str, data, *phases, jsonable_side: str | None = None):
+    """
+    Runs data through the phases of a conversion.
+    :param conversion: name of the conversion
+    :param data: conversion input
+    :param phases: (phase name, function) pairs; the result of the first phase
+        is the "cborable" intermediate form
+    :param jsonable_side: "input" or "output" if the conversion deals with
+        jsonable data
+    """
+    instr = _ACTIVE.get()
+    if instr is None or (instr.sample_rate < 1.0 and random() >= instr.sample_rate):
+        for _, func in phases:
+            data = func(data)
+        return data
+
+    stats = ConversionStats(conversion)
+    stats.input_size = _size_of(data)
+    if jsonable_side == "input":
+        _walk(data, stats, count_types=False)
+    cborable = None
+    for idx, (phase_name, func) in enumerate(phases):
+        started = perf_counter()
+        data = func(data)
+        stats.phases[phase_name] = perf_counter() - started
+        if idx == 0:
+            cborable = data
+    stats.output_size = _size_of(data)
+    if jsonable_side == "output":
+        _walk(data, stats, count_types=False)
+    stats.nodes = stats.max_depth = 0  # count nodes of the cborable form only
+    _walk(cborable, stats, count_types=True)
+
+    if instr.callback is not None:
+        instr.callback(stats)
+    else:
+        instr.collected.append(stats)
+    return data
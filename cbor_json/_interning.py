@@ -0,0 +1,77 @@
+"""
+Sharing of repeated strings between decoded records.
+
+Class:
+- StringInterner - bounded table of strings for native_from_cbor and
+  native_from_jsonable
+
+Every decoded record normally gets its own copy of every map key, so a million
+records with the same ten keys hold ten million key strings. With an interner
+equal strings in the result are one object. The interner can be used for one
+call, or kept and passed to many calls to share strings between their results.
+"""
+
+import sys
+
+
+class StringInterner:
+    """
+    Bounded table of strings to share between decoded records.
+    Map keys are always interned; string values only if values is True.
+    When the table is full, new strings are not added, but the ones in the
+    table are still shared.
+    Statistics: hits, misses, entries, saved_bytes. They are approximate if
+    one interner is used by many threads at once.
+    """
+
+    def __init__(
+        self, max_entries: int = 65536, max_length: int = 64, values: bool = False
+    ):
+        """
+        :param max_entries: maximal number of strings in the table
+        :param max_length: longer strings are not interned
+        :param values: intern string values too, not only map keys
+        """
+        self.max_entries = max_entries
+        self.max_length = max_length
+        self.values = values
+        self.hits = self.misses = 0
+        self.saved_bytes = 0  # size of the duplicates that were replaced
+        self._table: dict[str, str] = {}
+
+    @property
+    def entries(self) -> int:
+        """
+        Number of strings in the table
+        """
+        return len(self._table)
+
+    def clear(self):
+        """
+        Removes all strings. Statistics are kept.
+        """
+        self._table.clear()
+
+    def __call__(self, val):
+        """
+        :return: the interned string equal to val, if val is a short enough
+            string; val otherwise
+        """
+        if type(val) is not str or len(val) > self.max_length:
+            return val
+        found = self._table.get(val)
+        if found is None:
+            self.misses += 1
+            if len(self._table) < self.max_entries:
+                self._table[val] = val
+            return val
+        if found is not val:
+            self.hits += 1
+            self.saved_bytes += sys.getsizeof(val)
+        return found
+
+    def __repr__(self):
+        return (
+            f"<StringInterner entries={self.entries} hits={self.hits} "
+            f"misses={self.misses} saved_bytes={self.saved_bytes}>"
+        )
@@ -0,0 +1,231 @@
+"""
+Conversion between 'native' data and JSON text in one pass.
+
+Functions:
+- native_from_json - parses JSON text to native data
+- json_from_native - serializes native data to JSON text
+
+native_from_json converts "$type" objects in the object_hook of json.loads, so
+the native tree is the only tree built. json_from_native lets the json encoder
+write lists, plain dicts and JSON scalars as they are, and converts other
+values in its default hook. Dicts that become "map" objects (non-string keys or
+a "$type" key) must be found before the encoder sees them, so a walk over the
+containers goes first; it copies only containers that hold such dicts.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterator
+from datetime import date, timedelta
+from itertools import chain
+import json
+from typing import IO, TYPE_CHECKING
+
+import cbor2
+
+from ._cbor_json_codecs import (
+    _cborable_from_jsonable,
+    _cborable_from_native,
+    _custom_object,
+    _freeze,
+    _jsonable_from_cborable,
+    _native_from_cborable,
+)
+from ._streaming import StreamedMap
+
+if TYPE_CHECKING:
+    from ._blob_store import BlobStore
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+_NOT_READ = object()
+
+
+# MARK: JSON->Native
+
+
+def _native_from_json_object(obj: dict, blob_store: BlobStore | None):
+    """
+    object_hook: values in obj are native already
+    """
+    if "$type" not in obj:
+        return obj
+    val_type = obj["$type"]
+    if val_type == "map":
+        assert isinstance(obj["$value"], list)
+        res = {}
+        for kv_pair in obj["$value"]:
+            assert isinstance(kv_pair, list)
+            assert len(kv_pair) == 2
+            res[_freeze(kv_pair[0])] = kv_pair[1]
+        return res
+    if val_type == "set":
+        assert isinstance(obj["$value"], list)
+        return set(_freeze(el) for el in obj["$value"])
+    if val_type == "tagged-value":
+        # same handling as in _native_from_cborable
+        if obj["$cbor_tag"] == 100:
+            return date(1970, 1, 1) + timedelta(days=obj["$value"])
+        if obj["$cbor_tag"] == 27:  # http://cbor.schmorp.de/generic-object
+            assert isinstance(obj["$value"], list)
+            assert len(obj["$value"]) > 0
+            assert isinstance(obj["$value"][0], str)
+            assert obj["$value"][0]
+            return _custom_object(obj["$value"][0], obj["$value"][1:])
+        return cbor2.CBORTag(obj["$cbor_tag"], obj["$value"])
+    if val_type == "custom-object":
+        assert obj["$class_tag"]
+        assert isinstance(obj["$value"], list)
+        return _custom_object(obj["$class_tag"], obj["$value"])
+    # scalars: their "$value"s are not touched by the hook
+    return _native_from_cborable(_cborable_from_jsonable(obj, blob_store=blob_store))
+
+
+def native_from_json(text_or_fp, blob_store: BlobStore | None = None):
+    """
+    Same as native_from_jsonable(json.loads(text)) without the intermediate
+    jsonable tree
+    :param text_or_fp: JSON str or bytes, or a file object to read it from
+    :param blob_store: store to resolve "binary-ref" and "mime-ref" values from
+    :return: native data
+    """
+
+    def object_hook(obj):
+        return _native_from_json_object(obj, blob_store)
+
+    if hasattr(text_or_fp, "read"):
+        return json.load(text_or_fp, object_hook=object_hook)
+    return json.loads(text_or_fp, object_hook=object_hook)
+
+
+# MARK: Native->JSON
+
+
+class _ArrayStream(list):
+    """
+    Iterator written by the pure-Python json encoder as an array while it
+    produces items. The encoder checks lists with isinstance, tests them for
+    emptiness and iterates over them.
+    """
+
+    def __init__(self, source: Iterator, prepare):
+        super().__init__()
+        self.source = source
+        self.prepare = prepare
+        self.first = _NOT_READ
+
+    def __bool__(self):
+        # the encoder writes "[" with the first item, so it must know of it
+        if self.first is _NOT_READ:
+            self.first = next(self.source, _NOT_READ)
+            if self.first is _NOT_READ:
+                self.source = iter(())
+                return False
+            self.source = chain((self.first,), self.source)
+        return True
+
+    def __iter__(self):
+        return (self.prepare(el) for el in self.source)
+
+
+class _ObjectStream(dict):
+    """
+    StreamedMap written by the pure-Python json encoder as an object while it
+    produces pairs. Keys must be strings.
+    """
+
+    def __init__(self, source: StreamedMap, prepare):
+        super().__init__()
+        self.source = source
+        self.prepare = prepare
+
+    def __bool__(self):
+        return True
+
+    def items(self):  # type: ignore[override]
+        for key, value in self.source.pairs:
+            if not isinstance(key, str) or key == "$type":
+                raise ValueError(f"Cannot stream a map with key {key!r} to JSON")
+            yield key, self.prepare(value)
+
+
+class _Preparer:
+    """
+    Makes native data ready for the json encoder, see the module docstring
+    """
+
+    def __init__(self, blob_store: BlobStore | None, streaming: bool):
+        self.blob_store = blob_store
+        self.streaming = streaming
+        self.path_ids: set[int] = set()
+
+    def jsonable(self, native):
+        """
+        default hook of the encoder
+        """
+        if isinstance(native, (Iterator, StreamedMap)):
+            return self.prepare(native)
+        return _jsonable_from_cborable(_cborable_from_native(native), self.blob_store)
+
+    def prepare(self, native):
+        """
+        :return: native itself if the encoder can take it, or a replacement
+        """
+        if type(native) in _JSON_SCALARS:
+            return native
+        if isinstance(native, StreamedMap):
+            if self.streaming:
+                return _ObjectStream(native, self.prepare)
+            native = dict(native.pairs)
+        elif isinstance(native, Iterator):
+            if self.streaming:
+                return _ArrayStream(native, self.prepare)
+            return [self.prepare(el) for el in native]
+        if isinstance(native, dict):
+            if "$type" in native or not all(isinstance(k, str) for k in native):
+                return self.jsonable(native)  # a "map" object
+            items = native.items()
+        elif isinstance(native, cbor2.CBORSimpleValue):
+            # a namedtuple, the encoder would write it as an array
+            return self.jsonable(native)
+        elif isinstance(native, (list, tuple)):
+            items = enumerate(native)
+        else:
+            return native  # left to the default hook
+
+        this_id = id(native)
+        if this_id in self.path_ids:
+            raise ValueError("Cannot encode a recursively linked structure")
+        self.path_ids.add(this_id)
+        res = native
+        for key, value in items:
+            prepared = self.prepare(value)
+            if prepared is not value:
+                if res is native:  # copy on the first change
+                    res = dict(native) if isinstance(native, dict) else list(native)
+                res[key] = prepared
+        self.path_ids.remove(this_id)
+        return res
+
+
+def json_from_native(
+    native, fp: IO[str] | None = None, blob_store: BlobStore | None = None
+) -> str | None:
+    """
+    Same as json.dumps(jsonable_from_native(native)) without the intermediate
+    jsonable tree. With a file object the text is written while it is made,
+    and iterators (e.g. generators) in the data are written as arrays, and
+    StreamedMaps as objects, while they produce items. Without a file object
+    they are collected.
+    :param native: 'native' data
+    :param fp: text file object to write to
+    :param blob_store: optional store for binaries longer than its threshold
+    :return: JSON text, or None if it is written to fp
+    """
+    preparer = _Preparer(blob_store, streaming=fp is not None)
+    encoder = json.JSONEncoder(default=preparer.jsonable)
+    prepared = preparer.prepare(native)
+    if fp is None:
+        return encoder.encode(prepared)
+    for chunk in encoder.iterencode(prepared):
+        fp.write(chunk)
+    return None
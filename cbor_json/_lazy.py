@@ -0,0 +1,60 @@
+"""
+Deferred type checks for rarely used types.
+
+Modules like email.message, uuid or fractions take noticeable time to import,
+and most programs never convert values of their types. An object cannot be an
+instance of a class whose module is not imported yet, so the checks find the
+classes in sys.modules instead of importing them.
+"""
+
+from importlib import import_module
+import sys
+from typing import Any
+
+
+class _NotLoaded:
+    """
+    Stands for a class whose module is not imported: nothing is its instance
+    """
+
+
+def _loaded_class(module: str, name: str) -> Any:
+    """
+    :return: the class if its module is imported, _NotLoaded otherwise
+    """
+    mod = sys.modules.get(module)
+    return getattr(mod, name, _NotLoaded) if mod is not None else _NotLoaded
+
+
+def _imported_class(module: str, name: str) -> Any:
+    """
+    :return: the class; its module is imported if it is not yet
+    """
+    mod = sys.modules.get(module)
+    if mod is None:
+        mod = import_module(module)
+    return getattr(mod, name)
+
+
+class _LoadedClasses:
+    """
+    Callable that returns a tuple (to use in isinstance) of those of the given
+    classes whose modules are already imported
+    """
+
+    def __init__(self, *qualnames: str):
+        """
+        :param qualnames: module and class names like "uuid.UUID"
+        """
+        self._specs = [tuple(qualname.rsplit(".", 1)) for qualname in qualnames]
+        # (found classes, size of sys.modules they were found at); replaced as
+        # a whole, so threads never see a half-updated state
+        self._state: tuple[tuple[type, ...], int] = ((), -1)
+
+    def __call__(self) -> tuple[type, ...]:
+        classes, modules_count = self._state
+        if modules_count != len(sys.modules) and len(classes) < len(self._specs):
+            found = [_loaded_class(module, name) for module, name in self._specs]
+            classes = tuple(cls for cls in found if cls is not _NotLoaded)
+            self._state = (classes, len(sys.modules))
+        return classes
@@ -0,0 +1,126 @@
+"""
+Parallel decoding of big top-level CBOR arrays.
+
+Functions:
+- native_from_cbor_parallel - parallel native_from_cbor for arrays
+- jsonable_from_cbor_parallel - parallel jsonable_from_cbor for arrays
+
+Boundaries of the array elements are found by reading data item heads only,
+then runs of elements are decoded as separate arrays on a pool of workers, and
+the results are concatenated in order. Anything that cannot be split this way
+(not an array, too small, damaged, or using shared values or string references)
+is decoded sequentially, so the result always equals the sequential one.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import os
+import sys
+from typing import Callable, TYPE_CHECKING
+
+from ._cbor_scan import _array_item_bounds, _head
+from ._cbor_json_codecs import native_from_cbor, jsonable_from_cbor
+
+if TYPE_CHECKING:
+    from ._blob_store import BlobStore
+
+_MIN_CHUNK_SIZE = 1 << 16
+
+
+def _default_executor(max_workers: int | None) -> Executor:
+    """
+    Threads on free-threaded Python, processes otherwise
+    """
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    if gil_enabled:
+        return ProcessPoolExecutor(max_workers)
+    return ThreadPoolExecutor(max_workers)
+
+
+def _decode_parallel(
+    data: bytes,
+    convert: Callable,
+    executor: Executor | None,
+    max_workers: int | None,
+    chunk_size: int | None,
+) -> list:
+    workers = max_workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(len(data) // (4 * workers), _MIN_CHUNK_SIZE)
+    bounds = None
+    if len(data) >= 2 * chunk_size:
+        bounds = _array_item_bounds(data)
+    if not bounds:
+        return convert(data)
+
+    chunks = []  # CBOR arrays of element runs
+    first = 0
+    for idx in range(1, len(bounds)):
+        if bounds[idx] - bounds[first] >= chunk_size or idx == len(bounds) - 1:
+            chunks.append(_head(4, idx - first) + data[bounds[first] : bounds[idx]])
+            first = idx
+    if len(chunks) < 2:
+        return convert(data)
+
+    own_executor = executor is None
+    if executor is None:
+        executor = _default_executor(max_workers)
+    try:
+        res = []
+        for part in executor.map(convert, chunks):
+            res.extend(part)
+        return res
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+
+def native_from_cbor_parallel(
+    data: bytes,
+    executor: Executor | None = None,
+    max_workers: int | None = None,
+    chunk_size: int | None = None,
+):
+    """
+    Same as native_from_cbor, but elements of a big top-level array are
+    decoded in parallel.
+    :param data: CBOR bytes
+    :param executor: executor to run on; if not given, a pool is created (and
+        shut down at the end): threads on free-threaded Python, processes
+        otherwise
+    :param max_workers: size of the created pool
+    :param chunk_size: approximate size of the part of data for one task
+    :return: decoded 'native' data
+    """
+    return _decode_parallel(data, native_from_cbor, executor, max_workers, chunk_size)
+
+
+def jsonable_from_cbor_parallel(
+    data: bytes,
+    blob_store: BlobStore | None = None,
+    executor: Executor | None = None,
+    max_workers: int | None = None,
+    chunk_size: int | None = None,
+):
+    """
+    Same as jsonable_from_cbor, but elements of a big top-level array are
+    decoded in parallel.
+    :param data: CBOR bytes
+    :param blob_store: optional store for binaries longer than its threshold;
+        it must be picklable to be used by worker processes
+    :param executor: executor to run on; if not given, a pool is created (and
+        shut down at the end): threads on free-threaded Python, processes
+        otherwise
+    :param max_workers: size of the created pool
+    :param chunk_size: approximate size of the part of data for one task
+    :return: decoded data in jsonable form
+    """
+    return _decode_parallel(
+        data,
+        partial(jsonable_from_cbor, blob_store=blob_store),
+        executor,
+        max_workers,
+        chunk_size,
+    )
@@ -0,0 +1,152 @@
+"""
+Decoding of CBOR that keeps what cannot be understood as RawCbor, so that a
+proxy re-encodes it verbatim.
+
+Tagged items with tags unknown to cbor2 and cbor_json, and custom objects of
+unregistered classes, are kept as RawCbor slices of the payload. Subtrees
+chosen by paths are kept as RawCbor too, without decoding them. Only
+containers on the way to such items are walked here; everything else is
+decoded by cbor2 at full speed.
+
+Tagged items are kept raw as a whole: a custom object of a registered class
+with an unknown tag in its values becomes one RawCbor, since its class takes
+decoded values only. A shared value or string reference to an item kept raw
+cannot be resolved and fails with CBORDecodeError.
+"""
+
+import io
+from typing import Any
+
+import cbor2
+
+from ._custom_objects_base import _custom_class_by_classtag
+from ._delta import _Document
+from ._cbor_scan import _item_end, _read_head
+from ._profiles import RawCbor
+
+_SELF_DESCRIBED = 55799  # transparent tag
+
+
+class _PassThrough(Exception):
+    pass
+
+
+def _tag_hook(decoder, tag: cbor2.CBORTag):
+    # cbor2 calls the hook only for tags it does not decode itself
+    if (
+        tag.tag == 27
+        and isinstance(tag.value, list)
+        and tag.value
+        and isinstance(tag.value[0], str)
+        and _custom_class_by_classtag(tag.value[0]) is not None
+    ):
+        return tag
+    raise _PassThrough()
+
+
+def _keep_tag(decoder, tag: cbor2.CBORTag):
+    return tag
+
+
+class _PassThroughDecoder:
+    def __init__(self, data: bytes, passthrough: bool, raw_paths):
+        self.tag_hook = _tag_hook if passthrough else _keep_tag
+        self.doc = _Document(data)
+        self.data = self.doc.data
+        self.fp = io.BytesIO(self.data)
+        self.decoder = self.new_decoder()
+        self.plain_decoder = cbor2.CBORDecoder(self.fp)
+        self.raw_paths = raw_paths
+
+    def new_decoder(self) -> cbor2.CBORDecoder:
+        return cbor2.CBORDecoder(self.fp, tag_hook=self.tag_hook)
+
+    def match(self, path: tuple | None) -> tuple[bool, bool]:
+        """
+        :return: True if the item at path is to be kept raw, and True if some
+            item to be kept raw is inside it
+        """
+        raw = inside = False
+        if path is not None:
+            for raw_path in self.raw_paths:
+                if len(raw_path) >= len(path) and all(
+                    step is ... or step == key for step, key in zip(raw_path, path)
+                ):
+                    if len(raw_path) == len(path):
+                        raw = True
+                    else:
+                        inside = True
+        return raw, inside
+
+    def raw(self, pos: int, tagged: bool = False) -> tuple[RawCbor, int]:
+        if tagged:  # usually small: decoding it here is faster than windows
+            self.fp.seek(pos)
+            try:
+                self.plain_decoder.decode()
+                end = self.fp.tell()
+            except Exception:  # e.g. a shared value referenced out of its context
+                self.plain_decoder = cbor2.CBORDecoder(self.fp)
+                end = _item_end(self.data, pos)
+        else:
+            end = self.doc._item_bounds(pos, 1)[-1]
+        return RawCbor(bytes(self.data[pos:end])), end
+
+    def item(self, pos: int, path: tuple | None) -> tuple[Any, int]:
+        """
+        :param path: keys and indices of the item; None where no raw paths apply
+        :return: cborable value, and the position after the item
+        """
+        raw, inside = self.match(path)
+        if raw:
+            return self.raw(pos)
+        if not inside:
+            self.fp.seek(pos)
+            try:
+                return self.decoder.decode(), self.fp.tell()
+            except _PassThrough:
+                self.decoder = self.new_decoder()  # do not keep its interrupted state
+        major, info, arg, item_pos = _read_head(self.data, pos)
+        if major == 6:
+            if arg == _SELF_DESCRIBED:
+                return self.item(item_pos, path)
+            # Paths do not go into tagged items: it is kept raw as a whole
+            return self.raw(pos, tagged=True)
+        if major not in (4, 5):
+            self.fp.seek(pos)
+            return self.decoder.decode(), self.fp.tell()
+
+        res: Any = [] if major == 4 else {}
+        pos = item_pos
+        index = 0
+        while self.data[pos] != 0xFF if arg is None else index < arg:
+            if major == 4:
+                value, pos = self.item(pos, None if path is None else path + (index,))
+                res.append(value)
+            else:
+                key, pos = self.item(pos, None)
+                if isinstance(key, list):
+                    key = tuple(key)
+                elif isinstance(key, dict):
+                    key = cbor2.FrozenDict(key)
+                res[key], pos = self.item(pos, None if path is None else path + (key,))
+            index += 1
+        return res, pos + (1 if arg is None else 0)
+
+
+def _passthrough_loads(data: bytes, passthrough: bool = True, raw_paths=()):
+    """
+    Decodes CBOR to a "cborable" structure with RawCbor items, see the module
+    docstring.
+    :param passthrough: keep unknown tagged items and unregistered custom
+        objects raw
+    :param raw_paths: paths of items to keep raw: sequences of map keys and
+        array indices; ... (Ellipsis) matches any key or index
+    """
+    raw_paths = [tuple(raw_path) for raw_path in raw_paths]
+    if not raw_paths and passthrough:
+        try:
+            return cbor2.loads(data, tag_hook=_tag_hook)
+        except _PassThrough:
+            pass
+    decoder = _PassThroughDecoder(data, passthrough, raw_paths)
+    return decoder.item(0, () if raw_paths else None)[0]
@@ -0,0 +1,203 @@
+"""
+CBOR encoder profiles.
+
+Classes:
+- EncoderProfile - set of CBOR encoding options
+- RawCbor - already encoded CBOR item to splice into the output verbatim
+
+Predefined profiles:
+- CANONICAL_PROFILE - canonical CBOR, the default. Map keys and set elements are
+    sorted by their encoded form, floats are encoded in the shortest exact form.
+- FAST_PROFILE - maps and sets are encoded in their iteration order. The fastest
+    one, but equal dicts with different insertion order give different bytes,
+    and so do equal sets in different processes.
+- DETERMINISTIC_PROFILE - map keys and set elements are sorted by their natural
+    Python order (if they are comparable, by encoded form otherwise). Equal data
+    always gives equal bytes, but the result is not canonical CBOR. Cheaper than
+    canonical for big maps with string keys.
+"""
+
+from datetime import timezone as _timezone, tzinfo
+from operator import itemgetter
+
+import cbor2
+
+from ._cbor_scan import _head
+from ._streaming import _Stream
+
+
+class RawCbor:
+    """
+    Already encoded CBOR item. The encoder writes its bytes verbatim.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __eq__(self, other):
+        return isinstance(other, RawCbor) and self.data == other.data
+
+    def __hash__(self):
+        return hash((RawCbor, self.data))
+
+    def __repr__(self):
+        return f"RawCbor(bytes.fromhex('{self.data.hex()}'))"
+
+
+class _BlobRef:
+    """
+    Byte string in a blob store, read only when it is needed. The encoder
+    writes it straight from the store (memory-mapped by DirectoryBlobStore).
+    """
+
+    __slots__ = ("blob_store", "key", "length")
+
+    def __init__(self, blob_store, key: str, length: int):
+        self.blob_store = blob_store
+        self.key = key
+        self.length = length
+
+    def read(self) -> bytes:
+        return self.blob_store.get(self.key, self.length)
+
+    def encode(self, encoder):
+        data = self.blob_store.open(self.key, self.length)
+        try:
+            encoder.write(_head(2, self.length))
+            encoder.fp.write(data)  # encoder.write takes only bytes
+        finally:
+            if hasattr(data, "close"):
+                data.close()
+
+
+def _encode_raw(encoder, value):
+    if isinstance(value, (_Stream, _BlobRef)):
+        value.encode(encoder)
+        return
+    if not isinstance(value, RawCbor):
+        raise cbor2.CBOREncodeTypeError(f"cannot serialize type {type(value).__name__}")
+    encoder.write(value.data)
+
+
+class EncoderProfile:
+    """
+    Set of CBOR encoding options. Pass it to cbor_from_native or cbor_from_jsonable.
+    """
+
+    def __init__(
+        self,
+        canonical: bool = True,
+        sort_keys: bool = False,
+        datetime_as_timestamp: bool = True,
+        timezone: tzinfo | None = _timezone.utc,
+    ):
+        """
+        :param canonical: produce canonical CBOR
+        :param sort_keys: sort map keys and set elements in natural Python order;
+            makes sense only if canonical is False
+        :param datetime_as_timestamp: encode datetimes as epoch-based timestamps
+            (tag 1; integer if there are no microseconds) rather than as
+            ISO 8601 strings (tag 0)
+        :param timezone: timezone to assume for naive datetimes
+        """
+        self.canonical = canonical
+        self.sort_keys = sort_keys and not canonical
+        self.datetime_as_timestamp = datetime_as_timestamp
+        self.timezone = timezone
+
+    def dumps(self, cborable, presorted: bool = False) -> bytes:
+        """
+        Encodes "cborable" data to CBOR
+        :param cborable: data to encode
+        :param presorted: maps and sets are already sorted according to sort_keys
+        """
+        if self.sort_keys and not presorted:
+            cborable = _sorted_cborable(cborable)
+        return cbor2.dumps(
+            cborable,
+            canonical=self.canonical,
+            timezone=self.timezone,
+            datetime_as_timestamp=self.datetime_as_timestamp,
+            default=_encode_raw,
+        )
+
+    def dump(self, cborable, fp, presorted: bool = False):
+        """
+        Encodes "cborable" data to CBOR and writes it to a file object
+        :param cborable: data to encode
+        :param fp: file object open for writing in binary mode
+        :param presorted: maps and sets are already sorted according to sort_keys
+        """
+        if self.sort_keys and not presorted:
+            cborable = _sorted_cborable(cborable)
+        cbor2.dump(
+            cborable,
+            fp,
+            canonical=self.canonical,
+            timezone=self.timezone,
+            datetime_as_timestamp=self.datetime_as_timestamp,
+            default=_encode_raw,
+        )
+
+    def __repr__(self):
+        return (
+            f"EncoderProfile(canonical={self.canonical}, sort_keys={self.sort_keys}, "
+            f"datetime_as_timestamp={self.datetime_as_timestamp}, "
+            f"timezone={self.timezone!r})"
+        )
+
+
+CANONICAL_PROFILE = EncoderProfile()
+FAST_PROFILE = EncoderProfile(canonical=False)
+DETERMINISTIC_PROFILE = EncoderProfile(canonical=False, sort_keys=True)
+
+
+def _encoded_key(val) -> bytes:
+    if isinstance(val, RawCbor):
+        return val.data
+    return cbor2.dumps(val, canonical=True, timezone=_timezone.utc, default=_encode_raw)
+
+
+def _sorted_container(container):
+    """
+    Sorts items of a map or elements of a set. Does not go deeper.
+    """
+    if isinstance(container, (dict, cbor2.FrozenDict)):
+        items = list(container.items())
+        try:
+            items.sort(key=itemgetter(0))
+        except TypeError:
+            items.sort(key=lambda kv: _encoded_key(kv[0]))
+        return type(container)(items)
+    if isinstance(container, (set, frozenset)):
+        elements = list(container)
+        try:
+            elements.sort()
+        except TypeError:
+            elements.sort(key=_encoded_key)
+        return cbor2.CBORTag(
+            258, tuple(elements)  # https://github.com/input-output-hk/cbor-sets-spec
+        )
+    return container
+
+
+def _sorted_cborable(cborable):
+    if isinstance(cborable, list):
+        return [_sorted_cborable(el) for el in cborable]
+    if isinstance(cborable, tuple):
+        return tuple(_sorted_cborable(el) for el in cborable)
+    if isinstance(cborable, (dict, cbor2.FrozenDict)):
+        return _sorted_container(
+            type(cborable)(
+                (_sorted_cborable(k), _sorted_cborable(v)) for k, v in cborable.items()
+            )
+        )
+    if isinstance(cborable, (set, frozenset)):
+        return _sorted_container(
+            type(cborable)(_sorted_cborable(el) for el in cborable)
+        )
+    if isinstance(cborable, cbor2.CBORTag):
+        return cbor2.CBORTag(cborable.tag, _sorted_cborable(cborable.value))
+    return cborable
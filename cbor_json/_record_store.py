@@ -0,0 +1,470 @@
+"""
+Embedded append-only key-record store.
+
+Class:
+- RecordStore - persistent mapping of 'native' keys to records
+
+Files:
+- <path> - log: magic b"CBJS", format version (1 byte), 3 reserved bytes, then
+  entries. Entry: CRC-32 of the rest of the entry, key length, value length
+  (0xFFFFFFFF for a deletion), all 4-byte big-endian, then the key (canonical
+  CBOR of the 'native' key) and the value (CBOR of the record).
+- <path>.idx - open addressing hash table: 64-byte header (magic b"CBJI",
+  format version, capacity, used slots, live keys, size of the log it covers),
+  then slots of 64-bit key hash and 64-bit entry offset (0 for empty slots).
+  Little-endian.
+
+Both files are memory-mapped, so opening a store of any size does not load it,
+and a lookup reads a few slots and one entry. The index records the log size it
+is consistent with; it is marked stale while there are unflushed changes, and a
+stale or missing index is rebuilt from the log on open. Entries torn by a crash
+at the end of the log are cut off.
+One process may have a store open at a time; threads may share it.
+"""
+
+from hashlib import blake2b
+import mmap
+import os
+import struct
+from threading import RLock
+from typing import Callable, Iterator
+from zlib import crc32
+
+from ._cbor_json_codecs import cbor_from_native, native_from_cbor
+
+_LOG_MAGIC = b"CBJS"
+_INDEX_MAGIC = b"CBJI"
+_VERSION = 1
+_LOG_HEADER = _LOG_MAGIC + bytes((_VERSION, 0, 0, 0))
+_ENTRY = struct.Struct(">III")  # crc, key length, value length
+_DELETED = 0xFFFFFFFF
+# magic, version, capacity, used slots, live keys, log size
+_INDEX_HEADER = struct.Struct("<4sB3xQQQQ")
+_INDEX_HEADER_SIZE = 64
+_SLOT = struct.Struct("<QQ")  # key hash, entry offset
+_STALE = 0xFFFFFFFFFFFFFFFF
+_MIN_CAPACITY = 1024
+_MAX_LOAD = 0.7
+
+
+def _key_hash(key: bytes) -> int:
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+
+
+def _entry(key: bytes, value: bytes | None) -> bytes:
+    value_len = _DELETED if value is None else len(value)
+    checked = _ENTRY.pack(0, len(key), value_len)[4:] + key + (value or b"")
+    return crc32(checked).to_bytes(4, "big") + checked
+
+
+class _Index:
+    """
+    Memory-mapped hash table of the index file
+    """
+
+    def __init__(self, path: str, capacity: int | None = None):
+        """
+        Opens the index file, or creates an empty one if capacity is given
+        """
+        self.path = path
+        if capacity is not None:
+            with open(path, "wb") as index_f:
+                index_f.truncate(_INDEX_HEADER_SIZE + capacity * _SLOT.size)
+                index_f.write(
+                    _INDEX_HEADER.pack(_INDEX_MAGIC, _VERSION, capacity, 0, 0, 0)
+                )
+        with open(path, "r+b") as index_f:
+            self.map = mmap.mmap(index_f.fileno(), 0)
+        magic, version, self.capacity, self.used, self.live, self.log_size = (
+            _INDEX_HEADER.unpack_from(self.map)
+        )
+        if (
+            magic != _INDEX_MAGIC
+            or version != _VERSION
+            or len(self.map) != _INDEX_HEADER_SIZE + self.capacity * _SLOT.size
+        ):
+            self.map.close()
+            raise ValueError(f'"{path}" is not a valid index file')
+
+    def save_header(self):
+        _INDEX_HEADER.pack_into(
+            self.map,
+            0,
+            _INDEX_MAGIC,
+            _VERSION,
+            self.capacity,
+            self.used,
+            self.live,
+            self.log_size,
+        )
+
+    def slots(self, key_hash: int) -> Iterator[tuple[int, int, int]]:
+        """
+        Probes slots for a hash.
+        :return: iterator of (slot number, slot hash, entry offset) up to an
+            empty slot inclusive
+        """
+        slot_no = key_hash % self.capacity
+        while True:
+            slot_hash, offset = _SLOT.unpack_from(
+                self.map, _INDEX_HEADER_SIZE + slot_no * _SLOT.size
+            )
+            yield slot_no, slot_hash, offset
+            if not offset:
+                return
+            slot_no = (slot_no + 1) % self.capacity
+
+    def set_slot(self, slot_no: int, key_hash: int, offset: int):
+        _SLOT.pack_into(
+            self.map, _INDEX_HEADER_SIZE + slot_no * _SLOT.size, key_hash, offset
+        )
+
+    def occupied(self) -> Iterator[tuple[int, int]]:
+        """
+        :return: iterator of (hash, entry offset) of occupied slots
+        """
+        for slot_no in range(self.capacity):
+            slot_hash, offset = _SLOT.unpack_from(
+                self.map, _INDEX_HEADER_SIZE + slot_no * _SLOT.size
+            )
+            if offset:
+                yield slot_hash, offset
+
+    def close(self):
+        self.map.close()
+
+
+class RecordStore:
+    """
+    Persistent mapping of 'native' keys to records, with the usual dict
+    operations (store[key], store[key] = record, del store[key], key in store,
+    len, iteration over keys, get, items).
+    Keys are any 'native' data that encodes to CBOR; equal keys are found by
+    their canonical CBOR.
+    Every change appends an entry to the log, so space of overwritten and
+    deleted records is reclaimed only by compact().
+    """
+
+    def __init__(
+        self,
+        path: str,
+        encode: Callable[..., bytes] = cbor_from_native,
+        decode: Callable = native_from_cbor,
+    ):
+        """
+        :param path: log file; created with its index if it does not exist
+        :param encode: function that encodes records to CBOR
+        :param decode: function that decodes records; it gets a memoryview
+            into the mapped log, which must not be kept
+        """
+        self.path = path
+        self.encode = encode
+        self.decode = decode
+        self._lock = RLock()
+        if not os.path.exists(path):
+            with open(path, "wb") as log_f:
+                log_f.write(_LOG_HEADER)
+        self._log = open(path, "r+b")
+        try:
+            self._open()
+        except BaseException:
+            self._log.close()
+            raise
+
+    # MARK: Files
+
+    def _open(self):
+        if self._log.read(len(_LOG_HEADER)) != _LOG_HEADER:
+            raise ValueError(f'"{self.path}" is not a record store log')
+        self._log_size = self._log.seek(0, os.SEEK_END)
+        self._log_map = mmap.mmap(self._log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._index = _Index(self.path + ".idx")
+            if self._index.log_size == self._log_size:
+                return
+            self._index.close()
+        except (OSError, ValueError):
+            pass
+        self._rebuild_index()
+
+    def _remap_log(self):
+        self._log.flush()
+        old_map = self._log_map
+        self._log_map = mmap.mmap(self._log.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            old_map.close()
+        except BufferError:
+            pass  # decode kept a view; the map is closed when the view goes
+
+    def _read_entry(self, offset: int) -> tuple[int, int, int] | None:
+        """
+        :return: (key length, value length, end of the entry), or None if the
+            entry is incomplete or damaged
+        """
+        log_map = self._log_map
+        if offset + _ENTRY.size > len(log_map):
+            return None
+        crc, key_len, value_len = _ENTRY.unpack_from(log_map, offset)
+        end = offset + _ENTRY.size + key_len
+        if value_len != _DELETED:
+            end += value_len
+        if end > len(log_map):
+            return None
+        with memoryview(log_map) as view, view[offset + 4 : end] as checked:
+            if crc32(checked) != crc:
+                return None
+        return key_len, value_len, end
+
+    def _rebuild_index(self):
+        """
+        Builds the index from the log. Cuts off a damaged tail of the log.
+        """
+        entries = {}  # key -> offset of the last entry
+        offset = len(_LOG_HEADER)
+        while offset < self._log_size:
+            entry = self._read_entry(offset)
+            if entry is None:
+                break
+            key_len, value_len, end = entry
+            key_start = offset + _ENTRY.size
+            entries[self._log_map[key_start : key_start + key_len]] = (
+                offset,
+                value_len,
+            )
+            offset = end
+        if offset < self._log_size:
+            self._log_map.close()
+            self._log.truncate(offset)
+            self._log_size = offset
+            self._log_map = mmap.mmap(self._log.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = self._new_index(
+            ((_key_hash(key), offset) for key, (offset, _) in entries.items()),
+            len(entries),
+            sum(1 for _, value_len in entries.values() if value_len != _DELETED),
+        )
+
+    def _new_index(self, slots, used: int, live: int) -> _Index:
+        """
+        Writes a new index file of given slots and opens it
+        """
+        capacity = _MIN_CAPACITY
+        while used >= capacity * _MAX_LOAD:
+            capacity *= 2
+        tmp_path = self.path + ".idx.tmp"
+        index = _Index(tmp_path, capacity)
+        try:
+            for key_hash, offset in slots:
+                for slot_no, _, slot_offset in index.slots(key_hash):
+                    if not slot_offset:
+                        index.set_slot(slot_no, key_hash, offset)
+            index.used = used
+            index.live = live
+            index.log_size = self._log_size
+            index.save_header()
+            index.map.flush()
+            index.close()
+            os.replace(tmp_path, self.path + ".idx")
+        except BaseException:
+            index.close()
+            os.unlink(tmp_path)
+            raise
+        return _Index(self.path + ".idx")
+
+    def flush(self, fsync: bool = False):
+        """
+        Writes buffered changes to the files and marks the index up to date
+        :param fsync: also wait until they are on the disk
+        """
+        with self._lock:
+            self._log.flush()
+            if fsync:
+                os.fsync(self._log.fileno())
+            if self._index.log_size != self._log_size:
+                self._index.log_size = self._log_size
+                self._index.save_header()
+            self._index.map.flush()
+
+    def close(self):
+        """
+        Flushes changes and closes the log and the index
+        """
+        with self._lock:
+            if self._log.closed:
+                return
+            try:
+                self.flush()
+            finally:
+                self._index.close()
+                self._log_map.close()
+                self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # MARK: Lookups
+
+    def _find(self, key: bytes) -> tuple[int, int, int, int]:
+        """
+        :return: (slot number, key hash, entry offset, value length);
+            entry offset is 0 if the key was never stored
+        """
+        key_hash = _key_hash(key)
+        for slot_no, slot_hash, offset in self._index.slots(key_hash):
+            if not offset:
+                return slot_no, key_hash, 0, _DELETED
+            if slot_hash != key_hash:
+                continue
+            if offset + _ENTRY.size + len(key) > len(self._log_map):
+                self._remap_log()
+            _, key_len, value_len = _ENTRY.unpack_from(self._log_map, offset)
+            key_start = offset + _ENTRY.size
+            if self._log_map[key_start : key_start + key_len] == key:
+                return slot_no, key_hash, offset, value_len
+        raise AssertionError("Index is full")  # never happens at load factor < 1
+
+    def _value_span(self, key) -> tuple[int, int]:
+        """
+        :return: start and end of the record in the log
+        """
+        key_bytes = cbor_from_native(key)
+        _, _, offset, value_len = self._find(key_bytes)
+        if value_len == _DELETED:
+            raise KeyError(key)
+        start = offset + _ENTRY.size + len(key_bytes)
+        if start + value_len > len(self._log_map):
+            self._remap_log()
+        return start, start + value_len
+
+    def get_cbor(self, key) -> bytes:
+        """
+        :return: CBOR bytes of the record
+        """
+        with self._lock:
+            start, end = self._value_span(key)
+            return self._log_map[start:end]
+
+    def __getitem__(self, key):
+        with self._lock:
+            start, end = self._value_span(key)
+            with memoryview(self._log_map) as view, view[start:end] as value:
+                return self.decode(value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return self._find(cbor_from_native(key))[3] != _DELETED
+
+    def __len__(self) -> int:
+        return self._index.live
+
+    def _live_entries(self) -> list[tuple[int, int, int]]:
+        """
+        :return: sorted list of (offset, key length, value length) of live entries
+        """
+        with self._lock:
+            self._remap_log()
+            res = []
+            for _, offset in self._index.occupied():
+                _, key_len, value_len = _ENTRY.unpack_from(self._log_map, offset)
+                if value_len != _DELETED:
+                    res.append((offset, key_len, value_len))
+        res.sort()
+        return res
+
+    def keys(self) -> Iterator:
+        """
+        :return: iterator over keys in the order they were last written; keys
+            are decoded frozen, so they are hashable.
+            Do not change the store during the iteration.
+        """
+        with self._lock:
+            # Keys are copied from the map, which a later write may close
+            key_cbors = [
+                self._log_map[offset + _ENTRY.size : offset + _ENTRY.size + key_len]
+                for offset, key_len, _ in self._live_entries()
+            ]
+        for key_cbor in key_cbors:
+            yield native_from_cbor(key_cbor, frozen=True)
+
+    __iter__ = keys
+
+    def items(self) -> Iterator[tuple]:
+        """
+        :return: iterator over (key, record) in the order they were last written
+        """
+        for key in self.keys():
+            yield key, self[key]
+
+    # MARK: Changes
+
+    def _write(self, key: bytes, value: bytes | None):
+        with self._lock:
+            slot_no, key_hash, old_offset, old_value_len = self._find(key)
+            if value is None and old_value_len == _DELETED:
+                raise KeyError(native_from_cbor(key))
+            if (
+                not old_offset
+                and self._index.used + 1 >= self._index.capacity * _MAX_LOAD
+            ):
+                self._grow_index()
+                slot_no = self._find(key)[0]
+            if self._index.log_size != _STALE:
+                self._index.log_size = _STALE
+                self._index.save_header()
+            self._log.seek(self._log_size)
+            self._log.write(_entry(key, value))
+            offset = self._log_size
+            self._log_size = self._log.tell()
+            self._index.set_slot(slot_no, key_hash, offset)
+            if not old_offset:
+                self._index.used += 1
+            self._index.live += (value is not None) - (old_value_len != _DELETED)
+            self._index.save_header()
+
+    def _grow_index(self):
+        index = self._index
+        self._index = self._new_index(index.occupied(), index.used, index.live)
+        index.close()
+
+    def put_cbor(self, key, data: bytes):
+        """
+        Stores already encoded record. It must be exactly one CBOR item.
+        """
+        self._write(cbor_from_native(key), data)
+
+    def __setitem__(self, key, record):
+        self.put_cbor(key, self.encode(record))
+
+    def __delitem__(self, key):
+        self._write(cbor_from_native(key), None)
+
+    def compact(self):
+        """
+        Rewrites the log with live records only, and rebuilds the index
+        """
+        with self._lock:
+            self.flush()
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as tmp_f:
+                tmp_f.write(_LOG_HEADER)
+                for offset, key_len, value_len in self._live_entries():
+                    end = offset + _ENTRY.size + key_len + value_len
+                    tmp_f.write(self._log_map[offset:end])
+                tmp_f.flush()
+                os.fsync(tmp_f.fileno())
+            self._index.close()
+            self._log_map.close()
+            self._log.close()
+            os.replace(tmp_path, self.path)
+            self._log = open(self.path, "r+b")
+            self._log_size = self._log.seek(0, os.SEEK_END)
+            self._log_map = mmap.mmap(self._log.fileno(), 0, access=mmap.ACCESS_READ)
+            self._rebuild_index()
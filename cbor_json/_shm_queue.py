@@ -0,0 +1,259 @@
+"""
+Queue of 'native' values between processes through shared memory.
+
+Class:
+- SharedMemoryQueue - multiprocessing queue that moves values as CBOR in
+  shared memory and sends only their positions through a pipe
+
+Ring segment layout: 24-byte header (head, tail and used bytes, 8-byte
+little-endian, changed by producers only, under a lock), then records. Record:
+state (1 byte: in use, released or padding), 3 reserved bytes, record size
+(4-byte little-endian, header included, a multiple of 8), then the CBOR
+payload. Producers write records at the head and wrap to the start of the data
+area when the end is too close, leaving a padding record. A consumer marks a
+record released after decoding it, in any order; producers move the tail over
+released records when they need space. Payloads that do not fit in the ring go
+in segments of their own, which the consumer unlinks.
+
+A consumer decodes the payload straight from the shared memory view with
+native_from_cbor and releases the record after decoding. cbor2 reads its input
+through an in-memory buffer of its own, so the payload is still copied once,
+inside cbor2; a file-like reader over the view avoids that copy but decodes
+slower.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import multiprocessing
+from multiprocessing import shared_memory
+import queue
+import struct
+import time
+from typing import Iterator
+
+from ._cbor_json_codecs import cbor_from_native, native_from_cbor
+from ._profiles import FAST_PROFILE, EncoderProfile
+
+_HEADER = struct.Struct("<QQQ")  # head, tail, used bytes
+_RECORD = struct.Struct("<B3xI")  # state, record size
+_IN_USE = 0
+_RELEASED = 1
+_PADDING = 2
+_MAX_CAPACITY = 0xFFFFFFF8  # record sizes are 4-byte
+_MAX_WAIT = 0.01  # longest sleep while waiting for space in the ring, seconds
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) & ~7
+
+
+class SharedMemoryQueue:
+    """
+    Multiprocessing queue of 'native' values. A value is encoded to CBOR in a
+    shared memory ring buffer, and only its position goes through an ordinary
+    multiprocessing.Queue, so big values are not pickled and piped.
+    Pass the queue to child processes as an argument, like multiprocessing
+    queues. Any number of processes may put and get. The process that created
+    the queue owns the shared memory: close() there frees it.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 64 << 20,
+        profile: EncoderProfile | None = None,
+        maxsize: int = 0,
+        ctx=None,
+    ):
+        """
+        :param capacity: size of the ring buffer in bytes; values that do not
+            fit in it get shared memory segments of their own
+        :param profile: encoding options; FAST_PROFILE by default
+        :param maxsize: maximal number of values in the queue; 0 for no limit
+        :param ctx: multiprocessing context; the default one if not given
+        """
+        capacity = _aligned(capacity)
+        if not _HEADER.size + 2 * _RECORD.size <= capacity <= _MAX_CAPACITY:
+            raise ValueError(f"Invalid capacity {capacity}")
+        ctx = ctx or multiprocessing.get_context()
+        self.profile = profile or FAST_PROFILE
+        self._shm = shared_memory.SharedMemory(create=True, size=capacity)
+        self._capacity = capacity
+        self._owner = True
+        self._lock = ctx.Lock()
+        self._handles = ctx.Queue(maxsize)
+        self._buf[: _HEADER.size] = _HEADER.pack(_HEADER.size, _HEADER.size, 0)
+
+    def __getstate__(self):
+        return {
+            "profile": self.profile,
+            "name": self._shm.name,
+            "capacity": self._capacity,
+            "lock": self._lock,
+            "handles": self._handles,
+        }
+
+    def __setstate__(self, state):
+        self.profile = state["profile"]
+        self._shm = shared_memory.SharedMemory(state["name"])
+        self._capacity = state["capacity"]
+        self._owner = False
+        self._lock = state["lock"]
+        self._handles = state["handles"]
+
+    @property
+    def _buf(self) -> memoryview:
+        buf = self._shm.buf
+        assert buf is not None
+        return buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """
+        Closes the shared memory in this process, and frees it if this
+        process created the queue
+        """
+        self._handles.close()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+    # MARK: Producing
+
+    def put(self, native, block: bool = True, timeout: float | None = None):
+        """
+        Encodes a value and puts it in the queue
+        :param native: 'native' data
+        :param block: wait for space in the ring buffer and in the queue
+        :param timeout: longest wait in seconds; None for no limit
+        :raise queue.Full: no space in time
+        """
+        self.put_cbor(cbor_from_native(native, self.profile), block, timeout)
+
+    def put_cbor(self, data, block: bool = True, timeout: float | None = None):
+        """
+        Puts an already encoded value in the queue
+        :param data: CBOR bytes-like object
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        size = len(data)
+        if _aligned(_RECORD.size + size) > self._capacity - _HEADER.size:
+            segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            segment.buf[:size] = data  # type: ignore[index]
+            handle: tuple = (segment.name, size)
+            segment.close()
+        else:
+            wait = 0.0001
+            while (pos := self._allocate(size)) is None:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise queue.Full()
+                time.sleep(wait)
+                wait = min(wait * 2, _MAX_WAIT)
+            start = pos + _RECORD.size
+            self._buf[start : start + size] = data
+            handle = (pos, size)
+        try:
+            self._handles.put(
+                handle,
+                block,
+                None if deadline is None else max(deadline - time.monotonic(), 0),
+            )
+        except queue.Full:
+            self._release(handle)
+            raise
+
+    def _allocate(self, size: int) -> int | None:
+        """
+        :return: position of a new record in the ring, or None if there is no
+            space for it now
+        """
+        buf = self._buf
+        record_size = _aligned(_RECORD.size + size)
+        with self._lock:
+            head, tail, used = _HEADER.unpack_from(buf)
+            while used:  # move the tail over released records
+                state, tail_size = _RECORD.unpack_from(buf, tail)
+                if state == _IN_USE:
+                    break
+                used -= tail_size
+                tail += tail_size
+                if tail == self._capacity:
+                    tail = _HEADER.size
+            if not used:
+                head = tail = _HEADER.size
+            pos = None
+            if head > tail or not used:  # free space: after the head, before the tail
+                if self._capacity - head >= record_size:
+                    pos = head
+                elif tail - _HEADER.size >= record_size:
+                    padding = self._capacity - head
+                    _RECORD.pack_into(buf, head, _PADDING, padding)
+                    used += padding
+                    pos = _HEADER.size
+            elif head < tail and tail - head >= record_size:
+                pos = head
+            if pos is not None:
+                _RECORD.pack_into(buf, pos, _IN_USE, record_size)
+                used += record_size
+                head = pos + record_size
+                if head == self._capacity:
+                    head = _HEADER.size
+            _HEADER.pack_into(buf, 0, head, tail, used)
+            return pos
+
+    # MARK: Consuming
+
+    def get(self, block: bool = True, timeout: float | None = None, frozen=False):
+        """
+        Takes a value from the queue and decodes it
+        :param block: wait for a value
+        :param timeout: longest wait in seconds; None for no limit
+        :param frozen: build tuples, frozensets and FrozenDicts instead of
+            lists, sets and dicts
+        :raise queue.Empty: no value in time
+        :return: 'native' data
+        """
+        with self._payload(self._handles.get(block, timeout)) as view:
+            return native_from_cbor(view, frozen=frozen)  # type: ignore[arg-type]
+
+    def get_cbor(self, block: bool = True, timeout: float | None = None) -> bytes:
+        """
+        Takes a value from the queue without decoding it
+        :return: CBOR bytes
+        """
+        with self._payload(self._handles.get(block, timeout)) as view:
+            return bytes(view)
+
+    @contextmanager
+    def _payload(self, handle) -> Iterator[memoryview]:
+        """
+        Gives the payload in shared memory, and releases it at the end
+        """
+        where, size = handle
+        if isinstance(where, str):
+            segment = shared_memory.SharedMemory(where)
+            view = segment.buf[:size]  # type: ignore[index]
+        else:
+            start = where + _RECORD.size
+            view = self._buf[start : start + size]
+        try:
+            yield view
+        finally:
+            view.release()
+            if isinstance(where, str):
+                segment.close()
+            self._release(handle)
+
+    def _release(self, handle):
+        where = handle[0]
+        if isinstance(where, str):
+            segment = shared_memory.SharedMemory(where)
+            segment.close()
+            segment.unlink()
+        else:
+            self._buf[where] = _RELEASED
@@ -0,0 +1,365 @@
+"""
+Encoded size of data without encoding it.
+
+Functions:
+- cbor_size_of - length of cbor_from_native(native, profile)
+- json_size_of - length of json.dumps(jsonable_from_native(native)) in UTF-8
+- cbor_batches - packs records into size-bounded CBOR sequences
+
+The size functions walk the data by the same rules as the converters, but only
+count bytes. Rare scalars (datetimes, decimals, UUIDs, MIME messages, etc.) are
+measured by converting them alone.
+"""
+
+from __future__ import annotations
+
+from datetime import date, datetime
+import json
+from typing import Iterable, Iterator
+import struct
+
+import cbor2
+
+from ._cbor_json_codecs import (
+    _cborable_from_native,
+    _jsonable_from_cborable,
+    cbor_from_native,
+)
+from ._custom_objects_base import SerializableToCbor, _custom_class_by_classtag
+from ._profiles import EncoderProfile, CANONICAL_PROFILE
+
+
+def _head_size(arg: int) -> int:
+    """
+    :return: size of a CBOR item head with the argument arg
+    """
+    if arg < 24:
+        return 1
+    if arg < 0x100:
+        return 2
+    if arg < 0x10000:
+        return 3
+    if arg < 0x100000000:
+        return 5
+    return 9
+
+
+def _int_size(val: int) -> int:
+    if val < 0:
+        val = -val - 1
+    if val < 0x10000000000000000:
+        return _head_size(val)
+    length = (val.bit_length() + 7) // 8  # tag 2 or 3 with a byte string
+    return 1 + _head_size(length) + length
+
+
+def _bytes_item_size(length: int) -> int:
+    return _head_size(length) + length
+
+
+def _float_size(val: float, canonical: bool) -> int:
+    if val != val or val in (float("inf"), float("-inf")):
+        return 3
+    if not canonical:
+        return 9
+    # canonical floats take the shortest form that keeps the value
+    try:
+        if struct.unpack("f", struct.pack("f", val))[0] != val:
+            return 9
+    except OverflowError:
+        return 9
+    # cbor2 does not use half precision for 2**15 and more (the max is 65504)
+    if abs(val) >= 32768.0 or struct.unpack("e", struct.pack("e", val))[0] != val:
+        return 5
+    return 3
+
+
+# MARK: CBOR
+
+
+def _cbor_size(native, profile: EncoderProfile, encountered_ids: set) -> int:
+    native_type = type(native)
+    if native_type is str:  # the most common types first
+        return _bytes_item_size(
+            len(native) if native.isascii() else len(native.encode())
+        )
+    if native_type is int:
+        return _int_size(native)
+    if native is None or isinstance(native, bool):
+        return 1
+    if isinstance(native, int):
+        return _int_size(native)
+    if isinstance(native, float):
+        return _float_size(native, profile.canonical)
+    if isinstance(native, str):
+        return _bytes_item_size(
+            len(native) if native.isascii() else len(native.encode())
+        )
+    if isinstance(native, bytes):
+        return _bytes_item_size(len(native))
+    if isinstance(native, date) and not isinstance(native, datetime):
+        return 2 + _int_size((native - date(1970, 1, 1)).days)  # tag 100
+    if isinstance(native, cbor2.CBORSimpleValue):  # it is a tuple
+        return 1 if native.value < 24 else 2
+
+    if not isinstance(
+        native,
+        (
+            list,
+            tuple,
+            dict,
+            cbor2.FrozenDict,
+            set,
+            frozenset,
+            SerializableToCbor,
+            cbor2.CBORTag,
+        ),
+    ):
+        return len(profile.dumps(_cborable_from_native(native)))
+
+    this_id = id(native)
+    if this_id in encountered_ids:
+        raise ValueError("Cannot encode a recursively linked structure")
+    encountered_ids.add(this_id)
+    if isinstance(native, (list, tuple)):
+        res = _head_size(len(native)) + sum(
+            _cbor_size(el, profile, encountered_ids) for el in native
+        )
+    elif isinstance(native, (dict, cbor2.FrozenDict)):
+        res = _head_size(len(native)) + sum(
+            _cbor_size(k, profile, encountered_ids)
+            + _cbor_size(v, profile, encountered_ids)
+            for k, v in native.items()
+        )
+    elif isinstance(native, (set, frozenset)):
+        res = (
+            3  # tag 258
+            + _head_size(len(native))
+            + sum(_cbor_size(el, profile, encountered_ids) for el in native)
+        )
+    elif isinstance(native, SerializableToCbor):
+        values = native.get_cbor_cc_values() or []
+        res = (
+            2  # tag 27
+            + _head_size(len(values) + 1)
+            + _cbor_size(native.cbor_cc_classtag, profile, encountered_ids)
+            + sum(_cbor_size(el, profile, encountered_ids) for el in values)
+        )
+    else:
+        res = _head_size(native.tag) + _cbor_size(
+            native.value, profile, encountered_ids
+        )
+    encountered_ids.remove(this_id)
+    return res
+
+
+def cbor_size_of(native, profile: EncoderProfile | None = None) -> int:
+    """
+    :param native: 'native' data
+    :param profile: encoding options; canonical CBOR by default
+    :return: exact length of cbor_from_native(native, profile)
+    """
+    return _cbor_size(native, profile or CANONICAL_PROFILE, set())
+
+
+# MARK: JSON
+
+
+class _JsonSizer:
+    """
+    Measures json.dumps output with the given options
+    """
+
+    def __init__(self, ensure_ascii: bool, separators: tuple[str, str] | None):
+        self.ensure_ascii = ensure_ascii
+        if separators is None:
+            separators = (", ", ": ")
+        self.item_sep = len(separators[0].encode())
+        self.key_sep = len(separators[1].encode())
+        self.encode_str = (
+            json.encoder.encode_basestring_ascii  # type: ignore[attr-defined]
+            if ensure_ascii
+            else json.encoder.encode_basestring  # type: ignore[attr-defined]
+        )
+
+    def str_size(self, val: str) -> int:
+        if val.isascii() and val.isprintable() and '"' not in val and "\\" not in val:
+            return len(val) + 2
+        encoded = self.encode_str(val)
+        return len(encoded) if self.ensure_ascii else len(encoded.encode())
+
+    def seq_size(self, sizes) -> int:
+        count = total = 0
+        for size in sizes:
+            count += 1
+            total += size
+        return 2 + total + max(count - 1, 0) * self.item_sep
+
+    def obj_size(self, items) -> int:
+        """
+        :param items: iterable of (key, value size)
+        """
+        return self.seq_size(self.str_size(k) + self.key_sep + v for k, v in items)
+
+    def scalar_size(self, val) -> int:
+        if val is None or val is True:
+            return 4
+        if val is False:
+            return 5
+        if isinstance(val, int):
+            return len(int.__repr__(val))
+        if isinstance(val, float):
+            if val != val:
+                return 3  # NaN
+            if val in (float("inf"), float("-inf")):
+                return 8 if val > 0 else 9
+            return len(float.__repr__(val))
+        return self.str_size(val)
+
+    def jsonable_size(self, jsonable) -> int:
+        if isinstance(jsonable, (list, tuple)):
+            return self.seq_size(self.jsonable_size(el) for el in jsonable)
+        if isinstance(jsonable, dict):
+            return self.obj_size(
+                (k, self.jsonable_size(v)) for k, v in jsonable.items()
+            )
+        return self.scalar_size(jsonable)
+
+    def size(self, native, encountered_ids: set) -> int:
+        if native is None or isinstance(native, (bool, int, float, str)):
+            return self.scalar_size(native)
+        if isinstance(native, cbor2.CBORSimpleValue):  # it is a tuple
+            return self.jsonable_size(_jsonable_from_cborable(native))
+        if isinstance(native, bytes) and len(native) > 32:
+            # {"$type": "binary-base64", "$value": "<base64 lines joined by \n>"}
+            b64_len = (len(native) + 2) // 3 * 4
+            newlines = (b64_len - 1) // 76
+            return self.obj_size(
+                (
+                    ("$type", self.str_size("binary-base64")),
+                    ("$value", b64_len + 2 * newlines + 2),
+                )
+            )
+
+        if not isinstance(
+            native,
+            (
+                list,
+                tuple,
+                dict,
+                cbor2.FrozenDict,
+                set,
+                frozenset,
+                SerializableToCbor,
+                cbor2.CBORTag,
+            ),
+        ):
+            return self.jsonable_size(
+                _jsonable_from_cborable(_cborable_from_native(native))
+            )
+
+        this_id = id(native)
+        if this_id in encountered_ids:
+            raise ValueError("Cannot encode a recursively linked structure")
+        encountered_ids.add(this_id)
+        if isinstance(native, (list, tuple)):
+            res = self.seq_size(self.size(el, encountered_ids) for el in native)
+        elif isinstance(native, (dict, cbor2.FrozenDict)):
+            if "$type" not in native and all(isinstance(k, str) for k in native):
+                res = self.obj_size(
+                    (k, self.size(v, encountered_ids)) for k, v in native.items()
+                )
+            else:
+                pairs = self.seq_size(
+                    self.seq_size(
+                        (self.size(k, encountered_ids), self.size(v, encountered_ids))
+                    )
+                    for k, v in native.items()
+                )
+                res = self.obj_size(
+                    (("$type", self.str_size("map")), ("$value", pairs))
+                )
+        elif isinstance(native, (set, frozenset)):
+            elements = self.seq_size(self.size(el, encountered_ids) for el in native)
+            res = self.obj_size((("$type", self.str_size("set")), ("$value", elements)))
+        elif isinstance(native, SerializableToCbor):
+            class_tag = native.cbor_cc_classtag
+            assert class_tag
+            custom_class = _custom_class_by_classtag(class_tag)
+            class_descr = (
+                custom_class.get_cbor_cc_descr()
+                if custom_class is not None
+                else f'<unrecognized class tag "{class_tag}">'
+            )
+            values = self.seq_size(
+                self.size(el, encountered_ids)
+                for el in native.get_cbor_cc_values() or []
+            )
+            res = self.obj_size(
+                (
+                    ("$type", self.str_size("custom-object")),
+                    ("$class", self.str_size(class_descr)),
+                    ("$class_tag", self.str_size(class_tag)),
+                    ("$value", values),
+                )
+            )
+        elif native.tag in (27, 100):
+            res = self.jsonable_size(
+                _jsonable_from_cborable(_cborable_from_native(native))
+            )
+        else:
+            res = self.obj_size(
+                (
+                    ("$type", self.str_size("tagged-value")),
+                    ("$cbor_tag", self.scalar_size(native.tag)),
+                    ("$value", self.size(native.value, encountered_ids)),
+                )
+            )
+        encountered_ids.remove(this_id)
+        return res
+
+
+def json_size_of(
+    native, ensure_ascii: bool = True, separators: tuple[str, str] | None = None
+) -> int:
+    """
+    :param native: 'native' data
+    :param ensure_ascii: as in json.dumps
+    :param separators: as in json.dumps; (", ", ": ") by default
+    :return: exact length in bytes of UTF-8 encoded
+        json.dumps(jsonable_from_native(native), ensure_ascii, separators)
+    """
+    return _JsonSizer(ensure_ascii, separators).size(native, set())
+
+
+# MARK: Batching
+
+
+def cbor_batches(
+    natives: Iterable, max_bytes: int, profile: EncoderProfile | None = None
+) -> Iterator[bytes]:
+    """
+    Encodes records and packs them into CBOR sequences (concatenated items,
+    RFC 8742) of at most max_bytes each. Every record is encoded once.
+    Records are not reordered. IncrementalDecoder decodes the sequences back.
+    :param natives: iterable of 'native' records
+    :param max_bytes: maximal size of a sequence
+    :param profile: encoding options; canonical CBOR by default
+    :return: iterator of CBOR sequences
+    """
+    batch: list[bytes] = []
+    batch_size = 0
+    for native in natives:
+        item = cbor_from_native(native, profile)
+        if len(item) > max_bytes:
+            raise ValueError(
+                f"Record of {len(item)} bytes does not fit into {max_bytes} bytes"
+            )
+        if batch_size + len(item) > max_bytes:
+            yield b"".join(batch)
+            batch.clear()
+            batch_size = 0
+        batch.append(item)
+        batch_size += len(item)
+    if batch:
+        yield b"".join(batch)
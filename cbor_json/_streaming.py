@@ -0,0 +1,72 @@
+"""
+Streaming encoding of iterators.
+
+Class:
+- StreamedMap - iterable of (key, value) pairs to encode as a map
+
+write_cbor_from_native writes iterators (e.g. generators) in the data as
+indefinite-length arrays, and StreamedMaps as indefinite-length maps, while
+they produce items. Canonical CBOR does not allow indefinite lengths, so with
+a canonical profile they are collected first and written as usual.
+json_from_native with a file object streams them as JSON arrays and objects.
+"""
+
+from typing import Callable, Iterable
+
+
+class StreamedMap:
+    """
+    Iterable of (key, value) pairs to encode as a map by write_cbor_from_native
+    or json_from_native
+    """
+
+    __slots__ = ("pairs",)
+
+    def __init__(self, pairs: Iterable[tuple]):
+        self.pairs = pairs
+
+    def __repr__(self):
+        return f"StreamedMap({self.pairs!r})"
+
+
+class _Stream:
+    """
+    Iterator or StreamedMap in "cborable" data. Its items are converted to
+    "cborable" form when they are encoded.
+    """
+
+    __slots__ = ("source", "convert", "sort_container")
+
+    def __init__(self, source, convert: Callable, sort_container: Callable | None):
+        """
+        :param source: the iterator or StreamedMap
+        :param convert: function that converts an item to "cborable" form
+        :param sort_container: function that sorts a map, if keys must be sorted
+        """
+        self.source = source
+        self.convert = convert
+        self.sort_container = sort_container
+
+    def encode(self, encoder):
+        convert = self.convert
+        if isinstance(self.source, StreamedMap):
+            pairs = ((convert(k), convert(v)) for k, v in self.source.pairs)
+            if encoder.canonical or self.sort_container is not None:
+                collected = dict(pairs)
+                if self.sort_container is not None:
+                    collected = self.sort_container(collected)
+                encoder.encode(collected)
+                return
+            encoder.write(b"\xbf")
+            for key, value in pairs:
+                encoder.encode(key)
+                encoder.encode(value)
+        else:
+            items = (convert(el) for el in self.source)
+            if encoder.canonical:
+                encoder.encode(list(items))
+                return
+            encoder.write(b"\x9f")
+            for item in items:
+                encoder.encode(item)
+        encoder.write(b"\xff")  # "break"
@@ -0,0 +1,555 @@
+"""
+Validation of CBOR and jsonable input without decoding it.
+
+Classes:
+- ValidationLimits - limits to enforce
+- ValidationError - the error with the path to the bad item
+
+Functions:
+- validate_cbor - checks CBOR data
+- validate_jsonable - checks jsonable data
+
+Validation reads CBOR item heads and walks jsonable data without building the
+result: no containers, custom objects or compiled regexes are created. Only
+small tagged scalars (datetimes, decimals, UUIDs etc.) and "$type" envelopes
+of scalars are decoded to be sure they are valid. Regular expressions are
+checked to be strings only, so a bad pattern fails when the data is decoded.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+import cbor2
+
+from ._cbor_json_codecs import _cborable_from_jsonable
+from ._cbor_scan import _CONTEXT_TAGS
+
+# Tags cbor2 decodes to scalars; their items are decoded to check them
+_SCALAR_TAGS = frozenset((0, 1, 2, 3, 4, 5, 30, 36, 37, 100, 260, 261, 1004, 43000))
+_SELF_DESCRIBE_TAG = 55799
+_REGEX_TAG = 35
+_SET_TAG = 258
+_CUSTOM_OBJECT_TAG = 27
+
+_REF_TYPES = frozenset(("binary-ref", "mime-ref"))
+_SCALAR_TYPES = frozenset(
+    (
+        "datetime",
+        "date",
+        "binary-hex",
+        "binary-base58",
+        "binary-b58",
+        "binary-base64",
+        "uuid",
+        "fraction",
+        "decimal",
+        "ipv4-address",
+        "ipv4-network",
+        "ipv6-address",
+        "ipv6-network",
+        "mime",
+        "cbor-simple-value",
+    )
+)
+
+
+class ValidationLimits:
+    """
+    Limits to enforce by validate_cbor and validate_jsonable. None means
+    no limit.
+    """
+
+    def __init__(
+        self,
+        max_depth: int | None = 100,
+        max_size: int | None = None,
+        max_items: int | None = None,
+        max_nodes: int | None = None,
+        max_string_length: int | None = None,
+        class_tags: frozenset[str] | set[str] | None = None,
+    ):
+        """
+        :param max_depth: maximal nesting depth (a scalar has depth 0)
+        :param max_size: maximal size of CBOR data in bytes; not applied to
+            jsonable data
+        :param max_items: maximal number of items in one array or map
+        :param max_nodes: maximal total number of items
+        :param max_string_length: maximal length of a text or byte string
+        :param class_tags: allowed class tags of custom objects
+        """
+        self.max_depth = max_depth
+        self.max_size = max_size
+        self.max_items = max_items
+        self.max_nodes = max_nodes
+        self.max_string_length = max_string_length
+        self.class_tags = frozenset(class_tags) if class_tags is not None else None
+
+    def __repr__(self):
+        return (
+            f"ValidationLimits(max_depth={self.max_depth}, max_size={self.max_size}, "
+            f"max_items={self.max_items}, max_nodes={self.max_nodes}, "
+            f"max_string_length={self.max_string_length}, "
+            f"class_tags={self.class_tags!r})"
+        )
+
+
+_DEFAULT_LIMITS = ValidationLimits()
+
+
+class ValidationError(ValueError):
+    """
+    Invalid or unsupported data, or a violated limit.
+    path - keys and indices from the top item to the bad one
+    """
+
+    def __init__(self, message: str, path: list | None = None):
+        super().__init__(message)
+        self.message = message
+        self.path: list = path if path is not None else []
+
+    def __str__(self):
+        return f"{self.message} at {self.path}" if self.path else self.message
+
+
+# MARK: CBOR
+
+
+def _scalar_size(initial: int) -> int:
+    """
+    :return: size of a number or a simple value by its initial byte; 0 if the
+        byte starts something else
+    """
+    major = initial >> 5
+    info = initial & 0x1F
+    if major not in (0, 1, 7) or info > 27:
+        return 0
+    return 1 if info < 24 else 1 + (1 << (info - 24))
+
+
+_SCALAR_SIZES = tuple(_scalar_size(initial) for initial in range(256))
+
+_MIN_DATE_DAYS = -719162  # date.min - date(1970, 1, 1)
+_MAX_DATE_DAYS = 2932896  # date.max - date(1970, 1, 1)
+_MIN_TIMESTAMP = -62135596800  # datetime.min in UTC
+_MAX_TIMESTAMP = 253402300799  # datetime.max in UTC
+
+
+class _CborValidator:
+    def __init__(self, data, limits: ValidationLimits):
+        self.data = data
+        self.end = len(data)
+        self.limits = limits
+        self.max_depth = limits.max_depth if limits.max_depth is not None else -1
+        self.max_items = limits.max_items
+        self.max_string_length = limits.max_string_length
+        # items left to the max_nodes limit; counted by their containers
+        self.nodes_left = limits.max_nodes if limits.max_nodes is not None else -1
+
+    def count_nodes(self, count: int):
+        if self.nodes_left >= 0:
+            self.nodes_left -= count
+            if self.nodes_left < 0:
+                raise ValidationError("More items than allowed")
+
+    def head(self, pos: int) -> tuple[int, int | None, int]:
+        """
+        :return: (major type, argument, position after the head); argument is
+            None for indefinite lengths
+        """
+        if pos >= self.end:
+            raise ValidationError("Unexpected end of data")
+        initial = self.data[pos]
+        major = initial >> 5
+        info = initial & 0x1F
+        if info < 24:
+            return major, info, pos + 1
+        if info < 28:
+            after = pos + 1 + (1 << (info - 24))
+            if after > self.end:
+                raise ValidationError("Unexpected end of data")
+            return major, int.from_bytes(self.data[pos + 1 : after], "big"), after
+        if info == 31 and major in (2, 3, 4, 5):
+            return major, None, pos + 1
+        if info == 31 and major == 7:
+            raise ValidationError("Unexpected break")
+        raise ValidationError(f"Invalid initial byte 0x{initial:02x}")
+
+    def string(self, major: int, length: int, pos: int) -> int:
+        if self.max_string_length is not None and length > self.max_string_length:
+            raise ValidationError(f"String of {length} is longer than allowed")
+        after = pos + length
+        if after > self.end:
+            raise ValidationError("Unexpected end of data")
+        if major == 3:
+            try:
+                str(self.data[pos:after], "utf-8")
+            except UnicodeDecodeError as exc:
+                raise ValidationError(f"Invalid UTF-8 string: {exc.reason}") from None
+        return after
+
+    def item(self, pos: int, depth: int) -> int:
+        """
+        Checks the item at pos. The item is already counted as a node.
+        :return: position after the item
+        """
+        start = pos
+        major, arg, pos = self.head(pos)
+        if major in (0, 1, 7):
+            return pos
+        if major in (2, 3):
+            if arg is not None:
+                return self.string(major, arg, pos)
+            total = 0
+            while pos < self.end and self.data[pos] != 0xFF:
+                chunk_major, chunk_len, pos = self.head(pos)
+                if chunk_major != major or chunk_len is None:
+                    raise ValidationError("Invalid chunk of indefinite-length string")
+                total += chunk_len
+                pos = self.string(major, chunk_len, pos)
+            if self.max_string_length is not None and total > self.max_string_length:
+                raise ValidationError(f"String of {total} is longer than allowed")
+            return self.skip_break(pos)
+        if depth == self.max_depth:
+            raise ValidationError("Nesting is deeper than allowed")
+        if major == 6:
+            return self.tagged(arg, start, pos, depth)
+        if arg is not None:
+            if self.max_items is not None and arg > self.max_items:
+                raise ValidationError(
+                    f"Container of {arg} items is larger than allowed"
+                )
+            count = arg * 2 if major == 5 else arg
+            if pos + count > self.end:  # every item takes at least a byte
+                raise ValidationError("Unexpected end of data")
+            self.count_nodes(count)
+        return self.children(pos, arg, depth + 1, major == 5)
+
+    def children(self, pos: int, count: int | None, depth: int, is_map: bool) -> int:
+        """
+        Checks items of an array or keys and values of a map
+        :param pos: position of the first item
+        :param count: number of items (pairs for a map); None if indefinite
+        :param depth: depth of the items
+        :return: position after the container
+        """
+        if count is None:
+            return self.indefinite_children(pos, depth, is_map)
+        data = self.data
+        end = self.end
+        scalar_sizes = _SCALAR_SIZES
+        max_string_length = self.max_string_length
+        first_pos = pos
+        for idx in range(count * 2 if is_map else count):
+            # Fast path for valid scalars; anything else goes to self.item
+            if pos < end:
+                initial = data[pos]
+                size = scalar_sizes[initial]
+                if size:
+                    if pos + size <= end:
+                        pos += size
+                        continue
+                elif 0x40 <= initial < 0x5C or 0x60 <= initial < 0x7C:
+                    # definite-length byte or text string
+                    info = initial & 0x1F
+                    if info < 24:
+                        start = pos + 1
+                        after = start + info
+                    else:
+                        start = pos + 1 + (1 << (info - 24))
+                        after = start + int.from_bytes(data[pos + 1 : start], "big")
+                    if after <= end and (
+                        max_string_length is None or after - start <= max_string_length
+                    ):
+                        if initial < 0x60:
+                            pos = after
+                            continue
+                        try:
+                            str(data[start:after], "utf-8")
+                        except UnicodeDecodeError:
+                            pass
+                        else:
+                            pos = after
+                            continue
+            try:
+                pos = self.item(pos, depth)
+            except ValidationError as exc:
+                self.locate(exc, first_pos, idx, is_map)
+                raise
+        return pos
+
+    def indefinite_children(self, pos: int, depth: int, is_map: bool) -> int:
+        """
+        Checks items of an indefinite-length array or map
+        """
+        first_pos = pos
+        max_items = self.max_items
+        if max_items is not None and is_map:
+            max_items *= 2
+        idx = 0
+        while pos >= self.end or self.data[pos] != 0xFF:
+            if idx == max_items:
+                raise ValidationError("Container is larger than allowed")
+            self.count_nodes(1)
+            try:
+                pos = self.item(pos, depth)
+            except ValidationError as exc:
+                self.locate(exc, first_pos, idx, is_map)
+                raise
+            idx += 1
+        if idx % 2 and is_map:
+            raise ValidationError("Map key without a value")
+        return pos + 1
+
+    def locate(self, exc: ValidationError, first_pos: int, idx: int, is_map: bool):
+        """
+        Adds the index or the key of the item to the path of the error
+        :param first_pos: position of the first item of the container
+        :param idx: number of the bad item; keys and values are counted apart
+        """
+        if not is_map:
+            exc.path.insert(0, idx)
+        elif idx % 2 == 0:
+            exc.message = f"{exc.message} in a map key"
+            exc.path.insert(0, idx // 2)
+        else:
+            key_pos = first_pos
+            for _ in range(idx - 1):  # the items before are valid
+                key_pos = self.item(key_pos, 0)
+            exc.path.insert(0, self.path_key(key_pos, idx // 2))
+
+    def tagged(self, tag: Any, start: int, pos: int, depth: int) -> int:
+        """
+        Checks the tagged item whose tag head is from start to pos
+        """
+        if tag in _SCALAR_TAGS:
+            if tag in (1, 100):  # the most common ones: dates and integer timestamps
+                major, arg, after = self.head(pos)
+                if major in (0, 1) and arg is not None:
+                    value = arg if major == 0 else -1 - arg
+                    if tag == 100 and _MIN_DATE_DAYS <= value <= _MAX_DATE_DAYS:
+                        return after
+                    if tag == 1 and _MIN_TIMESTAMP <= value <= _MAX_TIMESTAMP:
+                        return after
+            after = self.item(pos, depth + 1)
+            try:
+                cbor2.loads(bytes(self.data[start:after]))
+            except Exception as exc:
+                raise ValidationError(f"Invalid value of tag {tag}: {exc}") from None
+            return after
+        if tag == _CUSTOM_OBJECT_TAG:
+            self.class_tag(pos)
+        elif tag == _SET_TAG:
+            if self.head(pos)[0] != 4:
+                raise ValidationError("Set is not an array")
+        elif tag == _REGEX_TAG:
+            if self.head(pos)[0] != 3:
+                raise ValidationError("Regular expression is not a string")
+        elif tag in _CONTEXT_TAGS:
+            raise ValidationError(
+                f"Tag {tag} (shared values and string references) is not supported"
+            )
+        elif tag == _SELF_DESCRIBE_TAG:
+            return self.item(pos, depth)
+        return self.item(pos, depth + 1)
+
+    def class_tag(self, pos: int):
+        """
+        Checks the class tag of the custom object whose array starts at pos
+        """
+        major, length, pos = self.head(pos)
+        if major != 4 or length == 0:
+            raise ValidationError("Custom object is not a non-empty array")
+        major, length, pos = self.head(pos)
+        if major != 3 or length is None:
+            raise ValidationError("Class tag is not a string")
+        class_tag = str(self.data[pos : self.string(major, length, pos)], "utf-8")
+        if not class_tag:
+            raise ValidationError("Empty class tag")
+        if (
+            self.limits.class_tags is not None
+            and class_tag not in self.limits.class_tags
+        ):
+            raise ValidationError(f'Class tag "{class_tag}" is not allowed')
+
+    def path_key(self, key_pos: int, idx: int):
+        """
+        :return: the key at key_pos if it is a string or an integer, idx otherwise
+        """
+        major, arg, pos = self.head(key_pos)
+        if major == 0:
+            return arg
+        if major == 1 and arg is not None:
+            return -1 - arg
+        if major == 3 and arg is not None:
+            return str(self.data[pos : pos + arg], "utf-8")
+        return idx
+
+    def skip_break(self, pos: int) -> int:
+        if pos >= self.end:
+            raise ValidationError("Unexpected end of data")
+        return pos + 1
+
+
+def validate_cbor(data, limits: ValidationLimits | None = None):
+    """
+    Checks that CBOR data is well-formed, can be decoded by native_from_cbor
+    and jsonable_from_cbor, and is within the limits. Regular expressions
+    (tag 35) are checked to be strings only, a bad pattern fails when decoded.
+    Shared values and string references (tags 28, 29, 256, 25) and data after
+    the top item are rejected.
+    :param data: CBOR bytes
+    :param limits: limits to enforce; max_depth=100 and no other limits by default
+    :raise ValidationError: with the path to the first bad item
+    """
+    limits = limits or _DEFAULT_LIMITS
+    if limits.max_size is not None and len(data) > limits.max_size:
+        raise ValidationError(f"Data of {len(data)} bytes is larger than allowed")
+    validator = _CborValidator(data, limits)
+    validator.count_nodes(1)
+    end = validator.item(0, 0)
+    if end != len(data):
+        raise ValidationError(f"Extra data after the top item at offset {end}")
+
+
+# MARK: JSONable
+
+
+class _JsonableValidator:
+    def __init__(self, limits: ValidationLimits):
+        self.limits = limits
+        self.max_depth = limits.max_depth if limits.max_depth is not None else -1
+        self.max_items = limits.max_items
+        self.max_string_length = limits.max_string_length
+        self.nodes_left = limits.max_nodes if limits.max_nodes is not None else -1
+
+    def item(self, val, depth: int):
+        if self.nodes_left == 0:
+            raise ValidationError("More items than allowed")
+        self.nodes_left -= 1
+        if isinstance(val, str):
+            if self.max_string_length is not None and len(val) > self.max_string_length:
+                raise ValidationError(f"String of {len(val)} is longer than allowed")
+            return
+        if val is None or isinstance(val, (int, float)):
+            return
+        if not isinstance(val, (list, tuple, dict)):
+            raise ValidationError(f"Value of type {type(val).__name__} is not JSONable")
+        if depth == self.max_depth:
+            raise ValidationError("Nesting is deeper than allowed")
+        if self.max_items is not None and len(val) > self.max_items:
+            raise ValidationError(
+                f"Container of {len(val)} items is larger than allowed"
+            )
+        if isinstance(val, dict):
+            if "$type" in val:
+                self.envelope(val, depth)
+                return
+            for key, el in val.items():
+                if not isinstance(key, str):
+                    raise ValidationError(f"Key {key!r} is not a string")
+                self.child(el, depth, key)
+        else:
+            for idx, el in enumerate(val):
+                self.child(el, depth, idx)
+
+    def child(self, val, depth: int, *path):
+        """
+        Checks val at the path (relative to the item at depth)
+        """
+        try:
+            self.item(val, depth + 1)
+        except ValidationError as exc:
+            exc.path[:0] = path
+            raise
+
+    def field(self, envelope: dict, name: str, types: tuple) -> Any:
+        """
+        :return: value of the field of a "$type" envelope, if it has one of types
+        """
+        val = envelope.get(name)
+        if not isinstance(val, types) or isinstance(val, bool):
+            raise ValidationError(
+                f'Invalid field "{name}" of $type "{envelope["$type"]}"'
+            )
+        return val
+
+    def envelope(self, val: dict, depth: int):
+        val_type = val["$type"]
+        if val_type in _SCALAR_TYPES or val_type == "regex":
+            value = self.field(
+                val, "$value", (int,) if val_type == "cbor-simple-value" else (str,)
+            )
+            self.child(value, depth, "$value")
+            if val_type == "regex":  # not compiled
+                return
+            try:
+                _cborable_from_jsonable(val)
+            except Exception as exc:
+                raise ValidationError(
+                    f'Invalid value of $type "{val_type}": {exc}', ["$value"]
+                ) from None
+        elif val_type in _REF_TYPES:
+            self.field(val, "$value", (str,))
+            if self.field(val, "$length", (int,)) < 0:
+                raise ValidationError("Negative length", ["$length"])
+        elif val_type == "custom-object":
+            class_tag = self.field(val, "$class_tag", (str,))
+            values = self.field(val, "$value", (list, tuple))
+            try:
+                self.check_class_tag(class_tag)
+            except ValidationError as exc:
+                exc.path.append("$class_tag")
+                raise
+            self.child(values, depth, "$value")
+        elif val_type == "tagged-value":
+            tag = self.field(val, "$cbor_tag", (int,))
+            if tag < 0:
+                raise ValidationError("Negative tag", ["$cbor_tag"])
+            value = val.get("$value")
+            self.child(value, depth, "$value")
+            if tag == _CUSTOM_OBJECT_TAG:
+                if (
+                    not isinstance(value, (list, tuple))
+                    or not value
+                    or not isinstance(value[0], str)
+                ):
+                    raise ValidationError("Invalid custom object", ["$value"])
+                try:
+                    self.check_class_tag(value[0])
+                except ValidationError as exc:
+                    exc.path.extend(("$value", 0))
+                    raise
+        elif val_type in ("map", "set"):
+            elements = self.field(val, "$value", (list, tuple))
+            if val_type == "map":
+                for idx, pair in enumerate(elements):
+                    if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                        raise ValidationError(
+                            "Map item is not a [key, value] pair", ["$value", idx]
+                        )
+            self.child(elements, depth, "$value")
+        elif val_type != "undefined":
+            raise ValidationError(f'$type "{val_type}" is not supported')
+
+    def check_class_tag(self, class_tag: str):
+        if not class_tag:
+            raise ValidationError("Empty class tag")
+        if (
+            self.limits.class_tags is not None
+            and class_tag not in self.limits.class_tags
+        ):
+            raise ValidationError(f'Class tag "{class_tag}" is not allowed')
+
+
+def validate_jsonable(jsonable, limits: ValidationLimits | None = None):
+    """
+    Checks that jsonable data can be converted by native_from_jsonable and
+    cbor_from_jsonable, and is within the limits. Blob references are checked
+    for their form only.
+    :param jsonable: jsonable data
+    :param limits: limits to enforce; max_depth=100 and no other limits by
+        default; max_size is not applied
+    :raise ValidationError: with the path to the first bad item
+    """
+    _JsonableValidator(limits or _DEFAULT_LIMITS).item(jsonable, 0)
@@ -24,7 +24,7 @@ from typing import Dict as _Dict, List as _List
 
 from ._custom_objects_base import (
     SerializableToCbor as _SerializableToCbor,
-    register_custom_class as _register_custom_class,
+    _register_class as _register_custom_class,
 )
 
 
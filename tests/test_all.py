@@ -1,5 +1,16 @@
 import json
 import base64
+import copy
+import os
+import pickle
+import subprocess
+import sys
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import io
+import multiprocessing
+import queue
+import random
 from datetime import datetime
 from datetime import date, timezone  # noqa: F401
 
@@ -24,9 +35,46 @@ from cbor_json import (
     jsonable_from_native,
     SerializableToCbor,
     register_custom_class,
+    DirectoryBlobStore,
+    instrumented,
+    EncoderProfile,
+    FAST_PROFILE,
+    DETERMINISTIC_PROFILE,
+    EncodeCache,
+    DecodeCache,
+    IncrementalDecoder,
+    StringInterner,
+    ContainerWriter,
+    ContainerReader,
+    RecordStore,
+    native_from_cbor_parallel,
+    jsonable_from_cbor_parallel,
+    cbor_size_of,
+    json_size_of,
+    cbor_batches,
+    write_cbor_from_native,
+    StreamedMap,
+    ValidationLimits,
+    ValidationError,
+    validate_cbor,
+    validate_jsonable,
+    cbor_delta,
+    apply_cbor_delta,
+    content_hash,
+    DigestCache,
+    RawCbor,
+    SharedMemoryQueue,
+    native_from_json,
+    json_from_native,
 )
-from cbor_json._cbor_json_codecs import _native_from_cborable, _transform_collection
+from cbor_json._cbor_json_codecs import (
+    _cborable_from_jsonable,
+    _native_from_cborable,
+    _transform_collection,
+)
+from cbor_json._cbor_scan import _ItemScanner, _ContextDependent
 from cbor_json import custom_objects
+from cbor_json import _custom_objects_base
 from cbor_json import UnrecognizedCustomObject  # noqa: F401
 
 
@@ -328,3 +376,1058 @@ def test_custom_objects():
     unitialized_dfs = custom_objects.DataFrameSerialized()
     assert unitialized_dfs.rows_data() == []
     assert unitialized_dfs.columns_data() == {}
+
+
+def test_blob_store(tmp_path):
+    store = DirectoryBlobStore(str(tmp_path / "blobs"), threshold=100)
+    big = bytes(range(256)) * 10
+    native = {"small": b"abc", "big": big, "again": big}
+
+    jsonable = jsonable_from_native(native, blob_store=store)
+    assert jsonable["small"] == {"$type": "binary-hex", "$value": "616263"}
+    assert jsonable["big"]["$type"] == "binary-ref"
+    assert jsonable["big"]["$length"] == len(big)
+    assert jsonable["again"] == jsonable["big"]  # content-addressed
+    assert jsonable_from_cbor(cbor_from_native(native), blob_store=store) == jsonable
+
+    jsonable = json.loads(json.dumps(jsonable))
+    assert native_from_jsonable(jsonable, blob_store=store) == native
+    assert cbor_from_jsonable(jsonable, blob_store=store) == cbor_from_native(native)
+
+    with pytest.raises(ValueError) as exc_ve:
+        native_from_jsonable(jsonable)
+    assert str(exc_ve.value) == '$type "binary-ref" requires a blob store'
+
+    wrong_length = dict(jsonable["big"], **{"$length": 1})
+    with pytest.raises(ValueError):
+        native_from_jsonable(wrong_length, blob_store=store)
+    with pytest.raises(ValueError):
+        cbor_from_jsonable(wrong_length, blob_store=store)
+
+    # cbor_from_jsonable writes blobs from memory-mapped files, not read copies
+    class WatchedStore(DirectoryBlobStore):
+        def get(self, key, length):
+            calls.append("get")
+            return super().get(key, length)
+
+        def open(self, key, length):
+            data = super().open(key, length)
+            calls.append(type(data).__name__)
+            return data
+
+    calls: list = []
+    watched = WatchedStore(store.path, threshold=100)
+    assert cbor_from_jsonable(jsonable, blob_store=watched) == cbor_from_native(native)
+    assert calls == ["mmap", "mmap"]
+    calls.clear()
+    assert native_from_jsonable(jsonable, blob_store=watched) == native
+    assert calls == ["get", "get"]
+
+    mime = native_from_jsonable(
+        {"$type": "mime", "$value": base64.encodebytes(b"Some text.\n" * 50).decode()}
+    )
+    jsonable = jsonable_from_native([mime], blob_store=store)
+    assert jsonable[0]["$type"] == "mime-ref"
+    jsonable = json.loads(json.dumps(jsonable))
+    assert native_from_jsonable(jsonable, blob_store=store)[0].as_bytes() == (
+        mime.as_bytes()
+    )
+    assert cbor_from_jsonable(jsonable, blob_store=store) == cbor_from_native([mime])
+
+
+def test_instrumentation():
+    native = {"when": date(2024, 1, 2), "hash": custom_objects.HashCrc32(b"hi")}
+    cbor = cbor_from_native(native)
+
+    with instrumented() as collected:
+        native_from_cbor(cbor)
+        jsonable_from_cbor(cbor)
+    nfc_stats, jfc_stats = collected
+    assert nfc_stats.conversion == "native_from_cbor"
+    assert nfc_stats.input_size == len(cbor)
+    assert nfc_stats.output_size is None
+    assert list(nfc_stats.phases) == ["cbor_decode", "to_native"]
+    assert nfc_stats.cbor_tags == {27: 1}
+    assert nfc_stats.python_types["date"] == 1
+    assert nfc_stats.class_tags == {"#0": 1}
+    assert nfc_stats.max_depth == 3  # dict -> tag 27 -> list -> digest
+    assert jfc_stats.json_types == {"date": 1, "custom-object": 1, "binary-hex": 1}
+
+    received: list = []
+    with instrumented(callback=received.append, sample_rate=0.0) as collected:
+        cbor_from_native(native)
+    with instrumented(callback=received.append) as collected:
+        cbor_from_native(native)
+    assert collected == []
+    assert len(received) == 1
+    assert received[0].output_size == len(cbor)
+
+
+def test_encoder_profiles():
+    native1 = {"b": 1, "a": [{3, 1, 2}], 10: "ten"}
+    native2 = {10: "ten", "a": [{2, 3, 1}], "b": 1}
+    canonical = cbor_from_native(native1)
+    assert cbor_from_native(native2) == canonical
+
+    fast1 = cbor_from_native(native1, profile=FAST_PROFILE)
+    assert fast1 != canonical
+    assert native_from_cbor(fast1) == native1
+
+    det1 = cbor_from_native(native1, profile=DETERMINISTIC_PROFILE)
+    assert det1 == cbor_from_native(native2, profile=DETERMINISTIC_PROFILE)
+    assert native_from_cbor(det1) == native1
+    assert (
+        cbor_from_jsonable(jsonable_from_native(native1), profile=DETERMINISTIC_PROFILE)
+        == det1
+    )
+    # string keys: sorted as strings, not by the length of encoded keys
+    det2 = cbor_from_native({"c": 2, "bb": 1}, profile=DETERMINISTIC_PROFILE)
+    assert det2 != cbor_from_native({"c": 2, "bb": 1})
+    assert det2 == cbor_from_native({"bb": 1, "c": 2}, profile=DETERMINISTIC_PROFILE)
+    assert cbor_from_jsonable({"c": 2, "bb": 1}, profile=DETERMINISTIC_PROFILE) == det2
+    nested = {"b": [{"d": 1, "c": (2, {"f": 1, "e": 2})}], "a": {3: 1, 2: 0}}
+    assert cbor_from_native(nested, profile=DETERMINISTIC_PROFILE) == cbor2.dumps(
+        {"a": {2: 0, 3: 1}, "b": [{"c": [2, {"e": 2, "f": 1}], "d": 1}]}
+    )
+
+    moment = datetime(2024, 5, 6, 7, 8, 9, tzinfo=timezone.utc)
+    assert cbor_from_native(moment).hex() == "c11a663881d9"  # tag 1, integer
+    as_string = cbor_from_native(
+        moment, profile=EncoderProfile(datetime_as_timestamp=False)
+    )
+    assert as_string == b"\xc0t2024-05-06T07:08:09Z"  # tag 0
+    assert native_from_cbor(as_string) == moment
+
+
+def test_encode_cache():
+    cache = EncodeCache(max_entries=2, min_size=0)
+    config = cbor2.FrozenDict({"limits": (1, 2.5, "x"), "tags": frozenset({"a", "b"})})
+    native = {"config": config, "items": [config, (1, 2)]}
+    expected = cbor_from_native(native)
+    assert cbor_from_native(native, cache=cache) == expected
+    assert (cache.hits, cache.misses, cache.entries) == (1, 2, 2)
+    assert cbor_from_native(native, cache=cache) == expected
+    assert (cache.hits, cache.misses) == (4, 2)
+
+    # equal values of different types are different entries
+    assert cbor_from_native((1, True, 1.0), cache=cache) == cbor_from_native(
+        (1, True, 1.0)
+    )
+    assert cbor_from_native((True, 1.0, 1), cache=cache) == cbor_from_native(
+        (True, 1.0, 1)
+    )
+    assert cache.evictions == 2
+
+    # cache entries are profile-specific; tuples with lists are not cached
+    deterministic = cbor_from_native(native, DETERMINISTIC_PROFILE)
+    assert cbor_from_native(native, DETERMINISTIC_PROFILE, cache) == deterministic
+    misses = cache.misses
+    assert cbor_from_native(([1],), cache=cache) == cbor_from_native(([1],))
+    assert cache.misses == misses
+
+    # the same object under two profiles, then evicted
+    cache = EncodeCache(max_entries=2, min_size=0)
+    value = cbor2.FrozenDict({"c": 2, "bb": (1, 2.5)})
+    fast = cbor_from_native(value, FAST_PROFILE)
+    deterministic = cbor_from_native(value, DETERMINISTIC_PROFILE)
+    assert fast != deterministic
+    for _ in range(2):
+        assert cbor_from_native(value, FAST_PROFILE, cache) == fast
+        assert cbor_from_native(value, DETERMINISTIC_PROFILE, cache) == deterministic
+    assert (cache.hits, cache.misses, cache.evictions, cache.entries) == (2, 2, 0, 2)
+    cbor_from_native((1, 2), cache=cache)
+    cbor_from_native((3, 4), cache=cache)
+    assert (cache.hits, cache.misses, cache.evictions, cache.entries) == (2, 4, 2, 2)
+    assert cbor_from_native(value, FAST_PROFILE, cache) == fast  # encoded again
+    assert (cache.hits, cache.misses, cache.evictions) == (2, 5, 3)
+
+    # without sorting, equal FrozenDicts in different order are different entries
+    ab = cbor2.FrozenDict({"a": 1, "b": 2})
+    ba = cbor2.FrozenDict({"b": 2, "a": 1})
+    for value in (ab, ba):
+        expected = cbor_from_native(value, FAST_PROFILE)
+        assert cbor_from_native(value, FAST_PROFILE, cache) == expected
+    assert cbor_from_native(ab, FAST_PROFILE) != cbor_from_native(ba, FAST_PROFILE)
+    misses = cache.misses
+    assert cbor_from_native(ba, DETERMINISTIC_PROFILE, cache) == (
+        cbor_from_native(ab, DETERMINISTIC_PROFILE, cache)
+    )
+    assert cache.misses == misses + 1
+
+    cache.clear()
+    assert (cache.entries, cache.size_bytes) == (0, 0)
+
+
+def test_decode_cache():
+    cache = DecodeCache(max_bytes=1000)
+    native = {"a": [1, {2, 3}], "b": {"c": custom_objects.HashCrc32(b"hi")}}
+    cbor = cbor_from_native(native)
+
+    res = native_from_cbor(cbor, cache=cache)
+    assert res == {"a": (1, frozenset({2, 3})), "b": {"c": native["b"]["c"]}}
+    assert isinstance(res, cbor2.FrozenDict)
+    assert hash(res)
+    assert native_from_cbor(cbor, cache=cache) is res
+    assert (cache.hits, cache.misses, cache.entries) == (1, 1, 1)
+    assert cbor_from_native(res) == cbor
+
+    jsonable = jsonable_from_cbor(cbor, cache=cache)
+    assert isinstance(jsonable["a"], tuple)
+    with pytest.raises(TypeError):
+        jsonable["x"] = 1
+    assert jsonable_from_cbor(cbor, cache=cache) is jsonable
+    assert json.loads(json.dumps(jsonable)) == jsonable_from_cbor(cbor)
+    assert (cache.hits, cache.misses, cache.entries) == (2, 2, 2)
+    assert copy.copy(jsonable) is jsonable
+    for copied in (copy.deepcopy(jsonable), pickle.loads(pickle.dumps(jsonable))):
+        assert copied == jsonable and copied is not jsonable
+        assert type(copied) is type(jsonable)
+        assert type(copied["b"]) is type(jsonable["b"])
+    mutable = dict(jsonable)
+    mutable["x"] = 1
+
+    native_from_cbor(cbor_from_native(bytes(990)), cache=cache)
+    assert cache.evictions == 2
+    assert cache.size_bytes <= 1000
+    native_from_cbor(cbor_from_native(bytes(2000)), cache=cache)  # too big
+    assert cache.entries == 1
+
+
+def test_frozen_decoding():
+    native = {"a": [1, {2, 3}], "b": {"c": [custom_objects.HashCrc32(b"hi")]}, 4: []}
+    expected = cbor2.FrozenDict(
+        {
+            "a": (1, frozenset({2, 3})),
+            "b": cbor2.FrozenDict({"c": (native["b"]["c"][0],)}),
+            4: (),
+        }
+    )
+    for frozen in (
+        native_from_cbor(cbor_from_native(native), frozen=True),
+        native_from_jsonable(jsonable_from_native(native), frozen=True),
+    ):
+        assert frozen == expected
+        assert isinstance(frozen, cbor2.FrozenDict)
+        assert isinstance(frozen["a"], tuple)
+        assert {frozen: 1}  # is hashable
+        assert cbor_from_native(frozen) == cbor_from_native(native)
+
+    # custom objects still get their values as usual
+    dfs = custom_objects.DataFrameSerialized(pd.DataFrame({"a": [1, 2]}))
+    decoded = native_from_cbor(cbor_from_native((dfs,)), frozen=True)
+    assert decoded[0].rows_data() == [{"a": 1}, {"a": 2}]
+
+
+def test_in_place_conversion():
+    def make_native():
+        shared = [date(2024, 1, 2), b"\x00"]
+        return {
+            "rows": [
+                {"n": i, "when": date(2024, 1, 1 + i), "tags": {"a"}} for i in range(3)
+            ],
+            "shared": [shared, shared],
+            "keys": {(1, 2): "x"},
+            "hash": custom_objects.HashCrc32(b"hi"),
+            "t": (1, [2]),
+        }
+
+    expected = jsonable_from_native(make_native())
+    native = make_native()
+    rows = native["rows"]
+    jsonable = jsonable_from_native(native, consume=True)
+    assert jsonable == expected
+    assert jsonable is native and jsonable["rows"] is rows  # containers are reused
+    assert jsonable["shared"][0] is jsonable["shared"][1]
+
+    jsonable = json.loads(json.dumps(expected))
+    rows = jsonable["rows"]
+    native = native_from_jsonable(jsonable, consume=True)
+    assert native == native_from_jsonable(json.loads(json.dumps(expected)))
+    assert native is jsonable and native["rows"] is rows
+    assert native["rows"][1] == {"n": 1, "when": date(2024, 1, 2), "tags": {"a"}}
+
+    looped: list = [1]
+    looped.append(looped)
+    for convert in (jsonable_from_native, native_from_jsonable):
+        with pytest.raises(ValueError):
+            convert(looped, consume=True)
+    with pytest.raises(ValueError):
+        native_from_jsonable([], frozen=True, consume=True)
+
+
+def test_string_interning():
+    records = [{"name": f"n{i % 3}", "long_key_" * 10: i} for i in range(10)]
+    interner = StringInterner()
+    for decoded in (
+        native_from_cbor(cbor_from_native(records), interner=interner),
+        [native_from_cbor(cbor_from_native(rec), interner=interner) for rec in records],
+        native_from_jsonable(jsonable_from_native(records), interner=interner),
+    ):
+        assert decoded == records
+        keys = [next(iter(rec)) for rec in decoded]
+        assert all(key is keys[0] for key in keys)
+        assert decoded[0]["name"] is not decoded[3]["name"]  # values are not
+    assert interner.entries == 1  # too long keys are not interned
+    assert interner.saved_bytes >= sys.getsizeof("name") * interner.hits
+
+    interner = StringInterner(values=True, max_entries=2)
+    decoded = native_from_cbor(
+        cbor_from_native(records), frozen=True, interner=interner
+    )
+    assert decoded[0]["name"] is decoded[3]["name"]  # "n0" got into the table
+    assert decoded[2]["name"] is not decoded[5]["name"]  # "n2" did not
+    assert interner.entries == 2
+
+
+def test_incremental_decoder():
+    items = [1, "x" * 300, [1, [2, {"a": b"z" * 70000}]], {(1, 2): {3, 4}}, None]
+    stream = b"".join(cbor_from_native(item) for item in items)
+    stream += bytes.fromhex("9f018202039f0405ffff")  # indefinite arrays
+    stream += bytes.fromhex("7f657374726561646d696e67ff")  # indefinite string
+    items += [[1, [2, 3], [4, 5]], "streaming"]
+
+    for chunk_size in (1, 2, 3, 7, 1000, len(stream)):
+        decoder = IncrementalDecoder()
+        decoded = []
+        for pos in range(0, len(stream), chunk_size):
+            decoded += decoder.feed(stream[pos : pos + chunk_size])
+        decoder.close()
+        assert decoded == items
+        assert decoder.pending_bytes == 0
+
+    decoder = IncrementalDecoder(jsonable_from_cbor)
+    assert decoder.feed(cbor_from_native({1: 2})[:-1]) == []
+    assert decoder.pending_bytes == 2
+    with pytest.raises(cbor2.CBORDecodeEOF):
+        decoder.close()
+    assert decoder.feed(b"\x02\xff") == [{"$type": "map", "$value": [[1, 2]]}]
+    with pytest.raises(cbor2.CBORDecodeValueError) as exc:
+        decoder.feed(b"")  # the error is reported after completed items
+    assert str(exc.value) == "Unexpected break at 0"
+
+    # after an error the scanner position matches its open containers
+    for data, error in (
+        (b"\x82\x01\x1c", cbor2.CBORDecodeValueError),
+        (b"\x82\x01\xd8\x1c\x00", _ContextDependent),
+    ):
+        scanner = _ItemScanner(watch_context=True)
+        for _ in range(2):
+            with pytest.raises(error):
+                scanner.scan(data)
+            assert (scanner.pos, scanner._stack) == (2, [1])
+
+
+@pytest.mark.parametrize("compression", [None, "zlib", "lzma"])
+def test_container(tmp_path, compression):
+    path = str(tmp_path / "records.cbjc")
+    records = [{"n": i, "name": f"record {i}", "tags": ["a", "b"]} for i in range(1000)]
+    zdict = cbor_from_native(records[0]) if compression == "zlib" else None
+    with ContainerWriter(path, compression, zdict=zdict, block_size=1000) as writer:
+        for record in records:
+            writer.write(record)
+    assert writer.records == 1000
+
+    with ContainerReader(path, zdict=zdict) as reader:
+        assert len(reader) == 1000
+        assert reader.blocks > 1
+        assert reader[0] == records[0]
+        assert reader[567] == records[567]
+        assert reader[-1] == records[-1]
+        assert reader.raw(3) == cbor_from_native(records[3])
+        with pytest.raises(IndexError):
+            reader[1000]
+        assert list(reader) == records
+        with ThreadPoolExecutor(4) as executor:
+            assert list(reader.scan(executor)) == records
+    if compression is None:
+        with ContainerReader(path, decode=jsonable_from_cbor) as reader:
+            assert list(reader.scan(max_workers=2)) == records
+
+    if zdict:
+        with pytest.raises(ValueError):
+            ContainerReader(path)
+        with pytest.raises(ValueError):
+            ContainerReader(path, zdict=b"another")
+
+    unclosed_path = str(tmp_path / "unclosed.cbjc")
+    with ContainerWriter(unclosed_path, block_size=1) as writer:
+        writer.write(1)
+        with pytest.raises(ValueError):
+            ContainerReader(unclosed_path)
+
+
+def test_record_store(tmp_path):
+    path = str(tmp_path / "store.log")
+    with RecordStore(path) as store:
+        for i in range(2000):
+            store[i] = {"n": i, "square": i * i}
+        store[("composite", 1)] = [b"abc", date(2024, 1, 2)]
+        store[5] = "overwritten"
+        del store[6]
+        with pytest.raises(KeyError):
+            del store[6]
+        assert len(store) == 2000
+        assert store[5] == "overwritten"
+        assert store[1999] == {"n": 1999, "square": 1999 * 1999}
+        assert 6 not in store and 7 in store
+        assert store.get(6, "default") == "default"
+        assert store.get_cbor(7) == cbor_from_native({"n": 7, "square": 49})
+        with pytest.raises(KeyError):
+            store[6]
+        # iteration right after writes in the same session
+        assert list(store)[-2:] == [("composite", 1), 5]
+        assert dict(store.items())[("composite", 1)] == [b"abc", date(2024, 1, 2)]
+        old_map = store._log_map
+        store["grows the log"] = True
+        assert store["grows the log"] and old_map.closed  # remapped
+        del store["grows the log"]
+
+    with RecordStore(path) as store:  # reopened with the saved index
+        assert len(store) == 2000
+        assert store[("composite", 1)] == [b"abc", date(2024, 1, 2)]
+        keys = list(store)
+        assert keys[-2:] == [("composite", 1), 5]
+        size_before = os.path.getsize(path)
+        store.compact()
+        assert os.path.getsize(path) < size_before
+        assert list(store) == keys
+        assert dict(store.items())[5] == "overwritten"
+        store["after compaction"] = True
+        assert list(store.keys())[-1] == "after compaction"
+
+    os.unlink(path + ".idx")
+    with open(path, "ab") as log_f:
+        log_f.write(b"torn entry")
+    with RecordStore(path, decode=jsonable_from_cbor) as store:  # index rebuilt
+        assert len(store) == 2001
+        assert store["after compaction"] is True
+        assert store[0] == {"n": 0, "square": 0}
+
+    with RecordStore(path, decode=memoryview) as store:  # decode keeps a view
+        store["kept"] = 1
+        kept = store["kept"]
+        old_map = store._log_map
+        store["another"] = 2
+        assert store["another"] == cbor_from_native(2)
+        assert not old_map.closed and kept == cbor_from_native(1)  # still viewed
+        kept.release()
+
+
+def test_parallel_decoding():
+    records = [
+        {
+            "n": i,
+            "when": date(2024, 1, 1 + i % 28),
+            "hash": custom_objects.HashCrc32(b"x"),
+        }
+        for i in range(500)
+    ]
+    data = cbor_from_native(records)
+    with ThreadPoolExecutor(3) as executor:
+        assert native_from_cbor_parallel(data, executor, chunk_size=500) == records
+        assert jsonable_from_cbor_parallel(
+            data, executor=executor, chunk_size=500
+        ) == jsonable_from_cbor(data)
+    assert native_from_cbor_parallel(data, max_workers=2, chunk_size=5000) == records
+
+    # Indefinite-length array
+    indefinite = b"\x9f" + b"".join(cbor_from_native(rec) for rec in records) + b"\xff"
+    with ThreadPoolExecutor(3) as executor:
+        assert (
+            native_from_cbor_parallel(indefinite, executor, chunk_size=500) == records
+        )
+
+    # Not splittable: sequential decoding gives the same result or error
+    shared = cbor2.dumps([[1, 2]] * 100, value_sharing=True)
+    assert native_from_cbor_parallel(shared, chunk_size=10) == [[1, 2]] * 100
+    assert native_from_cbor_parallel(cbor_from_native({"a": 1}), chunk_size=1) == {
+        "a": 1
+    }
+    with pytest.raises(cbor2.CBORDecodeEOF):
+        native_from_cbor_parallel(data[:-1], chunk_size=500)
+
+
+def _echo_lengths(in_queue, out_queue):
+    while (native := in_queue.get()) is not None:
+        out_queue.put({"n": len(native)})
+    out_queue.put(None)
+
+
+def test_shared_memory_queue():
+    records = [{"n": i, "when": date(2024, 1, 1), "blob": b"x" * i} for i in range(40)]
+    with SharedMemoryQueue(capacity=1024) as shm_queue:
+        for _ in range(5):  # wraps around the ring
+            shm_queue.put(records[:5])
+            assert shm_queue.get() == records[:5]
+        shm_queue.put(records)  # too big for the ring: a segment of its own
+        shm_queue.put_cbor(cbor_from_native({1, 2}))
+        assert shm_queue.get() == records
+        assert shm_queue.get(frozen=True) == frozenset({1, 2})
+        shm_queue.put("a" * 600)
+        with pytest.raises(queue.Full):
+            shm_queue.put("b" * 600, block=False)
+        assert shm_queue.get_cbor() == cbor_from_native("a" * 600)
+        shm_queue.put("b" * 600, timeout=1)
+        assert shm_queue.get() == "b" * 600
+        with pytest.raises(queue.Empty):
+            shm_queue.get(timeout=0.01)
+
+    ctx = multiprocessing.get_context("spawn")
+    with SharedMemoryQueue(1 << 16, ctx=ctx) as in_queue, SharedMemoryQueue(
+        ctx=ctx
+    ) as out_queue:
+        child = ctx.Process(target=_echo_lengths, args=(in_queue, out_queue))
+        child.start()
+        for i in range(20):
+            in_queue.put(records[:i])
+        in_queue.put(b"x" * 100000)
+        in_queue.put(None)
+        lengths = []
+        while (res := out_queue.get(timeout=30)) is not None:
+            lengths.append(res["n"])
+        child.join()
+        assert lengths == list(range(20)) + [100000]
+
+
+SIZED_VALUES = [
+    None,
+    True,
+    -25,
+    2**64,
+    -(2**70),
+    0.0,
+    1.5,
+    0.1,
+    32752.0,
+    65504.0,
+    1e300,
+    math.nan,
+    -math.inf,
+    "",
+    "a" * 24,
+    'ж\n"\\\x01😀',
+    b"x" * 17,
+    b"x" * 58,
+    b"x" * 1000,
+    date(1900, 5, 5),
+    datetime(2020, 1, 1, 1, 2, 3, 456),
+    uuid.uuid4(),
+    decimal.Decimal("1.25"),
+    fractions.Fraction(1, 3),
+    ipaddress.ip_network("10.0.0.0/8"),
+    re.compile("a+"),
+    cbor2.undefined,
+    cbor2.CBORSimpleValue(100),
+    cbor2.CBORTag(1000, [1, 2]),
+    {1, 2, "x"},
+    {"a": 1, "$type": 2},
+    {(1, 2): "x"},
+    cbor2.FrozenDict({"a": (1, 2)}),
+    custom_objects.HashSha256(b"x"),
+    [{"k": i, "v": [i * 1.1, str(i)]} for i in range(300)],
+]
+
+
+@pytest.mark.parametrize("native", SIZED_VALUES)
+def test_size_of(native):
+    for profile in (None, FAST_PROFILE):
+        assert cbor_size_of(native, profile) == len(cbor_from_native(native, profile))
+    jsonable = jsonable_from_native(native)
+    assert json_size_of(native) == len(json.dumps(jsonable))
+    assert json_size_of(native, ensure_ascii=False, separators=(",", ":")) == len(
+        json.dumps(jsonable, ensure_ascii=False, separators=(",", ":")).encode()
+    )
+
+
+def test_cbor_batches():
+    records = [{"n": i, "text": "x" * (i % 50)} for i in range(200)]
+    batches = list(cbor_batches(records, 1000))
+    decoder = IncrementalDecoder()
+    decoded = [decoder.feed(batch) for batch in batches]
+    assert [rec for batch_recs in decoded for rec in batch_recs] == records
+    assert all(len(batch) <= 1000 for batch in batches)
+    for batch, next_batch_recs in zip(batches, decoded[1:]):  # batches are full
+        assert len(batch) + cbor_size_of(next_batch_recs[0]) > 1000
+
+    assert list(cbor_batches([], 1000)) == []
+    with pytest.raises(ValueError):
+        list(cbor_batches(records, 20))
+
+
+def test_streaming_encoding():
+    produced = []
+
+    def rows(count):
+        for i in range(count):
+            produced.append(i)
+            yield {"n": i, "day": date(2024, 1, 1 + i % 28), "parts": iter([i, -i])}
+
+    def native():
+        return {
+            "rows": rows(100),
+            "totals": StreamedMap((f"k{i}", {i}) for i in range(10)),
+            "hash": custom_objects.HashCrc32(b"x"),
+        }
+
+    expected = {
+        "rows": [
+            {"n": i, "day": date(2024, 1, 1 + i % 28), "parts": [i, -i]}
+            for i in range(100)
+        ],
+        "totals": {f"k{i}": {i} for i in range(10)},
+        "hash": custom_objects.HashCrc32(b"x"),
+    }
+    for profile in (FAST_PROFILE, DETERMINISTIC_PROFILE, None):
+        fp = io.BytesIO()
+        write_cbor_from_native(native(), fp, profile)
+        assert native_from_cbor(fp.getvalue()) == expected
+        if profile is None:  # canonical: collected first
+            assert fp.getvalue() == cbor_from_native(expected)
+        else:
+            assert b"\x9f" in fp.getvalue()  # indefinite-length array
+
+    # items are encoded while they are produced
+    class Probe(io.BytesIO):
+        def write(self, data):
+            probe_writes.append(len(produced))
+            return super().write(data)
+
+    produced.clear()
+    probe_writes: list[int] = []
+    write_cbor_from_native(rows(100), Probe(), FAST_PROFILE)
+    assert probe_writes[0] == 0 and probe_writes[-1] == 100
+
+    with pytest.raises(ValueError):
+        cbor_from_native(iter([1]))
+
+
+def test_json_text():
+    native = {
+        "rows": [
+            {"n": i, "day": date(2024, 1, 1 + i), "tags": {"a"}} for i in range(3)
+        ],
+        "keys": {(1, 2): [b"\x00"], "$type": 1},
+        "hash": custom_objects.HashCrc32(b"x"),
+        "tagged": cbor2.CBORTag(1000, {"d": date(2020, 1, 1)}),
+        "frozen": cbor2.FrozenDict({"a": 1}),
+        "simple": [cbor2.CBORSimpleValue(100)],
+        "text": "ж",
+    }
+    text = json.dumps(jsonable_from_native(native))
+    assert json_from_native(native) == text
+    fp = io.StringIO()
+    assert json_from_native(native, fp) is None
+    assert fp.getvalue() == text
+    assert native_from_json(text) == native_from_jsonable(json.loads(text))
+    assert native_from_json(io.StringIO(text))["keys"] == {
+        (1, 2): [b"\x00"],
+        "$type": 1,
+    }
+    assert native_from_json(text.encode())["tagged"] == native["tagged"]
+    assert native_from_json(json_from_native(cbor2.CBORSimpleValue(100))) == (
+        cbor2.CBORSimpleValue(100)
+    )
+    # a custom object written as a plain tag 27
+    tagged_text = json.dumps(
+        {
+            "$type": "tagged-value",
+            "$cbor_tag": 27,
+            "$value": ["#0", {"$type": "binary-hex", "$value": "8cdc1683"}],
+        }
+    )
+    from_json = native_from_json(tagged_text)
+    assert from_json == native_from_jsonable(json.loads(tagged_text))
+    assert from_json == custom_objects.HashCrc32(b"x")
+
+    # iterators are streamed to a file, and collected otherwise
+    def streamed():
+        return {
+            "rows": ({"n": i, "day": date(2024, 1, 1)} for i in range(3)),
+            "empty": iter(()),
+            "totals": StreamedMap((f"k{i}", iter([i])) for i in range(2)),
+        }
+
+    expected = {
+        "rows": [{"n": i, "day": date(2024, 1, 1)} for i in range(3)],
+        "empty": [],
+        "totals": {"k0": [0], "k1": [1]},
+    }
+    fp = io.StringIO()
+    json_from_native(streamed(), fp)
+    assert native_from_json(fp.getvalue()) == expected
+    assert native_from_json(json_from_native(streamed())) == expected
+    fp = io.StringIO()
+    with pytest.raises(ValueError):
+        json_from_native(StreamedMap([(1, 2)]), fp)
+    assert native_from_json(json_from_native(StreamedMap([(1, 2)]))) == {1: 2}
+
+    looped: list = [1]
+    looped.append(looped)
+    with pytest.raises(ValueError):
+        json_from_native(looped)
+
+
+def test_validation():
+    native = {
+        "rows": [{"n": i, "when": date(2024, 1, 1 + i)} for i in range(3)],
+        "misc": [
+            datetime(2024, 1, 2, 3, 4, 5, 6, tzinfo=timezone.utc),
+            uuid.uuid4(),
+            decimal.Decimal("1.5"),
+            re.compile("a+"),
+            {1, 2},
+            {(1, 2): b"x" * 40},
+            custom_objects.HashCrc32(b"x"),
+            cbor2.CBORTag(1000, "v"),
+            2**70,
+            "ж",
+        ],
+    }
+    data = cbor_from_native(native)
+    jsonable = jsonable_from_native(native)
+    validate_cbor(data)
+    validate_cbor(cbor2.dumps(native["rows"], canonical=False))
+    validate_jsonable(jsonable)
+
+    def error(validate, data, limits=None):
+        with pytest.raises(ValidationError) as exc_info:
+            validate(data, limits)
+        return exc_info.value.message, exc_info.value.path
+
+    rows_data = cbor_from_native(native["rows"])
+    assert error(validate_cbor, rows_data[:-1]) == (
+        "Unexpected end of data",
+        [2, "when"],
+    )
+    assert error(validate_cbor, rows_data + b"\x00")[0].startswith("Extra data")
+    assert error(validate_cbor, b"\x82\x01\x63\xff\xfe\xfd")[1] == [1]
+    assert error(validate_cbor, cbor2.dumps([1, cbor2.CBORTag(1, "bad")]))[1] == [1]
+    assert error(validate_cbor, b"\x9b" + b"\xff" * 8) == (
+        "Unexpected end of data",
+        [],
+    )
+    assert error(validate_cbor, cbor2.dumps([[1]] * 3, value_sharing=True))
+    # reserved additional info and a broken indefinite-length byte string
+    for bad in (
+        b"\x81\x5c" + bytes(16),
+        b"\x81\x5d" + bytes(32),
+        b"\x81\x5f" + bytes(128),
+    ):
+        assert error(validate_cbor, bad)
+    for validate, doc, path in (
+        (validate_cbor, data, ["misc", 6]),
+        (validate_jsonable, jsonable, ["misc", 6, "$class_tag"]),
+    ):
+        assert error(validate, doc, ValidationLimits(class_tags={"#2"})) == (
+            'Class tag "#0" is not allowed',
+            path,
+        )
+        assert len(error(validate, doc, ValidationLimits(max_depth=2))[1]) == 2
+        assert error(validate, doc, ValidationLimits(max_items=5))[1] == ["misc"]
+        assert error(validate, doc, ValidationLimits(max_nodes=10))
+        assert error(validate, doc, ValidationLimits(max_string_length=20))
+    assert error(validate_cbor, data, ValidationLimits(max_size=100))
+
+    assert error(validate_jsonable, [{"$type": "date", "$value": "2020-13-01"}])[1] == [
+        0,
+        "$value",
+    ]
+    assert error(validate_jsonable, {"a": {"$type": "wat"}})[1] == ["a"]
+    assert error(validate_jsonable, {"$type": "map", "$value": [[1]]})
+    assert error(validate_jsonable, {"a": {1: 2}})
+    assert error(validate_jsonable, {"a": {1, 2}})
+
+
+def test_delta():
+    rows = [{"n": i, "name": f"row {i}", "tags": {"a", "b"}} for i in range(100)]
+    old_native = {"meta": {"version": 1}, "rows": rows}
+    new_rows = [dict(row) for row in rows]
+    new_rows[50]["name"] = "changed"
+    new_rows[70]["tags"] = {"a", "c"}
+    del new_rows[10]
+    new_rows.insert(30, {"n": -1})
+    new_native = {"meta": {"version": 1, "draft": True}, "rows": new_rows}
+    old = cbor_from_native(old_native)
+    new = cbor_from_native(new_native)
+
+    delta = cbor_delta(old, new)
+    assert len(delta) < len(new) // 10
+    assert apply_cbor_delta(old, delta) == new
+    assert jsonable_from_cbor(delta) == [
+        ["insert", ["meta", "draft"], True, 0],
+        ["delete", ["rows", 10]],
+        ["insert", ["rows", 30], {"n": -1}],
+        ["set", ["rows", 50, "name"], "changed"],
+        ["set", ["rows", 70, "tags", 1], "c"],  # into the set under tag 258
+    ]
+    # the JSON form converts back to a working delta
+    json_delta = json.loads(json.dumps(jsonable_from_cbor(delta)))
+    assert apply_cbor_delta(old, cbor_from_jsonable(json_delta)) == new
+
+    assert cbor_delta(old, old) == b"\x80"
+    assert apply_cbor_delta(old, cbor_delta(old, b"\x01")) == b"\x01"
+    fast_old = cbor_from_native(old_native, FAST_PROFILE)
+    fast_new = cbor_from_native(new_native, FAST_PROFILE)
+    patched = apply_cbor_delta(fast_old, cbor_delta(fast_old, fast_new))
+    assert native_from_cbor(patched) == new_native
+    with pytest.raises(ValueError):
+        apply_cbor_delta(old, cbor2.dumps([["set", ["rows", 500], 1]]))
+    with pytest.raises(ValueError):
+        apply_cbor_delta(old, cbor2.dumps([["delete", ["nope"]]]))
+
+
+def test_delta_nested_delete_under_map_key():
+    long = "long" * 7
+    old = cbor_from_native(
+        {"k4": [long, long], "k1": -4, 0: [long, b"x", b"xx", [], True]}
+    )
+    new = cbor_from_native({"k1": -4, 0: [long, b"x", [], True]})
+    delta = cbor_delta(old, new)
+    assert jsonable_from_cbor(delta) == [["delete", ["k4"]], ["delete", [0, 2]]]
+    assert apply_cbor_delta(old, delta) == new
+
+
+def test_delta_random_round_trip():
+    rnd = random.Random(44)
+    scalars = [0, -4, 7, 1.5, True, None, "s", "long" * 7, b"x", b"xx"]
+
+    def random_native(level=0):
+        choice = rnd.random()
+        if level > 3 or choice < 0.4:
+            return rnd.choice(scalars)
+        if choice < 0.7:
+            return [random_native(level + 1) for _ in range(rnd.randrange(6))]
+        keys = rnd.sample(["k1", "k2", "k3", "k4", 0, 1], rnd.randrange(6))
+        return {key: random_native(level + 1) for key in keys}
+
+    def mutate(native):
+        if isinstance(native, list):
+            result = [mutate(item) for item in native if rnd.random() > 0.2]
+            if rnd.random() < 0.3:
+                result.insert(rnd.randrange(len(result) + 1), random_native(2))
+            return result
+        if isinstance(native, dict):
+            result = {k: mutate(v) for k, v in native.items() if rnd.random() > 0.2}
+            if rnd.random() < 0.3:
+                result[rnd.choice(["k1", "k5", 2])] = random_native(2)
+            return result
+        return rnd.choice(scalars) if rnd.random() < 0.2 else native
+
+    for _ in range(2000):
+        old_native = random_native()
+        old = cbor_from_native(old_native)
+        new = cbor_from_native(mutate(old_native))
+        assert apply_cbor_delta(old, cbor_delta(old, new)) == new
+
+
+def test_content_hash():
+    record = {"id": 1, "name": "x", "score": 1.5, "ok": True, "data": b"z", "no": None}
+    # without nested containers the hash is the hash of canonical CBOR
+    assert content_hash(record) == custom_objects.HashSha256(
+        data=cbor_from_native(record)
+    )
+    assert content_hash(date(2020, 1, 2)) == custom_objects.HashSha256(
+        data=cbor_from_native(date(2020, 1, 2))
+    )
+    native = {"rows": [{"n": 1, "tags": {"a", "b"}}], "key": {(1, 2): "v"}}
+    same = {
+        "key": cbor2.FrozenDict({(1, 2): "v"}),
+        "rows": ({"tags": frozenset({"b", "a"}), "n": 1},),
+    }
+    assert content_hash(native) == content_hash(same)
+    assert content_hash(native, custom_objects.HashMd5) == content_hash(
+        same, custom_objects.HashMd5
+    )
+    native["rows"][0]["tags"].add("c")
+    assert content_hash(native) != content_hash(same)
+    looped: list = [1]
+    looped.append(looped)
+    with pytest.raises(ValueError):
+        content_hash(looped)
+
+    # unchanged frozen branches are not hashed again
+    doc = native_from_cbor(
+        cbor_from_native({"rows": [{"n": i, "tags": ["t"]} for i in range(10)]}),
+        frozen=True,
+    )
+    cache = DigestCache()
+    doc_hash = content_hash(doc, cache=cache)
+    assert cache.entries == 22  # the document, rows, records and their tags
+    rows = list(doc["rows"])
+    rows[3] = cbor2.FrozenDict({"n": 3, "tags": ("u",)})
+    changed = cbor2.FrozenDict({"rows": tuple(rows)})
+    changed_hash = content_hash(changed, cache=cache)
+    assert changed_hash != doc_hash
+    assert cache.hits == 9
+    assert changed_hash == content_hash(native_from_cbor(cbor_from_native(changed)))
+    assert native_from_cbor(cbor_from_native(changed_hash)) == changed_hash
+
+
+def test_passthrough():
+    # not canonical: the map keys are not sorted
+    unknown = cbor2.dumps(cbor2.CBORTag(5000, {"b": 1, "a": [1, 2]}))
+    unregistered = cbor2.dumps(cbor2.CBORTag(27, ["NoSuchClass", 1, b"x"]))
+    data = (
+        b"\xa2"
+        + cbor2.dumps("id")
+        + cbor2.dumps(7)
+        + cbor2.dumps("items")
+        + b"\x83"
+        + unknown
+        + unregistered
+        + cbor2.dumps({"n": 1})
+    )
+    native = native_from_cbor(data, passthrough=True)
+    assert native == {
+        "id": 7,
+        "items": [RawCbor(unknown), RawCbor(unregistered), {"n": 1}],
+    }
+    assert cbor_from_native(native, FAST_PROFILE) == data
+    native["id"] = 8
+    changed = cbor_from_native(native, FAST_PROFILE)
+    assert changed[changed.index(unknown) :].startswith(unknown + unregistered)
+    assert jsonable_from_native(native)["items"][0] == {
+        "$type": "tagged-value",
+        "$cbor_tag": 5000,
+        "$value": {"b": 1, "a": [1, 2]},
+    }
+    # registered classes and known tags are decoded as usual
+    known = cbor_from_native([custom_objects.HashMd5(data=b"x"), {1, 2}])
+    assert native_from_cbor(known, passthrough=True) == native_from_cbor(known)
+    frozen = native_from_cbor(data, frozen=True, passthrough=True)
+    assert frozen["items"][0] == RawCbor(unknown)
+    assert isinstance(native_from_cbor(data)["items"][0], cbor2.CBORTag)
+    # a registered custom object holding an unknown tag is kept raw as a whole
+    holder = cbor2.dumps(cbor2.CBORTag(27, ["#0", cbor2.CBORTag(5000, b"x")]))
+    native = native_from_cbor(b"\x82" + holder + b"\x01", passthrough=True)
+    assert native == [RawCbor(holder), 1]
+    # a reference to a shared value kept raw fails; no silent full decoding
+    shared = bytes.fromhex("a3616181d81c01616281d81d006163d9138801")
+    assert native_from_cbor(shared, passthrough=True)["b"] == [1]
+    with pytest.raises(cbor2.CBORDecodeError):
+        native_from_cbor(shared, passthrough=True, raw_paths=[("a",)])
+
+    # chosen subtrees are not decoded at all
+    envelope = cbor_from_native({"to": "b", "body": [{"n": 1}, {"n": 2}]})
+    native = native_from_cbor(envelope, raw_paths=[("body",)])
+    assert native == {
+        "to": "b",
+        "body": RawCbor(cbor_from_native([{"n": 1}, {"n": 2}])),
+    }
+    native = native_from_cbor(envelope, raw_paths=[("body", ...)])
+    assert native["body"] == [RawCbor(cbor_from_native({"n": i})) for i in (1, 2)]
+    assert cbor_from_native(native) == envelope
+    assert native_from_cbor(envelope, raw_paths=[("nope", 1)]) == native_from_cbor(
+        envelope
+    )
+
+
+def test_registry_snapshots():
+    class LateRegistered(SerializableToCbor):
+        cbor_cc_classtag = "late-registered"
+
+        def get_cbor_cc_values(self):
+            return [1]
+
+        def put_cbor_cc_values(self, *values):
+            self.values = values
+
+    cbor = cbor_from_native(LateRegistered())
+    assert isinstance(native_from_cbor(cbor), UnrecognizedCustomObject)
+
+    snapshot = _custom_objects_base.CUSTOM_CLASSES_BY_CLASSTAG
+    register_custom_class(LateRegistered)
+    register_custom_class(LateRegistered)  # no-op
+    assert "late-registered" not in snapshot  # readers' snapshots never change
+    assert isinstance(native_from_cbor(cbor), LateRegistered)
+
+
+def test_big_mime_payload():
+    body = b"Some text of a big attachment.\n" * 30_000
+    jsonable = {
+        "$type": "mime",
+        "$value": base64.encodebytes(b"\n" * 100_000 + body).decode(),
+    }
+    msg = native_from_jsonable(jsonable)  # was quadratic in leading newlines
+    assert msg.as_bytes().lstrip(b"\n") == body
+    assert native_from_cbor(cbor_from_native(msg)).as_bytes() == msg.as_bytes()
+    assert jsonable_from_native(msg)["$value"] == (
+        base64.encodebytes(msg.as_bytes()).decode().rstrip("\n")
+    )
+
+
+def _peak_memory(func, *args):
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_big_mime_payload_is_not_copied():
+    size = 4 << 20
+    body = (b"\n" * 1000 + b"Some text of a big attachment.\n" * size)[:size]
+    msg = native_from_jsonable(
+        {"$type": "mime", "$value": base64.encodebytes(body).decode()}
+    )
+    # Only the base64 text is added to what Message.as_bytes itself takes
+    assert _peak_memory(jsonable_from_native, msg) < _peak_memory(msg.as_bytes) * 1.1
+    jsonable = jsonable_from_native(msg)
+    # Decoded bytes plus the payload as Message keeps it, no stripped copy
+    assert _peak_memory(_cborable_from_jsonable, jsonable) < size * 2.2
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_BUDGET_US = 100_000  # generous; about 20 ms on a laptop
+LAZY_MODULES = [
+    "uuid",
+    "decimal",
+    "fractions",
+    "ipaddress",
+    "email.message",
+    "base58",
+    "hashlib",
+    "tempfile",
+    "concurrent.futures",
+    "cbor_json.custom_objects",
+]
+
+
+def test_import_time():
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import cbor_json"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=REPO_ROOT,
+    )
+    import_times = {}
+    for line in proc.stderr.splitlines()[1:]:  # skip the header
+        _, cumulative_us, name = line.split("|")
+        import_times[name.strip()] = int(cumulative_us)
+    assert import_times["cbor_json"] < IMPORT_TIME_BUDGET_US
+    assert not [mod for mod in LAZY_MODULES if mod in import_times]
+
+
+def test_lazy_imports():
+    script = """
+import sys, cbor_json
+assert not [mod for mod in %r if mod in sys.modules]
+# Custom class registered by the custom_objects module, not imported yet
+hashed = cbor_json.native_from_cbor(bytes.fromhex("d81b826123440102030a"))
+assert type(hashed).__name__ == "HashSha3_224", type(hashed)
+import uuid
+assert cbor_json.native_from_cbor(cbor_json.cbor_from_native(uuid.UUID(int=1))) == (
+    uuid.UUID(int=1)
+)
+assert cbor_json.native_from_jsonable({"$type": "decimal", "$value": "1.5"}) == 1.5
+assert cbor_json.custom_objects.HashSha3_224 is type(hashed)
+from cbor_json import *
+assert custom_objects is cbor_json.custom_objects
+assert RecordStore is cbor_json.RecordStore
+assert validate_cbor is cbor_json.validate_cbor
+""" % (
+        LAZY_MODULES,
+    )
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=REPO_ROOT)